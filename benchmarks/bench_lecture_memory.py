@@ -0,0 +1,131 @@
+# Resident memory and disk size of a semester of lectures, before and after the
+# compact lecture representation.
+#   before: lectures_cache entries holding the full decoded text (the old cache.txt layout)
+#           and a lecture index keeping every passage as plain text
+#   after:  LectureRecord metadata only, text compressed in the store, and
+#           compressed passage text in the lecture index
+# Run from the repository root: python benchmarks/bench_lecture_memory.py
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import LectureIndex, build_passages
+from store import ClassroomStore, LectureRecord
+
+# Sentences in the style of lecture slides, so the text compresses like the real thing
+SENTENCES = [
+    "A recursive function calls itself on a smaller input until it reaches a base case.",
+    "Every recursive call pushes a new frame onto the call stack.",
+    "A hash table maps keys to buckets with a hash function and resolves collisions by chaining.",
+    "Merge sort splits the array in half, sorts both halves and merges them in linear time.",
+    "The runtime of merge sort is O(n log n) in the best, average and worst case.",
+    "Quick sort picks a pivot and partitions the array around it.",
+    "A priority queue is usually implemented with a binary heap stored in an array.",
+    "Dynamic programming stores the answers to overlapping subproblems so each is solved once.",
+    "Dijkstra's algorithm finds shortest paths in a graph with non-negative edge weights.",
+    "A loop invariant is a property that holds before and after every iteration.",
+    "Proof by induction shows a base case and that each case implies the next.",
+    "Greedy algorithms make the locally best choice at each step.",
+]
+COURSES = 4
+LECTURES_PER_COURSE = 30
+SLIDES_PER_LECTURE = 60
+
+
+def make_lecture(rng) -> list:
+    slides = []
+    for slide in range(SLIDES_PER_LECTURE):
+        lines = [f"Slide {slide + 1}"] + [rng.choice(SENTENCES) for _ in range(rng.randint(4, 12))]
+        slides.append("\n".join(lines))
+    return slides
+
+
+# Bytes allocated (and still alive) while building what `build` returns
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, allocated, seconds
+
+
+def main():
+    rng = random.Random(1234)
+    corpus = [make_lecture(rng) for _ in range(COURSES * LECTURES_PER_COURSE)]
+    text_bytes = sum(len(page.encode('utf-8')) for slides in corpus for page in slides)
+    print(f"{len(corpus)} lectures, {text_bytes / (1024 * 1024):.1f} MB of text\n")
+
+    def before():
+        lectures_cache = {}
+        index = LectureIndex(os.path.join(directory, "before"), compress=False)
+        for lecture_id, slides in enumerate(corpus, 1):
+            content = "\n\n".join(slides)
+            lectures_cache[lecture_id] = {'filename': f"lecture{lecture_id}.pdf", 'filetype': 'pdf', 'content': content}
+            index.add_lecture(lecture_id, build_passages(content))
+        return lectures_cache, index
+
+    def after():
+        lectures_cache = {}
+        index = LectureIndex(os.path.join(directory, "after"), compress=True)
+        for lecture_id, slides in enumerate(corpus, 1):
+            for page_number, text in enumerate(slides, 1):
+                store.add_lecture_page(lecture_id, page_number, text)
+            store.add_lecture(lecture_id, f"lecture{lecture_id}.pdf", 'pdf')
+            lectures_cache[lecture_id] = LectureRecord(f"lecture{lecture_id}.pdf", 'pdf')
+            index.add_lecture(lecture_id, build_passages("\n\n".join(slides)))
+        store.flush()
+        return lectures_cache, index
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The store is opened outside the measurement so SQLite's page cache isn't counted
+        store = ClassroomStore(os.path.join(directory, "classroom.db"), content_cache_bytes=0)
+        (_, before_index), before_bytes, before_seconds = measure(before)
+        (_, after_index), after_bytes, after_seconds = measure(after)
+
+        # Reading lectures back: cold from the compressed store, then hot from the LRU
+        reader = ClassroomStore(os.path.join(directory, "classroom.db"))
+        start = time.perf_counter()
+        for lecture_id in range(1, 11):
+            reader.get_lecture_content(lecture_id)
+        cold_ms = (time.perf_counter() - start) / 10 * 1000
+        start = time.perf_counter()
+        for lecture_id in range(1, 11):
+            reader.get_lecture_content(lecture_id)
+        hot_ms = (time.perf_counter() - start) / 10 * 1000
+
+        start = time.perf_counter()
+        for _ in range(200):
+            before_index.search("how does merge sort split the array", 3)
+        before_search_ms = (time.perf_counter() - start) / 200 * 1000
+        start = time.perf_counter()
+        for _ in range(200):
+            after_index.search("how does merge sort split the array", 3)
+        after_search_ms = (time.perf_counter() - start) / 200 * 1000
+
+        asyncio.run(reader.close())
+        asyncio.run(store.close())
+        db_bytes = sum(
+            os.path.getsize(os.path.join(directory, name))
+            for name in os.listdir(directory) if name.startswith("classroom.db")
+        )
+
+    print(f"{'':<8} {'resident (MB)':>14} {'build (s)':>10} {'search (ms)':>12}")
+    print(f"{'before':<8} {before_bytes / (1024 * 1024):>14.1f} {before_seconds:>10.2f} {before_search_ms:>12.3f}")
+    print(f"{'after':<8} {after_bytes / (1024 * 1024):>14.1f} {after_seconds:>10.2f} {after_search_ms:>12.3f}")
+    print(f"\nStore on disk: {db_bytes / (1024 * 1024):.1f} MB for {text_bytes / (1024 * 1024):.1f} MB of text")
+    print(f"Lecture read: {cold_ms:.2f} ms from the store, {hot_ms:.3f} ms from the LRU")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Render time of one /cache and /questions page as the interaction log grows, against
+# building the whole listing the way /cache used to.
+# Run from the repository root: python benchmarks/bench_pagination.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clustering import QuestionClusters
+from pagination import Paginator, Section, list_lines, mapping_lines
+from store import LectureRecord
+
+TOPICS = [
+    "recursion", "pointers", "linked lists", "binary trees", "hash tables", "big o notation",
+    "dynamic programming", "graphs", "sorting", "heaps", "stacks", "queues", "closures",
+]
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+QUESTION_SIZES = [1_000, 5_000, 20_000]  # building the clusters is the slow part here, not rendering
+LECTURES = 200
+REPEATS = 200
+
+
+# Questions about many different terms, so they form many clusters of different sizes
+def make_questions(count: int, rng: random.Random) -> list:
+    terms = [rng.randrange(max(1, count // 4)) for _ in range(count)]
+    return [f"why does widget{term} break gadget{term}" for term in terms]
+
+
+def make_interactions(count: int, rng: random.Random) -> list:
+    return [
+        {
+            'user_id': str(rng.randrange(10_000)),
+            'question': f"how does {rng.choice(TOPICS)} work in assignment {rng.randrange(1000)}",
+            'response': "It works by " + "reducing the problem step by step " * 5,
+        }
+        for _ in range(count)
+    ]
+
+
+# The old /cache: format every lecture and interaction, then send the first 2000 characters at best
+def render_everything(lectures: dict, interactions: list) -> str:
+    lecture_info = "\n".join(f"ID: {id} - Filename: {lecture.filename} (Type: {lecture.filetype})"
+                             for id, lecture in lectures.items())
+    interaction_info = "\n".join(f"User: <@{entry['user_id']}> - Question: {entry['question']} - Response: {entry['response'][:50]}..."
+                                 for entry in interactions)
+    return "### Lectures in Memory:\n" + lecture_info + "\n\n### Interactions in Memory:\n" + interaction_info
+
+
+def cache_paginator(lectures: dict, interactions: list) -> Paginator:
+    def format_lecture(_, lecture_id, lecture):
+        return f"ID: {lecture_id} - Filename: {lecture.filename} (Type: {lecture.filetype})"
+
+    def format_interaction(_, entry):
+        return f"User: <@{entry['user_id']}> - Question: {entry['question']} - Response: {entry['response'][:50]}..."
+
+    return Paginator([
+        Section("### Lectures in Memory:", lambda: len(lectures), mapping_lines(lectures, format_lecture)),
+        Section("### Interactions in Memory:", lambda: len(interactions), list_lines(interactions, format_interaction)),
+    ], per_page=10)
+
+
+def questions_paginator(clusters: QuestionClusters) -> Paginator:
+    def format_clusters(start, stop):
+        for rank, cluster in enumerate(clusters.ranked(start, stop), start + 1):
+            question, *other_phrasings = cluster.representatives(3)
+            yield f"{rank}. {question} (Asked {cluster.count} times) Also asked as: " + "; ".join(other_phrasings)
+
+    return Paginator([Section("**Most Frequently Asked Questions:**", lambda: len(clusters), format_clusters)], per_page=5)
+
+
+def time_call(function, repeats: int = REPEATS) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    rng = random.Random(42)
+    lectures = {lecture_id: LectureRecord(f"lecture{lecture_id}.pdf", "pdf") for lecture_id in range(1, LECTURES + 1)}
+
+    print(f"/cache with {LECTURES} lectures, 10 items per page")
+    print(f"{'interactions':>12} {'full listing (ms)':>18} {'first page (ms)':>16} {'last page (ms)':>15}")
+    for size in SIZES:
+        interactions = make_interactions(size, rng)
+        paginator = cache_paginator(lectures, interactions)
+        last_page = paginator.page_count()
+        full = time_call(lambda: render_everything(lectures, interactions), repeats=max(1, 100_000 // size))
+        first = time_call(lambda: paginator.render(1))
+        last = time_call(lambda: paginator.render(last_page))
+        print(f"{size:>12} {full * 1000:>18.2f} {first * 1000:>16.3f} {last * 1000:>15.3f}")
+
+    print("\n/questions, 5 clusters per page")
+    print(f"{'questions':>12} {'clusters':>10} {'first page (ms)':>16} {'last page (ms)':>15}")
+    for size in QUESTION_SIZES:
+        clusters = QuestionClusters()
+        clusters.rebuild(make_questions(size, rng))
+        paginator = questions_paginator(clusters)
+        last_page = paginator.page_count()
+        first = time_call(lambda: paginator.render(1))
+        last = time_call(lambda: paginator.render(last_page))
+        print(f"{size:>12} {len(clusters):>10} {first * 1000:>16.3f} {last * 1000:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Retrieval latency of the BM25 lecture index as the lecture corpus grows.
+# Run from the repository root: python benchmarks/bench_retrieval.py
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import LectureIndex, build_passages
+
+VOCABULARY = [
+    "recursion", "base", "case", "stack", "frame", "pointer", "memory", "heap", "allocation",
+    "binary", "tree", "node", "leaf", "traversal", "graph", "edge", "vertex", "shortest", "path",
+    "hash", "table", "collision", "bucket", "sorting", "merge", "quick", "pivot", "complexity",
+    "runtime", "loop", "invariant", "proof", "induction", "array", "list", "queue", "priority",
+    "dynamic", "programming", "memoization", "greedy", "algorithm", "class", "object", "method",
+]
+QUERIES = [
+    "what is the base case in recursion",
+    "how does a hash table handle a collision",
+    "explain merge sort complexity",
+    "what is a priority queue",
+    "how do you find the shortest path in a graph",
+]
+SLIDES_PER_LECTURE = 60
+CORPUS_SIZES = [10, 100, 500]
+SEARCHES = 200
+
+
+def make_lecture(rng):
+    slides = []
+    for _ in range(SLIDES_PER_LECTURE):
+        words = [rng.choice(VOCABULARY) for _ in range(rng.randint(40, 120))]
+        slides.append(" ".join(words) + ".")
+    return "\n\n".join(slides)
+
+
+def main():
+    rng = random.Random(1234)
+    print(f"{'lectures':>9} {'passages':>9} {'index (s)':>10} {'search (ms)':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        index = LectureIndex(directory)
+        lecture_count = 0
+        build_seconds = 0.0
+        for size in CORPUS_SIZES:
+            start = time.perf_counter()
+            while lecture_count < size:
+                lecture_count += 1
+                index.add_lecture(lecture_count, build_passages(make_lecture(rng)))
+            build_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for i in range(SEARCHES):
+                index.search(QUERIES[i % len(QUERIES)], 3)
+            search_ms = (time.perf_counter() - start) / SEARCHES * 1000
+            print(f"{size:>9} {len(index.passages):>9} {build_seconds:>10.2f} {search_ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Lookup latency of the similarity index against the old linear fuzz.ratio scan.
+# Run from the repository root: python benchmarks/bench_similarity.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fuzzywuzzy import fuzz
+
+from similarity import QuestionIndex
+
+TOPICS = [
+    "recursion", "pointers", "linked lists", "binary trees", "hash tables", "big o notation",
+    "dynamic programming", "graphs", "sorting", "heaps", "stacks", "queues", "closures",
+    "inheritance", "polymorphism", "interfaces", "generics", "exceptions", "threads", "sockets",
+]
+TEMPLATES = [
+    "what is {} used for in assignment {}",
+    "can you explain {} with an example from lab {}",
+    "why does my {} code fail on test case {}",
+    "how do i implement {} for homework {}",
+    "what is the difference between {} and {} in chapter {}",
+]
+# Questions nobody asked before; these are the worst case for the linear scan
+NOVEL_QUESTIONS = [
+    "when is the midterm review session scheduled",
+    "are office hours moved to the library this friday",
+    "could the grading rubric for the final project be posted",
+    "is attendance mandatory during the guest lecture week",
+]
+SIZES = [1_000, 10_000, 100_000]
+LOOKUPS = 200
+
+
+def make_question(rng):
+    template = rng.choice(TEMPLATES)
+    slots = template.count("{}")
+    values = [rng.choice(TOPICS) for _ in range(slots - 1)] + [rng.randint(1, 500)]
+    return template.format(*values)
+
+
+def linear_lookup(entries, new_question, threshold=60):
+    for entry in entries:
+        if fuzz.ratio(entry['question'].lower(), new_question.lower()) >= threshold:
+            return entry['response']
+    return None
+
+
+def time_lookups(lookup, queries):
+    start = time.perf_counter()
+    for query in queries:
+        lookup(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    rng = random.Random(1234)
+    print(f"{'questions':>10} {'build (s)':>10} {'index hit (ms)':>15} {'index miss (ms)':>16} "
+          f"{'linear hit (ms)':>16} {'linear miss (ms)':>17}")
+    for size in SIZES:
+        entries = [{'question': make_question(rng), 'response': 'answer'} for _ in range(size)]
+        hits = [make_question(rng) for _ in range(LOOKUPS)]
+        misses = [rng.choice(NOVEL_QUESTIONS) + f" {rng.randint(1, 9)}" for _ in range(LOOKUPS)]
+
+        start = time.perf_counter()
+        index = QuestionIndex()
+        index.rebuild(entries)
+        build_seconds = time.perf_counter() - start
+
+        index_hit_ms = time_lookups(index.best_match, hits)
+        index_miss_ms = time_lookups(index.best_match, misses)
+        # The linear scan is too slow to run every query at the larger sizes
+        sample = max(1, 20_000 // size)
+        linear_hit_ms = time_lookups(lambda q: linear_lookup(entries, q), hits[:sample])
+        linear_miss_ms = time_lookups(lambda q: linear_lookup(entries, q), misses[:sample])
+        print(f"{size:>10} {build_seconds:>10.2f} {index_hit_ms:>15.3f} {index_miss_ms:>16.3f} "
+              f"{linear_hit_ms:>16.3f} {linear_miss_ms:>17.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+# Offline load test of the bot's command handlers.
+# Runs /say, /summary, /new_lecture, /sayiac and DM questions (on_message) against
+# fake Discord interactions, with OpenAI calls sent to a local stub server, and
+# reports commands/sec, p50/p99 latency per command and memory growth.
+# Nothing connects to Discord or OpenAI.
+#
+# Run from the repository root: python benchmarks/loadtest.py --commands 500 --concurrency 50
+import argparse
+import asyncio
+import gc
+import importlib
+import io
+import itertools
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+import docx
+from PIL import Image, ImageDraw
+
+from metrics import LatencyTracker
+from stub_openai import StubOpenAI
+
+QUESTIONS = [
+    "What is recursion?",
+    "How does a hash table handle collisions?",
+    "Explain the base case in recursion",
+    "What is the runtime of merge sort?",
+    "How is a priority queue implemented?",
+    "What is dynamic programming?",
+    "How do you find the shortest path in a graph?",
+    "What is the difference between a stack and a queue?",
+]
+DEFAULT_MIX = "say=60,dm=20,sayiac=10,summary=7,new_lecture=3"
+
+
+# --- Fake Discord objects: just the attributes and coroutines the handlers use ---
+
+class FakeRole:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeUser:
+    def __init__(self, user_id: int, professor: bool = False):
+        self.id = user_id
+        self.name = self.display_name = f"student{user_id}"
+        self.bot = False
+        self.roles = [FakeRole("Professor")] if professor else []
+
+
+class FakeAttachment:
+    def __init__(self, attachment_id: int, filename: str, data: bytes, url: str):
+        self.id = attachment_id
+        self.filename = filename
+        self.size = len(data)
+        self.url = url
+        self._data = data
+
+    async def read(self) -> bytes:
+        return self._data
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, channel, content: str = "", author=None, attachments=()):
+        self.id = next(self._ids)
+        self.channel = channel
+        self.content = content
+        self.author = author
+        self.attachments = list(attachments)
+        self.guild = channel.guild
+        self.edits = 0
+
+    async def edit(self, content: str = None, **kwargs):
+        if content is not None:
+            self.content = content
+        self.edits += 1
+        return self
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, name: str, guild=None):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.messages = []
+
+    async def send(self, content: str = "", **kwargs):
+        message = FakeMessage(self, content)
+        self.messages.append(message)
+        del self.messages[:-50]  # keep the history short, like a real channel fetch
+        return message
+
+    async def history(self, limit: int = 100):
+        for message in reversed(self.messages[-limit:]):
+            yield message
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = 1
+        self.text_channels = [FakeChannel(100, "lecture", self), FakeChannel(101, "general", self)]
+        self.roles = [FakeRole("Professor")]
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content: str = "", **kwargs):
+        self._done = True
+        self.interaction.original = await self.interaction.channel.send(content)
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content: str = "", wait: bool = False, **kwargs):
+        return await self.interaction.channel.send(content)
+
+
+class FakeInteraction:
+    def __init__(self, user, channel, guild=None):
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = guild
+        self.created_at = discord.utils.utcnow()
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.original = None
+
+    async def edit_original_response(self, content: str = None, **kwargs):
+        if self.original is not None:
+            await self.original.edit(content=content)
+
+
+# --- Fixtures served by the stub server ---
+
+def make_lecture_docx(paragraphs: int = 200) -> bytes:
+    rng = random.Random(42)
+    words = " ".join(QUESTIONS).lower().replace("?", "").split()
+    document = docx.Document()
+    for _ in range(paragraphs):
+        document.add_paragraph(" ".join(rng.choice(words) for _ in range(60)) + ".")
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_slide_png() -> bytes:
+    image = Image.new("RGB", (1600, 900), "white")
+    draw = ImageDraw.Draw(image)
+    for line, text in enumerate(QUESTIONS):
+        draw.text((80, 80 + line * 90), text, fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        # No /proc (macOS): fall back to the peak RSS, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+class LoadTest:
+    def __init__(self, bot, stub: StubOpenAI, args):
+        self.bot = bot
+        self.stub = stub
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latency = LatencyTracker(max_samples=args.commands)
+        self.failures = Counter()
+        self.guild = FakeGuild()
+        self.lecture_channel = self.guild.text_channels[0]
+        self.students = [FakeUser(1000 + i) for i in range(args.users)]
+        self.professor = FakeUser(1, professor=True)
+        self.dm_channels = {}
+        self.attachment_ids = itertools.count(1)
+        self.pending = {}  # id of the interaction or message answered by the queue -> future
+
+        # Queued answers (DMs, /sayiac) finish in a queue worker, so wrap the handler to see when
+        original_handler = bot.question_queue.handler
+
+        async def handler(question, source, *args):
+            try:
+                await original_handler(question, source, *args)
+            finally:
+                future = self.pending.pop(id(source), None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+        bot.question_queue.handler = handler
+
+        # The bot only has slash commands, and prefix command parsing needs a real connection state
+        async def process_commands(message):
+            pass
+
+        bot.bot.process_commands = process_commands
+
+    def dm_channel(self, user) -> FakeChannel:
+        if user.id not in self.dm_channels:
+            self.dm_channels[user.id] = FakeChannel(10_000 + user.id, f"dm-{user.id}")
+        return self.dm_channels[user.id]
+
+    def question(self) -> str:
+        question = self.rng.choice(QUESTIONS)
+        if self.rng.random() < self.args.unique:
+            question += f" (case {self.rng.randrange(1_000_000)})"
+        return question
+
+    def lecture_attachment(self) -> FakeAttachment:
+        data = self.stub.files["lecture.docx"]
+        return FakeAttachment(next(self.attachment_ids), "lecture.docx", data, f"{self.stub.base_url}/files/lecture.docx")
+
+    async def wait_for_queue(self, source):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[id(source)] = future
+        try:
+            await asyncio.wait_for(future, self.args.timeout)
+        finally:
+            self.pending.pop(id(source), None)
+
+    async def run_say(self):
+        user = self.rng.choice(self.students)
+        interaction = FakeInteraction(user, self.guild.text_channels[1], self.guild)
+        await self.bot.say.callback(interaction, message=self.question())
+
+    async def run_dm(self):
+        user = self.rng.choice(self.students)
+        channel = self.dm_channel(user)
+        message = FakeMessage(channel, self.question(), author=user)
+        rejected_before = self.bot.question_queue.rejected
+        future = asyncio.get_running_loop().create_future()
+        self.pending[id(message)] = future
+        await self.bot.on_message(message)
+        if self.bot.question_queue.rejected != rejected_before:
+            self.pending.pop(id(message), None)
+            raise RuntimeError("queue full")
+        try:
+            await asyncio.wait_for(future, self.args.timeout)
+        finally:
+            self.pending.pop(id(message), None)
+
+    async def run_sayiac(self):
+        user = self.rng.choice(self.students)
+        interaction = FakeInteraction(user, self.guild.text_channels[1], self.guild)
+        rejected_before = self.bot.question_queue.rejected
+        messages = interaction.channel.messages
+        last_seen_id = messages[-1].id if messages else 0
+        waiter = asyncio.ensure_future(self.wait_for_queue(interaction))
+        await self.bot.sayiac.callback(interaction, message=self.question())
+        # The handler returns at once and OCRs in a background task, so follow the reply instead.
+        # Other commands post to the same channel, so look at every message since this one started.
+        while not waiter.done():
+            if self.bot.question_queue.rejected != rejected_before:
+                waiter.cancel()
+                raise RuntimeError("queue full")
+            for message in interaction.channel.messages:
+                if message.id > last_seen_id and message.content.startswith(("Could not read the image", "No image found", "Lecture channel not found")):
+                    waiter.cancel()
+                    raise RuntimeError(message.content)
+            await asyncio.sleep(0.01)
+        await waiter
+
+    async def run_summary(self):
+        interaction = FakeInteraction(self.professor, self.guild.text_channels[1], self.guild)
+        lecture_id = self.rng.choice(list(self.bot.lectures_cache))
+        await self.bot.summary.callback(interaction, lecture_id)
+
+    async def run_new_lecture(self):
+        interaction = FakeInteraction(self.professor, self.guild.text_channels[1], self.guild)
+        await self.bot.store_lecture.callback(interaction, self.lecture_attachment())
+        if "stored successfully" not in interaction.channel.messages[-1].content:
+            raise RuntimeError(interaction.channel.messages[-1].content)
+
+    async def run_command(self, name: str):
+        start = time.perf_counter()
+        try:
+            await getattr(self, f"run_{name}")()
+        except Exception as e:
+            self.failures[f"{name}: {type(e).__name__}: {e}"[:120]] += 1
+            self.latency.record(f"{name}:failed", time.perf_counter() - start)
+        else:
+            self.latency.record(name, time.perf_counter() - start)
+
+    # Seed one lecture and one slide image so /summary and /sayiac have something to work on
+    async def prepare(self):
+        await self.run_new_lecture()
+        slide = FakeAttachment(next(self.attachment_ids), "slide.png", self.stub.files["slide.png"],
+                               f"{self.stub.base_url}/files/slide.png")
+        message = FakeMessage(self.lecture_channel, "", author=self.professor, attachments=[slide])
+        self.lecture_channel.messages.append(message)
+        await self.bot.on_message(message)
+        # Let the seed lecture's background jobs finish, so /summary is measured as a lookup
+        deadline = time.perf_counter() + self.args.timeout
+        while {'pending', 'running'} & set(self.bot.store.lecture_job_counts()) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        self.latency = LatencyTracker(max_samples=self.args.commands)
+
+    async def run(self):
+        weights = parse_mix(self.args.mix)
+        names = self.rng.choices(list(weights), weights=list(weights.values()), k=self.args.commands)
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(name):
+            async with semaphore:
+                await self.run_command(name)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(name) for name in names))
+        return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the bot's command handlers.")
+    parser.add_argument("--commands", type=int, default=300, help="number of commands to run")
+    parser.add_argument("--concurrency", type=int, default=30, help="commands in flight at once")
+    parser.add_argument("--users", type=int, default=50, help="number of simulated students")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="command weights, e.g. say=60,dm=20")
+    parser.add_argument("--unique", type=float, default=0.5, help="share of questions not asked before")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub OpenAI latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of OpenAI requests that fail")
+    parser.add_argument("--answer-words", type=int, default=120, help="length of each stub answer")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for a queued answer")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    stub = StubOpenAI(latency=args.latency, error_rate=args.error_rate, answer_words=args.answer_words)
+    stub.files["lecture.docx"] = make_lecture_docx()
+    stub.files["slide.png"] = make_slide_png()
+    base_url = await stub.start()
+
+    # The bot reads its settings at import time, so configure it before importing it.
+    # Everything it writes (store, lecture index) goes to a scratch directory.
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name)
+    os.environ.update({
+        'OPENAI_BASE_URL': f"{base_url}/v1",
+        'OPENAI_API_KEY': 'stub',
+        'METRICS_PORT': '0',
+        'STORE_PATH': os.path.join(workdir.name, 'classroom.db'),
+    })
+    # Every /say answer streams into the same fake channel, which Discord would slow down far more than
+    # the bot; lift the per-channel edit budget unless it is set, so the run measures the bot itself
+    os.environ.setdefault('STREAM_EDITS_PER_CHANNEL', '100000')
+    bot = importlib.import_module("bot")
+    bot.store.start()
+    bot.load_cache_from_store()
+    await bot.question_queue.start()
+    await bot.lecture_jobs.start()
+
+    load_test = LoadTest(bot, stub, args)
+    try:
+        await load_test.prepare()
+        gc.collect()
+        rss_start = rss_mb()
+        elapsed = await load_test.run()
+        gc.collect()
+        rss_end = rss_mb()
+        # The runner only counts jobs every poll interval, so take a fresh count for the report
+        lecture_job_counts = await asyncio.to_thread(bot.store.lecture_job_counts)
+    finally:
+        await bot.question_queue.stop()
+        await bot.lecture_jobs.stop()
+        bot.extractor.shutdown()
+        await bot.store.close()
+        await bot.openai_client.close()
+        await stub.stop()
+        os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        workdir.cleanup()
+
+    completed = sum(load_test.latency.counts.values())
+    print(f"\n{completed} commands in {elapsed:.2f}s: {completed / elapsed:.1f} commands/sec "
+          f"(concurrency {args.concurrency}, stub latency {args.latency * 1000:.0f}ms, "
+          f"error rate {args.error_rate:.0%})")
+    print(f"\n{'command':<22} {'count':>6} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for name in sorted(load_test.latency.counts):
+        print(f"{name:<22} {load_test.latency.counts[name]:>6} "
+              f"{load_test.latency.percentile(name, 50) * 1000:>9.0f} "
+              f"{load_test.latency.percentile(name, 99) * 1000:>9.0f}")
+    print(f"\nMemory: {rss_start:.1f} MB -> {rss_end:.1f} MB RSS ({rss_end - rss_start:+.1f} MB)")
+    print(f"Stub OpenAI: {stub.requests} requests, {stub.errors} failed on purpose, "
+          f"{stub.max_concurrent} at most in flight")
+    print("Background lecture jobs: " + ", ".join(f"{status}={count}" for status, count in sorted(lecture_job_counts.items()))
+          + f" (this worker: completed={bot.lecture_jobs.completed} failed={bot.lecture_jobs.failed})")
+    print(f"OpenAI dispatcher: {bot.openai_client.dispatcher.stats()}")
+    print(f"OpenAI tokens: {bot.openai_client.total_tokens('prompt_tokens')} input, "
+          f"{bot.openai_client.total_tokens('completion_tokens')} output")
+    print(f"Answer cache: hit rate {bot.response_cache.hit_rate() * 100:.1f}%")
+    print(f"Shared answers: {bot.answer_coalescer.stats()}")
+    if load_test.failures:
+        print("\nFailures:")
+        for failure, count in load_test.failures.most_common(10):
+            print(f"{count:>6}  {failure}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+# Local stand-in for the OpenAI chat completions API, used by the load tests.
+# Answers after a configurable latency, fails a configurable share of requests
+# with 429/500, streams answers as server-sent events when asked to, and also
+# serves fixture files under /files/ so attachments can be "downloaded" from it.
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+ANSWER_WORDS = (
+    "Recursion solves a problem by reducing it to a smaller instance of the same problem "
+    "until it reaches a base case that can be answered directly. For example, factorial(n) "
+    "returns 1 when n is 0 and otherwise returns n * factorial(n - 1)."
+).split()
+
+
+class StubOpenAI:
+    def __init__(self, latency: float = 0.5, jitter: float = 0.5, error_rate: float = 0.0,
+                 answer_words: int = 120, stream_chunk_words: int = 8, seed: int = 1234):
+        self.latency = latency
+        self.jitter = jitter  # latency varies uniformly by +/- this fraction
+        self.error_rate = error_rate
+        self.answer_words = answer_words
+        self.stream_chunk_words = stream_chunk_words
+        self.files = {}  # name -> bytes served at /files/<name>
+        self.requests = 0
+        self.errors = 0
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._rng = random.Random(seed)
+        self._runner = None
+        self.base_url = None
+
+    def _answer(self) -> str:
+        return " ".join(ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(self.answer_words))
+
+    async def _wait(self):
+        spread = self.latency * self.jitter
+        await asyncio.sleep(max(0.0, self.latency + self._rng.uniform(-spread, spread)))
+
+    async def handle_chat(self, request):
+        self.requests += 1
+        self._concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        try:
+            payload = await request.json()
+            if self._rng.random() < self.error_rate:
+                self.errors += 1
+                status = self._rng.choice((429, 500))
+                return web.json_response(
+                    {'error': {'message': 'stub error'}}, status=status, headers={'retry-after-ms': '50'}
+                )
+
+            await self._wait()
+            answer = self._answer()
+            # Roughly four characters per token, like the bot's own estimate
+            usage = {
+                'prompt_tokens': sum(len(message.get('content') or '') for message in payload.get('messages', [])) // 4,
+                'completion_tokens': len(answer) // 4,
+            }
+            if not payload.get('stream'):
+                return web.json_response({'choices': [{'message': {'role': 'assistant', 'content': answer}}], 'usage': usage})
+
+            response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+            await response.prepare(request)
+            words = answer.split()
+            for start in range(0, len(words), self.stream_chunk_words):
+                chunk = " ".join(words[start:start + self.stream_chunk_words]) + " "
+                event = {'choices': [{'delta': {'content': chunk}}]}
+                await response.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                await asyncio.sleep(0)
+            if (payload.get('stream_options') or {}).get('include_usage'):
+                await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode('utf-8'))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+        finally:
+            self._concurrent -= 1
+
+    async def handle_file(self, request):
+        data = self.files.get(request.match_info['name'])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.handle_chat)
+        app.router.add_get('/files/{name}', self.handle_file)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
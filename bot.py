@@ -1,47 +1,271 @@
 import os
 import discord
+from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 import asyncio
-import aiohttp
-from io import BytesIO
-import pdfplumber  
-import docx  
-from pptx import Presentation  
-from fuzzywuzzy import fuzz
-from collections import deque
-from PIL import Image
-import pytesseract
-import io
-from cachetools import TTLCache
-import pytesseract
-import atexit
-import json
+import socket
+import time
+import types
+from typing import Optional
+from openai_client import OpenAIClient
+from dispatcher import RateLimitDispatcher
+from summarizer import SUMMARY_ERROR_MESSAGE, Summarizer
+from scheduler import QuestionScheduler, SharedQuestionScheduler
+from jobs import LectureJobRunner
+from extraction import (
+    ExtractionExecutor, ExtractionError, is_archive, is_supported_document, spool_attachment, unpack_archive,
+)
+from retrieval import LectureIndex, build_passages
+from store import ClassroomStore, LectureRecord
+from streaming import EditBudget, StreamingReply
+from response_cache import ResponseCache
+from clustering import QuestionClusters
+from lifecycle import Lifecycle, read_json, write_json_atomic
+from coalescing import AnswerCoalescer
+from conversations import ConversationMemory, looks_like_followup
+from prompts import PromptBuilder
+from pagination import Paginator, Section, list_lines, mapping_lines, send_page
+from ocr_cache import LatestImages, OcrCache
+from metrics import LatencyTracker, LoopLagMonitor, MetricsRegistry, SamplingProfiler
 
 load_dotenv()  # Load environment variables from .env file
 
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+OPENAI_FAST_MODEL = os.getenv('OPENAI_FAST_MODEL', '')  # e.g. "gpt-4o-mini" for short prompts, empty to always use OPENAI_MODEL
+OPENAI_FAST_MODEL_MAX_TOKENS = int(os.getenv('OPENAI_FAST_MODEL_MAX_TOKENS', '400'))
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')  # point at a local stub for load tests
+
+# Connection pool settings for the shared OpenAI client
+OPENAI_POOL_LIMIT = int(os.getenv('OPENAI_POOL_LIMIT', '20'))
+OPENAI_POOL_LIMIT_PER_HOST = int(os.getenv('OPENAI_POOL_LIMIT_PER_HOST', '10'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '120'))
+
+# OpenAI flow control: concurrency starts at OPENAI_CONCURRENCY and adapts to the account's rate limits
+OPENAI_CONCURRENCY = int(os.getenv('OPENAI_CONCURRENCY', '3'))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '32'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '5'))
+
+# Lecture summarization settings
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '2000'))
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '4'))
+
+# Background question queue settings
+QUEUE_WORKERS = int(os.getenv('QUEUE_WORKERS', '3'))
+QUEUE_MAX_DEPTH = int(os.getenv('QUEUE_MAX_DEPTH', '100'))
+QUEUE_MAX_PER_USER = int(os.getenv('QUEUE_MAX_PER_USER', '5'))
+QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'local')  # "local", or "shared" to queue questions in the store for every worker process
+QUEUE_POLL_INTERVAL = float(os.getenv('QUEUE_POLL_INTERVAL', '1'))
+QUEUE_CLAIM_TIMEOUT = float(os.getenv('QUEUE_CLAIM_TIMEOUT', '600'))  # seconds before a dead worker's question is answered by another
+
+# Sharding: SHARD_COUNT > 0 runs an AutoShardedBot, SHARD_IDS picks this process's shards (e.g. "0,1"; empty means all)
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()]
+
+# Name of this process in the shared store, so it can tell its own writes from other workers'.
+# It must stay the same across restarts: on start a worker hands back the questions and lecture
+# jobs it had claimed, which otherwise wait out their claim timeout after a crash. The default
+# suits one process per host; give each process its own WORKER_ID when running several.
+WORKER_ID = os.getenv('WORKER_ID', socket.gethostname())
+
+# Document and image extraction settings
+EXTRACTION_EXECUTOR = os.getenv('EXTRACTION_EXECUTOR', 'process')  # "process" or "thread"
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '2'))
+EXTRACTION_CONCURRENCY = int(os.getenv('EXTRACTION_CONCURRENCY', '2'))
+EXTRACTION_MAX_MB = int(os.getenv('EXTRACTION_MAX_MB', '50'))
+EXTRACTION_MAX_PAGES = int(os.getenv('EXTRACTION_MAX_PAGES', '500'))
+EXTRACTION_TIMEOUT = float(os.getenv('EXTRACTION_TIMEOUT', '120'))
+EXTRACTION_BATCH_PAGES = int(os.getenv('EXTRACTION_BATCH_PAGES', '10'))
+OCR_RESOLUTION = int(os.getenv('OCR_RESOLUTION', '200'))  # DPI for OCR of image-only PDF pages, 0 disables it
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', '2000'))  # images are downscaled to this many pixels before OCR
+OCR_BINARIZE = os.getenv('OCR_BINARIZE', '1') == '1'
+OCR_CACHE_ENTRIES = int(os.getenv('OCR_CACHE_ENTRIES', '512'))
+
+# Bulk lecture import (/import_lectures)
+IMPORT_MAX_FILES = int(os.getenv('IMPORT_MAX_FILES', '20'))  # documents taken from each .zip archive
+IMPORT_MAX_MB = int(os.getenv('IMPORT_MAX_MB', '200'))  # per .zip archive, and for everything unpacked from it
+
+# Background jobs precomputing each new lecture's summary and keywords
+LECTURE_JOB_WORKERS = int(os.getenv('LECTURE_JOB_WORKERS', '1'))
+LECTURE_JOB_POLL_INTERVAL = float(os.getenv('LECTURE_JOB_POLL_INTERVAL', '5'))
+LECTURE_JOB_CLAIM_TIMEOUT = float(os.getenv('LECTURE_JOB_CLAIM_TIMEOUT', '1800'))  # seconds before a dead worker's job is run by another
+LECTURE_JOB_MAX_ATTEMPTS = int(os.getenv('LECTURE_JOB_MAX_ATTEMPTS', '3'))
+LECTURE_KEYWORDS = int(os.getenv('LECTURE_KEYWORDS', '10'))
+
+# Number of lecture passages sent to ChatGPT as context for each question
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+
+# Token budget for question prompts: the whole prompt, and the most the question and image text may take of it
+PROMPT_MAX_TOKENS = int(os.getenv('PROMPT_MAX_TOKENS', '6000'))
+PROMPT_QUESTION_MAX_TOKENS = int(os.getenv('PROMPT_QUESTION_MAX_TOKENS', '1000'))
+PROMPT_IMAGE_MAX_TOKENS = int(os.getenv('PROMPT_IMAGE_MAX_TOKENS', '1500'))
+
+# Lecture and interaction storage; queued writes are committed every STORE_FLUSH_INTERVAL seconds
+STORE_PATH = os.getenv('STORE_PATH', 'classroom.db')
+STORE_FLUSH_INTERVAL = float(os.getenv('STORE_FLUSH_INTERVAL', '2'))
+STORE_REFRESH_INTERVAL = float(os.getenv('STORE_REFRESH_INTERVAL', '5'))  # seconds between checks for other workers' writes, 0 disables
+STORE_CONTENT_CACHE_MB = int(os.getenv('STORE_CONTENT_CACHE_MB', '16'))  # recently used lecture texts kept decompressed
+STORE_MMAP_MB = int(os.getenv('STORE_MMAP_MB', '256'))
+
+# Minimum seconds between edits of a streamed answer (Discord limits message edits), and how many
+# messages every answer streaming into one channel may send or edit together per STREAM_EDIT_WINDOW seconds
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))
+STREAM_EDITS_PER_CHANNEL = int(os.getenv('STREAM_EDITS_PER_CHANNEL', '5'))
+STREAM_EDIT_WINDOW = float(os.getenv('STREAM_EDIT_WINDOW', '5'))
+
+# Answer cache settings
+RESPONSE_CACHE_MB = int(os.getenv('RESPONSE_CACHE_MB', '32'))
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv('RESPONSE_CACHE_TTL_HOURS', '168'))
+SIMILARITY_THRESHOLD = int(os.getenv('SIMILARITY_THRESHOLD', '60'))
+
+# /say questions share the answer of the same question already being answered (same words, ignoring case
+# and punctuation). Set a similarity (0-100) to also share it with near-identical wordings; the shared answer
+# is posted without a notice, so keep it high.
+COALESCE_SIMILARITY_THRESHOLD = int(os.getenv('COALESCE_SIMILARITY_THRESHOLD', '0'))
+
+# Cosine similarity a question needs to join an existing frequent-question cluster
+QUESTION_CLUSTER_THRESHOLD = float(os.getenv('QUESTION_CLUSTER_THRESHOLD', '0.6'))
+
+# Conversation memory: recent turns per conversation, idle conversations expire and all of them share a token cap
+CONVERSATION_MAX_TURNS = int(os.getenv('CONVERSATION_MAX_TURNS', '6'))  # 0 turns conversation memory off
+CONVERSATION_MAX_TOKENS = int(os.getenv('CONVERSATION_MAX_TOKENS', '1500'))
+CONVERSATION_TTL_MINUTES = float(os.getenv('CONVERSATION_TTL_MINUTES', '30'))
+CONVERSATION_MEMORY_TOKENS = int(os.getenv('CONVERSATION_MEMORY_TOKENS', '2000000'))
+# Remember server conversations (/say, /sayiac) too, not just DMs. Only questions that look like
+# follow-ups (see looks_like_followup) skip the answer cache and sharing another student's request.
+CONVERSATION_IN_SERVER = os.getenv('CONVERSATION_IN_SERVER', '1') == '1'
+
+# Items per page of /cache and /list (/questions takes its page size as top_n)
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '10'))
+
+# Warm-start snapshot of state that is slow to rebuild, and graceful shutdown
+STATE_SNAPSHOT_PATH = os.getenv('STATE_SNAPSHOT_PATH', 'state_snapshot.json')
+STATE_SNAPSHOT_INTERVAL = float(os.getenv('STATE_SNAPSHOT_INTERVAL', '300'))  # seconds between snapshots, 0 disables them
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '8'))  # keep it under the supervisor's kill timeout (10s for docker stop)
+
+# Local Prometheus-style metrics endpoint (METRICS_PORT=0 turns it off)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Reply sent when the question queue is full
+BUSY_MESSAGE = "I'm busy answering other questions right now. Please try again in a minute."
+
+# Returned by ask_openai when ChatGPT could not be reached
+OPENAI_ERROR_MESSAGE = "There was an error contacting ChatGPT."
+
+# Startup timing, background loops and draining queued work on SIGTERM
+lifecycle = Lifecycle(drain_timeout=SHUTDOWN_DRAIN_TIMEOUT)
 
 intents = discord.Intents.default()
 intents.message_content = True  # Allow bot to read message content
 intents.messages = True  # Allow bot to listen for messages
 
+# Notes when each slash command reached this process, by its own clock, so command latency
+# doesn't depend on how far Discord's timestamps are from the local clock
+class TimedCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['received_at'] = time.perf_counter()
+        return True
 
-bot = commands.Bot(command_prefix='/', intents=intents)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='/', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None,
+                                  tree_cls=TimedCommandTree)
+else:
+    bot = commands.Bot(command_prefix='/', intents=intents, tree_cls=TimedCommandTree)
 
 # Name of the admin role
 ADMIN_ROLE_NAME = "Professor"
 
-# In-memory caches
+# Persistent store for lectures and interactions
+store = ClassroomStore(
+    STORE_PATH,
+    flush_interval=STORE_FLUSH_INTERVAL,
+    worker_id=WORKER_ID,
+    content_cache_bytes=STORE_CONTENT_CACHE_MB * 1024 * 1024,
+    mmap_bytes=STORE_MMAP_MB * 1024 * 1024,
+)
+
+# In-memory caches (LectureRecord metadata only, bodies are loaded from the store on demand)
 lectures_cache = {}
 interactions_cache = []
 
-# Queue to handle incoming messages
-question_queue = deque()
-
-# Semaphore to limit the number of concurrent API requests
-semaphore = asyncio.Semaphore(3)  # Limit to 3 concurrent requests
+# How far the in-memory caches have caught up with the store, for picking up other workers' writes
+store_sync = {'data_version': None, 'generation': None, 'last_interaction_id': 0}
+# Held while catching up, so the refresh loop and a lecture job never load the same interactions twice
+store_refresh_lock = asyncio.Lock()
+
+# Exact and similar-question answer cache, invalidated when the lectures behind an answer change
+response_cache = ResponseCache(
+    max_bytes=RESPONSE_CACHE_MB * 1024 * 1024,
+    ttl=RESPONSE_CACHE_TTL_HOURS * 3600,
+    similarity_threshold=SIMILARITY_THRESHOLD,
+    error_responses=(OPENAI_ERROR_MESSAGE,),
+)
+
+# Identical /say questions asked while the first is still being answered share one ChatGPT request
+answer_coalescer = AnswerCoalescer(similarity_threshold=COALESCE_SIMILARITY_THRESHOLD)
+
+# Sends and edits of streamed answers, counted per channel
+stream_edit_budget = EditBudget(edits=STREAM_EDITS_PER_CHANNEL, per=STREAM_EDIT_WINDOW)
+
+# Clusters of similar logged questions, kept ranked for /questions
+question_clusters = QuestionClusters(threshold=QUESTION_CLUSTER_THRESHOLD)
+
+# BM25 index over lecture passages, persisted in the lecture_index directory
+lecture_index = LectureIndex()
+
+# Fits instructions, question, image text and lecture passages into the prompt token budget
+prompt_builder = PromptBuilder(
+    OPENAI_MODEL,
+    max_tokens=PROMPT_MAX_TOKENS,
+    question_max_tokens=PROMPT_QUESTION_MAX_TOKENS,
+    image_max_tokens=PROMPT_IMAGE_MAX_TOKENS,
+    fast_model=OPENAI_FAST_MODEL,
+    fast_model_max_tokens=OPENAI_FAST_MODEL_MAX_TOKENS,
+)
+
+# Recent questions and answers per student, sent along with their next question
+conversation_memory = ConversationMemory(
+    prompt_builder.count,
+    max_turns=CONVERSATION_MAX_TURNS,
+    max_tokens=CONVERSATION_MAX_TOKENS,
+    ttl=CONVERSATION_TTL_MINUTES * 60,
+    max_total_tokens=CONVERSATION_MEMORY_TOKENS,
+)
+
+# Shared OpenAI client, kept alive for the lifetime of the bot
+openai_client = OpenAIClient(
+    OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    pool_limit=OPENAI_POOL_LIMIT,
+    limit_per_host=OPENAI_POOL_LIMIT_PER_HOST,
+    timeout=OPENAI_TIMEOUT,
+    dispatcher=RateLimitDispatcher(
+        initial_concurrency=OPENAI_CONCURRENCY,
+        max_concurrency=OPENAI_MAX_CONCURRENCY,
+        max_retries=OPENAI_MAX_RETRIES,
+    ),
+)
+
+# Runs OCR and document parsing in worker processes so the event loop never blocks
+extractor = ExtractionExecutor(
+    kind=EXTRACTION_EXECUTOR,
+    workers=EXTRACTION_WORKERS,
+    concurrency=EXTRACTION_CONCURRENCY,
+    max_bytes=EXTRACTION_MAX_MB * 1024 * 1024,
+    max_pages=EXTRACTION_MAX_PAGES,
+    timeout=EXTRACTION_TIMEOUT,
+    batch_pages=EXTRACTION_BATCH_PAGES,
+    ocr_resolution=OCR_RESOLUTION,
+    ocr_max_side=OCR_MAX_SIDE,
+    ocr_binarize=OCR_BINARIZE,
+)
+
+# OCR results by attachment and image hash, and the latest image seen in each channel
+ocr_cache = OcrCache(extractor, max_entries=OCR_CACHE_ENTRIES)
+latest_images = LatestImages()
 
 # Function to check if the user has the administrator role
 async def is_admin(interaction):
@@ -68,171 +292,240 @@ async def create_admin_role(guild):
             print(f"Bot does not have permissions to create roles in '{guild.name}'.")
 
 
-def save_cache_to_file():
-    cache_file = "cache.txt"
-    
-    # Check if the file exists, create it if it doesn't
-    if not os.path.exists(cache_file):
-        with open(cache_file, 'w') as f:
-            json.dump({'lectures': {}, 'interactions': []}, f)
-
-    # Save the current cache state to the file
-    with open(cache_file, 'w') as f:
-        json.dump({
-            'lectures': lectures_cache,
-            'interactions': interactions_cache
-        }, f)
-    print("Cache saved to file successfully.")
-
-# Use `atexit` to ensure the cache is saved on shutdown
-atexit.register(save_cache_to_file)
+# Send a single prompt to ChatGPT and return the reply text, raising on API errors
+async def complete_prompt(prompt: str) -> str:
+    status, response_json = await openai_client.chat_completion(
+        [{'role': 'user', 'content': prompt}], OPENAI_MODEL
+    )
+    if status != 200:
+        raise RuntimeError(f"OpenAI returned {status}: {response_json}")
+    return response_json['choices'][0]['message']['content']
+
+# Map-reduce summarizer for lecture documents, with chunk summaries cached by content hash
+summarizer = Summarizer(
+    complete_prompt,
+    chunk_tokens=SUMMARY_CHUNK_TOKENS,
+    concurrency=SUMMARY_CONCURRENCY,
+    count_tokens=prompt_builder.count,
+    max_chars=1900,
+)
 
 # Function to summarize text in manageable chunks
 async def summarize_text(text: str) -> str:
     print("Starting text summarization...")
-    chunk_size = 1999  # Example chunk size
-    text_chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    print(f"Text split into {len(text_chunks)} chunks")
-
-    summaries = []
-    async with aiohttp.ClientSession() as session:
-        for i, chunk in enumerate(text_chunks):
-            try:
-                print(f"Processing chunk {i+1}/{len(text_chunks)}")
-
-                async with session.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    headers={
-                        'Authorization': f'Bearer {OPENAI_API_KEY}',
-                        'Content-Type': 'application/json'
-                    },
-                    json={
-                        'model': 'gpt-4',
-                        'messages': [{'role': 'user', 'content': f"Summarize the following text:\n{chunk}"}]
-                    }
-                ) as response:
-                    response_json = await response.json()
-                    
-                    if response.status == 200:
-                        summary_text = response_json['choices'][0]['message']['content']
-                        summaries.append(summary_text)
-                        print(f"Chunk {i+1} summarized successfully")
-                    else:
-                        print(f"Error summarizing chunk {i+1}: {response_json}")
-                        summaries.append("Error in summarizing this chunk.")
-
-            except Exception as e:
-                print(f"Exception while processing chunk {i+1}: {e}")
-                summaries.append("Error in summarizing this chunk due to an exception.")
-                
-    final_summary = " ".join(summaries)
+    final_summary = await summarizer.summarize(text)
     print("Summarization complete.")
     return final_summary
 
-async def read_file_content(attachment: discord.Attachment) -> str:
+# Stream a document into the store page by page, indexing each page as it is committed.
+# `progress` is called with (page number, total pages). Returns the number of pages with
+# text and the number of pages left out past EXTRACTION_MAX_PAGES.
+async def ingest_document(lecture_id: int, filename: str, path: str, progress=None):
+    index_writer = lecture_index.writer(lecture_id)
+    pages_with_text = 0
     try:
-        file_content = await attachment.read()
-        file_like_object = BytesIO(file_content)
-
-        # PDF Handling with incremental reading
-        if attachment.filename.endswith(".pdf"):
-            try:
-                text = ""
-                with pdfplumber.open(file_like_object) as pdf:
-                    for page in pdf.pages:
-                        text += page.extract_text() or ""
-                return text
-            except Exception as e:
-                print(f"Error reading PDF: {e}")
-                return None
-        
-        # Word Document Handling
-        elif attachment.filename.endswith(".docx"):
-            try:
-                doc = docx.Document(file_like_object)
-                text = "\n".join([para.text for para in doc.paragraphs])
-                return text
-            except Exception as e:
-                print(f"Error reading DOCX: {e}")
-                return None
-        
-        # PowerPoint Handling
-        elif attachment.filename.endswith(".pptx"):
-            try:
-                ppt = Presentation(file_like_object)
-                text = ""
-                for slide in ppt.slides:
-                    for shape in slide.shapes:
-                        if hasattr(shape, "text"):
-                            text += shape.text + "\n"
-                return text
-            except Exception as e:
-                print(f"Error reading PPTX: {e}")
-                return None
-
-    except Exception as e:
-        print(f"Unexpected error reading file: {e}")
+        page_count = await extractor.page_count(path)
+        pages_left_out = max(0, page_count - extractor.max_pages)
+        async for page_number, total_pages, text in extractor.iter_pages(path, page_count):
+            store.add_lecture_page(lecture_id, page_number, text)
+            if text.strip():
+                pages_with_text += 1
+                index_writer.add(await asyncio.to_thread(build_passages, text))
+            if progress is not None:
+                await progress(page_number, total_pages)
+    except BaseException:
+        index_writer.abort()
+        raise
+    finally:
+        await extractor.release(path)
+
+    if not pages_with_text:
+        index_writer.abort()
+        return 0, pages_left_out
+    index_writer.commit()
+    filetype = filename.split('.')[-1]
+    store.add_lecture(lecture_id, filename, filetype)
+    lectures_cache[lecture_id] = LectureRecord(filename, filetype)
+    return pages_with_text, pages_left_out
+
+# Tells the professor about the pages past EXTRACTION_MAX_PAGES, or "" when there were none
+def pages_left_out_note(pages_left_out: int) -> str:
+    if not pages_left_out:
+        return ""
+    return f". Only its first {extractor.max_pages} pages were stored; {pages_left_out} more were over the page limit."
+
+# Answer one question taken from the question queue
+async def answer_queued_question(question: str, interaction, is_dm: bool, image_text: str = ""):
+    # Stream the answer into the channel, rolling over to new messages at Discord's 2000 character limit
+    user = getattr(interaction, 'user', None) or interaction.author
+    if is_dm:
+        prefix = "Your ChatGPT response: "
+    else:
+        prefix = f"{user.display_name}'s ChatGPT response: "
+    reply = StreamingReply(
+        interaction.channel.send, prefix=prefix, edit_interval=STREAM_EDIT_INTERVAL,
+        budget=stream_edit_budget, channel_id=interaction.channel.id,
+    )
+
+    # Send the student's recent questions and answers along, so follow-ups don't need the context pasted again
+    key = conversation_key(user.id, is_dm)
+    history, history_tokens = conversation_memory.messages(key) if key else ([], 0)
+    prompt = build_question_prompt(question, image_text, history_tokens)
+    gpt_response = await ask_openai(question, reply, prompt, history)
+    await reply.finish(gpt_response)
+    if key and gpt_response != OPENAI_ERROR_MESSAGE:
+        conversation_memory.add(key, f"(About an image) {question}" if image_text else question, gpt_response)
+
+# What answer_queued_question needs from a queued interaction or message, rebuilt by the worker that answers it
+def encode_queued_question(question: str, source, is_dm: bool, image_text: str = "") -> dict:
+    user = getattr(source, 'user', None) or source.author
+    return {
+        'question': question, 'channel_id': source.channel.id, 'user_id': user.id, 'display_name': user.display_name,
+        'is_dm': is_dm, 'image_text': image_text,
+    }
+
+def decode_queued_question(data: dict):
+    source = types.SimpleNamespace(
+        channel=bot.get_partial_messageable(data['channel_id']),
+        user=types.SimpleNamespace(id=data.get('user_id'), display_name=data['display_name']),
+    )
+    return data['question'], source, data['is_dm'], data.get('image_text', "")
+
+# Queue to handle incoming messages, answered by a pool of worker tasks with per-user fairness.
+# The shared backend keeps it in the store so every worker process answers from the same queue.
+if QUEUE_BACKEND == 'shared':
+    question_queue = SharedQuestionScheduler(
+        answer_queued_question,
+        store,
+        encode_queued_question,
+        decode_queued_question,
+        worker_id=WORKER_ID,
+        workers=QUEUE_WORKERS,
+        max_depth=QUEUE_MAX_DEPTH,
+        max_per_user=QUEUE_MAX_PER_USER,
+        poll_interval=QUEUE_POLL_INTERVAL,
+        claim_timeout=QUEUE_CLAIM_TIMEOUT,
+    )
+else:
+    question_queue = QuestionScheduler(
+        answer_queued_question,
+        workers=QUEUE_WORKERS,
+        max_depth=QUEUE_MAX_DEPTH,
+        max_per_user=QUEUE_MAX_PER_USER,
+    )
+
+# Background job: the lecture's keyword list, from its passages in the retrieval index
+async def keywords_job(lecture_id: int):
+    if lecture_id not in lecture_index:
+        # Imported by another worker process that this one hasn't caught up with yet
+        await refresh_from_store()
+    if lecture_id not in lectures_cache:
+        return  # deleted since it was queued
+    keywords = lecture_index.keywords(lecture_id, LECTURE_KEYWORDS)
+    store.put_lecture_artifact(lecture_id, 'keywords', ", ".join(keywords))
+
+# Background job: the lecture's summary, so /summary only has to look it up
+async def summary_job(lecture_id: int):
+    content = await asyncio.to_thread(store.get_lecture_content, lecture_id)
+    if content is None:
+        return  # deleted since it was queued
+    summary = await summarize_text(content)
+    if summary == SUMMARY_ERROR_MESSAGE:
+        raise RuntimeError("ChatGPT could not summarize the lecture")
+    store.put_lecture_artifact(lecture_id, 'summary', summary)
+
+# Jobs are kept in the store until they finish, so imports still get their summaries after a restart
+lecture_jobs = LectureJobRunner(
+    store,
+    {'keywords': keywords_job, 'summary': summary_job},
+    worker_id=WORKER_ID,
+    workers=LECTURE_JOB_WORKERS,
+    poll_interval=LECTURE_JOB_POLL_INTERVAL,
+    claim_timeout=LECTURE_JOB_CLAIM_TIMEOUT,
+    max_attempts=LECTURE_JOB_MAX_ATTEMPTS,
+)
+
+# On shutdown, queued questions and running lecture jobs get SHUTDOWN_DRAIN_TIMEOUT seconds to finish
+lifecycle.on_drain("question queue", question_queue.drain)
+lifecycle.on_drain("lecture jobs", lecture_jobs.drain)
+
+# Metrics for the bot's hot paths, served at METRICS_PORT and shown by /stats
+command_latency = LatencyTracker()
+loop_lag_monitor = LoopLagMonitor()
+profiler = SamplingProfiler()
+metrics = MetricsRegistry()
+metrics.add_tracker("command", command_latency)
+metrics.add_tracker("openai", openai_client.latency)
+metrics.add_tracker("ocr", ocr_cache.latency)
+metrics.add_tracker("parsing", extractor.latency)
+metrics.add_tracker("queue", question_queue.latency)
+metrics.add_tracker("loop", loop_lag_monitor.latency)
+metrics.add_tracker("lecture_job", lecture_jobs.latency)
+metrics.gauge("startup_seconds", "Seconds from start until the bot was ready.", lambda: lifecycle.timer.ready_seconds or 0)
+metrics.gauge("question_queue_depth", "Questions waiting in the question queue.", lambda: question_queue.depth)
+metrics.gauge("question_queue_rejected_total", "Questions turned away because the queue was full.", lambda: question_queue.rejected)
+metrics.gauge("lecture_jobs_pending", "Lecture jobs waiting to run, across every worker process.", lambda: lecture_jobs.counts.get('pending', 0))
+metrics.gauge("answer_cache_hit_ratio", "Share of /say lookups answered from the answer cache.", response_cache.hit_rate)
+metrics.gauge("answer_coalesced_total", "/say questions answered by another student's in-flight request.", lambda: answer_coalescer.shared)
+metrics.gauge("answer_coalesce_in_flight", "Distinct /say questions currently being answered.", lambda: len(answer_coalescer))
+metrics.gauge("conversations", "Conversations with remembered turns.", lambda: len(conversation_memory))
+metrics.gauge("conversation_memory_tokens", "Tokens held in conversation memory.", lambda: conversation_memory.tokens)
+metrics.gauge("ocr_cache_hit_ratio", "Share of OCR requests served from the OCR cache.", ocr_cache.hit_rate)
+metrics.gauge("lecture_text_cache_hit_ratio", "Share of lecture text reads served decompressed from memory.", store.content_hit_rate)
+metrics.gauge("summary_cache_hits_total", "Lecture chunk summaries reused from the summary cache.", lambda: summarizer.cache_hits)
+metrics.gauge("summary_cache_misses_total", "Lecture chunk summaries sent to ChatGPT.", lambda: summarizer.cache_misses)
+metrics.gauge("openai_concurrency", "Current OpenAI request concurrency limit.", lambda: openai_client.dispatcher.concurrency)
+metrics.gauge("openai_prompt_tokens_total", "Input tokens reported by OpenAI.", lambda: openai_client.total_tokens('prompt_tokens'))
+metrics.gauge("openai_completion_tokens_total", "Output tokens reported by OpenAI.", lambda: openai_client.total_tokens('completion_tokens'))
+metrics.gauge("openai_in_flight", "OpenAI requests currently in flight.", lambda: openai_client.dispatcher.in_flight)
+
+
+# Conversation memory key: a student's DMs with the bot, or their questions in the server.
+# None where conversations aren't remembered.
+def conversation_key(user_id, is_dm: bool):
+    if not is_dm and not CONVERSATION_IN_SERVER:
         return None
+    return (user_id, 'dm' if is_dm else 'server')
+
+def check_similar_questions(new_question: str, prompt) -> str:
+    return response_cache.get(new_question, prompt.model, prompt.context_hash, prompt.lecture_ids)
+
+# Build the prompt for a student question (and the text of an image they asked about)
+# with the most relevant lecture passages that fit in the token budget
+def build_question_prompt(question: str, image_text: str = "", history_tokens: int = 0):
+    # Prepend the assistant prompt to every message
+    assistant_prompt = "You are a teaching assistant in a college class designed to answer student questions. Structure your responses in a way that students can learn from these answers, like providing examples or in-depth explanations."
+
+    # Include the most relevant lecture passages instead of whole documents
+    query = f"{image_text} {question}" if image_text else question
+    passages = [
+        (getattr(lectures_cache.get(lecture_id), 'filename', lecture_id), lecture_id, text)
+        for _, lecture_id, text in lecture_index.search(query, RETRIEVAL_TOP_K)
+    ]
+    prompt = prompt_builder.build(assistant_prompt, question, passages, image_text, reserved_tokens=history_tokens)
+    if prompt.trimmed:
+        print(f"Trimmed {', '.join(prompt.trimmed)} to fit the prompt in {prompt_builder.max_tokens} tokens")
+    return prompt
+
+# Ask ChatGPT a question, after the conversation `history` messages if any.
+# When `reply` is given the answer is streamed into it as it arrives; the reply only buffers
+# the text, so the request isn't held open while Discord messages are edited.
+async def ask_openai(question: str, reply: StreamingReply = None, prompt=None, history=()):
+    try:
+        if prompt is None:
+            prompt = build_question_prompt(question)
 
-# Background task that processes the question queue
-async def process_queue():
-    while True:
-        if question_queue:
-            question, interaction, is_dm = question_queue.popleft()
-            gpt_response = await ask_openai(question)
-
-            # Ensure the response does not exceed Discord's 2000 character limit
-            if len(gpt_response) > 2000:
-                # Split the response into chunks of 2000 characters
-                for i in range(0, len(gpt_response), 2000):
-                    chunk = gpt_response[i:i + 2000]
-                    if is_dm:
-                        await interaction.channel.send(chunk)
-                    else:
-                        await interaction.channel.send(f"{interaction.user.display_name}'s ChatGPT response (part):\n{chunk}")
-            else:
-                if is_dm:
-                    await interaction.channel.send(f"Your ChatGPT response: {gpt_response}")
-                else:
-                    await interaction.channel.send(f"{interaction.user.display_name}'s ChatGPT response: {gpt_response}")
-        
-        await asyncio.sleep(1)
-
-
-def check_similar_questions(new_question: str) -> str:
-    threshold = 60
-
-    for entry in interactions_cache:
-        existing_question = entry['question']
-        similarity = fuzz.ratio(existing_question.lower(), new_question.lower())
-        if similarity >= threshold:
-            return entry['response']
-    return None
+        messages = [*history, {'role': 'user', 'content': prompt.text}]
+        if reply is not None:
+            async for delta in openai_client.stream_chat_completion(messages, prompt.model):
+                reply.append(delta)
+            return reply.text
 
-async def ask_openai(question: str):
-    async with semaphore:  # Only allow a limited number of concurrent requests
-        try:
-            # Prepend the assistant prompt to every message
-            assistant_prompt = "You are a teaching assistant in a college class designed to answer student questions. Structure your responses in a way that students can learn from these answers, like providing examples or in-depth explanations."
-            full_prompt = f'{assistant_prompt}\n\nStudentQuestion: "{question}"'
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    headers={
-                        'Authorization': f'Bearer {OPENAI_API_KEY}',
-                        'Content-Type': 'application/json'
-                    },
-                    json={
-                        'model': 'gpt-4',
-                        'messages': [{'role': 'user', 'content': full_prompt}]
-                    }
-                ) as response:
-                    response_json = await response.json()
-                    return response_json['choices'][0]['message']['content']
-        except Exception as e:
-            print(f"Error contacting OpenAI: {e}")
-            return "There was an error contacting ChatGPT."
+        status, response_json = await openai_client.chat_completion(messages, prompt.model)
+        return response_json['choices'][0]['message']['content']
+    except Exception as e:
+        print(f"Error contacting OpenAI: {e}")
+        return OPENAI_ERROR_MESSAGE
 
 @bot.tree.command(name="new_lecture")
 async def store_lecture(interaction: discord.Interaction, attachment: discord.Attachment):
@@ -241,26 +534,170 @@ async def store_lecture(interaction: discord.Interaction, attachment: discord.At
         await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
         return  # Exit the command if the user lacks the role
 
+    if not is_supported_document(attachment.filename):
+        await interaction.response.send_message("Please upload a valid .pdf, .docx, or .pptx file.", ephemeral=True)
+        return
+    if attachment.size > extractor.max_bytes:
+        await interaction.response.send_message(f"That file is too large (limit {EXTRACTION_MAX_MB} MB).", ephemeral=True)
+        return
+
     # If the user has the admin role, proceed with processing
     await interaction.response.send_message("Processing your lecture document...")
 
-    # Read the file content
-    file_content = await read_file_content(attachment)
-
-    if file_content:
-        filetype = attachment.filename.split('.')[-1]
-        lecture_id = len(lectures_cache) + 1
+    # Report progress by editing the processing message, at most every few seconds
+    last_update = 0.0
+    async def report_progress(page_number, total_pages):
+        nonlocal last_update
+        now = asyncio.get_running_loop().time()
+        if now - last_update >= 3 or page_number == total_pages:
+            last_update = now
+            await interaction.edit_original_response(
+                content=f"Processing your lecture document... page {page_number}/{total_pages}"
+            )
 
-        lectures_cache[lecture_id] = {
-            'filename': attachment.filename,
-            'filetype': filetype,
-            'content': file_content
-        }
+    lecture_id = await asyncio.to_thread(store.reserve_lecture_id)
+    path = None
+    try:
+        # Spool the upload to a temporary file, then read it one batch of pages at a time
+        path = await spool_attachment(attachment.url, attachment.filename, extractor.max_bytes)
+        pages_with_text, pages_left_out = await ingest_document(lecture_id, attachment.filename, path, report_progress)
+    except Exception as e:
+        print(f"Error reading '{attachment.filename}': {e}")
+        pages_with_text, pages_left_out = 0, 0
+    finally:
+        if path is not None:
+            os.remove(path)
 
-        await interaction.followup.send(f"Lecture '{attachment.filename}' stored successfully. ID: {lecture_id}")
+    if pages_with_text:
+        await lecture_jobs.submit(lecture_id)
+        await interaction.followup.send(
+            f"Lecture '{attachment.filename}' stored successfully. ID: {lecture_id}" + pages_left_out_note(pages_left_out)
+        )
     else:
+        store.delete_lecture(lecture_id)
         await interaction.followup.send("Failed to process the document. Please upload a valid .pdf, .docx, or .pptx file.")
 
+# Store one document as a new lecture and queue its background jobs; returns a line for the import report
+async def import_document(filename: str, path: str) -> str:
+    lecture_id = await asyncio.to_thread(store.reserve_lecture_id)
+    try:
+        pages_with_text, pages_left_out = await ingest_document(lecture_id, filename, path)
+    except Exception as e:
+        print(f"Error reading '{filename}': {e}")
+        pages_with_text, pages_left_out = 0, 0
+    if not pages_with_text:
+        store.delete_lecture(lecture_id)
+        return f"{filename}: could not be read"
+    await lecture_jobs.submit(lecture_id)
+    return f"{filename}: stored as ID {lecture_id}" + pages_left_out_note(pages_left_out)
+
+# Import one /import_lectures attachment, or every document in it when it is a .zip archive.
+# `progress` is awaited after each document. Returns lines for the import report.
+async def import_attachment(attachment: discord.Attachment, progress) -> list:
+    if is_archive(attachment.filename):
+        max_bytes = IMPORT_MAX_MB * 1024 * 1024
+    elif is_supported_document(attachment.filename):
+        max_bytes = extractor.max_bytes
+    else:
+        return [f"{attachment.filename}: skipped, not a .pdf, .docx, .pptx or .zip file"]
+    if attachment.size > max_bytes:
+        return [f"{attachment.filename}: skipped, larger than {max_bytes // (1024 * 1024)} MB"]
+
+    async def import_and_report(filename, path):
+        line = await import_document(filename, path)
+        await progress()
+        return line
+
+    paths = []
+    try:
+        path = await spool_attachment(attachment.url, attachment.filename, max_bytes)
+        paths.append(path)
+        if is_archive(attachment.filename):
+            documents, skipped = await asyncio.to_thread(
+                unpack_archive, path, extractor.max_bytes, max_bytes, IMPORT_MAX_FILES
+            )
+            paths.extend(document_path for _, document_path in documents)
+        else:
+            documents, skipped = [(attachment.filename, path)], []
+        # Documents are read concurrently, as far as the extraction executor's concurrency allows
+        lines = [f"{filename}: skipped, {reason}" for filename, reason in skipped]
+        lines.extend(await asyncio.gather(*(import_and_report(filename, path) for filename, path in documents)))
+        return lines
+    except Exception as e:
+        print(f"Error importing '{attachment.filename}': {e}")
+        return [f"{attachment.filename}: could not be read ({e})"]
+    finally:
+        for path in set(paths):
+            os.remove(path)
+
+@bot.tree.command(name="import_lectures")
+async def import_lectures(
+    interaction: discord.Interaction,
+    attachment: discord.Attachment,
+    attachment2: Optional[discord.Attachment] = None,
+    attachment3: Optional[discord.Attachment] = None,
+    attachment4: Optional[discord.Attachment] = None,
+    attachment5: Optional[discord.Attachment] = None,
+):
+    # Check for admin role
+    if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
+        await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+        return
+
+    attachments = [a for a in (attachment, attachment2, attachment3, attachment4, attachment5) if a is not None]
+    await interaction.response.send_message(f"Importing {len(attachments)} files...")
+
+    # Report progress by editing the processing message, at most every few seconds
+    imported = 0
+    last_update = 0.0
+    async def report_progress():
+        nonlocal imported, last_update
+        imported += 1
+        now = asyncio.get_running_loop().time()
+        if now - last_update >= 3:
+            last_update = now
+            await interaction.edit_original_response(content=f"Importing {len(attachments)} files... {imported} documents done")
+
+    results = await asyncio.gather(*(import_attachment(a, report_progress) for a in attachments))
+    lines = [line for result in results for line in result]
+    stored = sum(1 for line in lines if ": stored as ID " in line)
+
+    response_message = f"### Imported {stored} of {len(lines)} documents\n" + "\n".join(lines)
+    if stored:
+        response_message += "\n\nSummaries and keywords are being prepared in the background, see /jobs."
+    if len(response_message) > 2000:
+        response_message = response_message[:1997] + "..."
+    await interaction.followup.send(response_message)
+
+@bot.tree.command(name="jobs")
+async def jobs(interaction: discord.Interaction, lecture_id: Optional[int] = None):
+    # Check for admin role
+    if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
+        await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+        return
+
+    counts = await asyncio.to_thread(store.lecture_job_counts)
+    rows = await asyncio.to_thread(store.lecture_jobs, lecture_id)
+    if not rows:
+        await interaction.response.send_message("No background jobs found.", ephemeral=True)
+        return
+
+    lines = []
+    for job_lecture_id, kind, status, attempts, error in rows:
+        lecture = lectures_cache.get(job_lecture_id)
+        line = f"ID: {job_lecture_id} ({lecture.filename if lecture else 'deleted'}) - {kind}: {status}"
+        if attempts > 1:
+            line += f" after {attempts} attempts"
+        if error and status != 'done':
+            line += f" - {error[:100]}"
+        lines.append(line)
+
+    summary_line = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    response_message = f"### Background Jobs ({summary_line}):\n" + "\n".join(lines)
+    if len(response_message) > 2000:
+        response_message = response_message[:1997] + "..."
+    await interaction.response.send_message(response_message, ephemeral=True)
+
 @bot.tree.command(name="summary")
 async def summary(interaction: discord.Interaction, lecture_id: int):
     # Check for admin role
@@ -273,25 +710,58 @@ async def summary(interaction: discord.Interaction, lecture_id: int):
     lecture = lectures_cache.get(lecture_id)
 
     if lecture:
-        filename = lecture['filename']
-        content = lecture['content']
-
-        # Start the summarization process
-        print("Starting text summarization...")
-        summary = await summarize_text(content)
+        filename = lecture.filename
+
+        # Summaries and keywords are precomputed by background jobs when a lecture is stored
+        summary = await asyncio.to_thread(store.get_lecture_artifact, lecture_id, 'summary')
+        keywords = await asyncio.to_thread(store.get_lecture_artifact, lecture_id, 'keywords')
+        if summary is None:
+            statuses = {kind: status for _, kind, status, _, _ in await asyncio.to_thread(store.lecture_jobs, lecture_id)}
+            if statuses.get('summary') in ('pending', 'running'):
+                await interaction.followup.send(
+                    f"The summary of {filename} is still being prepared. Please try again in a few minutes."
+                )
+                return
+
+            # Lectures stored before background jobs existed, or whose job failed: summarize now and keep the result
+            content = await asyncio.to_thread(store.get_lecture_content, lecture_id)
+            summary = await summarize_text(content)
+            if summary != SUMMARY_ERROR_MESSAGE:
+                store.put_lecture_artifact(lecture_id, 'summary', summary)
 
         # Truncate the summary to a maximum of 1999 characters
         if len(summary) > 1999:
             print("Summary exceeds 1999 characters, truncating...")
             summary = summary[:1999]
 
+        response_message = f"Summary of {filename}:\n{summary}"
+        if keywords:
+            response_message += f"\n\nKeywords: {keywords}"
         print("Sending summary of lecture to Discord")
-        await interaction.followup.send(f"Summary of {filename}:\n{summary}")
+        await interaction.followup.send(response_message[:2000])
     else:
         await interaction.followup.send(f"No lecture found with ID: {lecture_id}")
 
+# Sections of /cache and /list; only the lines on the requested page are formatted
+def lecture_section(header: str, with_type: bool) -> Section:
+    def format_lecture(_, lecture_id, lecture):
+        line = f"ID: {lecture_id} - Filename: {lecture.filename}"
+        return f"{line} (Type: {lecture.filetype})" if with_type else line
+    return Section(header, lambda: len(lectures_cache), mapping_lines(lectures_cache, format_lecture), "No lectures found.")
+
+def interaction_section() -> Section:
+    def format_interaction(_, entry):
+        line = f"User: <@{entry['user_id']}> - Question: {entry.get('question')}"
+        if entry.get('response'):
+            line += f" - Response: {entry['response'][:50]}..."
+        return line
+    return Section(
+        "### Interactions in Memory:", lambda: len(interactions_cache), list_lines(interactions_cache, format_interaction),
+        "No interactions found.",
+    )
+
 @bot.tree.command(name="cache")
-async def cache(interaction: discord.Interaction):
+async def cache(interaction: discord.Interaction, page: int = 1):
     # Check for admin role
     if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
         await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
@@ -299,45 +769,120 @@ async def cache(interaction: discord.Interaction):
 
     await interaction.response.defer()
 
-    lecture_info = "\n".join([f"ID: {id} - Filename: {lecture['filename']} (Type: {lecture['filetype']})"
-                              for id, lecture in lectures_cache.items()]) if lectures_cache else "No lectures found."
+    paginator = Paginator(
+        [lecture_section("### Lectures in Memory:", with_type=True), interaction_section()], per_page=PAGE_SIZE
+    )
+    await send_page(interaction.followup.send, paginator, page, interaction.user.id)
+
+@bot.tree.command(name="cache_stats")
+async def cache_stats(interaction: discord.Interaction):
+    # Check for admin role
+    if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
+        await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+        return
 
-    interaction_info = "\n".join([f"User: <@{entry['user_id']}> - Question: {entry['question']} - Response: {entry['response'][:50]}..."
-                                   for entry in interactions_cache]) if interactions_cache else "No interactions found."
+    await interaction.response.send_message(
+        f"### Answer Cache:\n{response_cache.stats()}\n\n### Shared Answers:\n{answer_coalescer.stats()}"
+        f"\n\n### OCR Cache:\n{ocr_cache.stats()}\n\n### Lecture Text Cache:\n{store.content_stats()}"
+        f"\n\n### Conversations:\n{conversation_memory.stats()}", ephemeral=True
+    )
 
-    response_message = "### Lectures in Memory:\n" + lecture_info + "\n\n### Interactions in Memory:\n" + interaction_info
+@bot.tree.command(name="stats")
+async def stats(interaction: discord.Interaction):
+    # Check for admin role
+    if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
+        await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+        return
 
-    await interaction.followup.send(response_message)
+    response_message = f"### Bot Metrics:\n{metrics.summary()}"
+    if len(response_message) > 2000:
+        response_message = response_message[:1997] + "..."
+    await interaction.response.send_message(response_message, ephemeral=True)
+
+@bot.tree.command(name="profile")
+async def profile(interaction: discord.Interaction, seconds: int = 30):
+    # Check for admin role
+    if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
+        await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
+        return
+    if profiler.running:
+        await interaction.response.send_message("The profiler is already running.", ephemeral=True)
+        return
+
+    seconds = max(1, min(seconds, 300))
+    await interaction.response.send_message(f"Profiling the bot for {seconds} seconds...", ephemeral=True)
+
+    # Sample the event loop thread, then dump the full report to a file and show the top of it
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    report = profiler.report(top=40)
+    report_file = f"profile-{int(discord.utils.utcnow().timestamp())}.txt"
+    with open(report_file, 'w') as f:
+        f.write(report)
+    await interaction.followup.send(f"Profile saved to {report_file}:\n```\n{profiler.report(top=10)[:1800]}\n```", ephemeral=True)
 
 @bot.tree.command(name="say")
 async def say(interaction: discord.Interaction, *, message: str):
     # Acknowledge the interaction by deferring the response
     await interaction.response.defer()
 
-    # Check for similar questions in the cache
-    cached_answer = check_similar_questions(message)
+    # The student's recent questions and answers go along with this one
+    key = conversation_key(interaction.user.id, interaction.guild is None)
+    history, history_tokens = conversation_memory.messages(key) if key else ([], 0)
+    # Only a question that looks like a follow-up goes with them. Any other question is answered
+    # on its own, so its answer can be cached and shared with other students.
+    if history and not looks_like_followup(message):
+        history, history_tokens = [], 0
+    prompt = build_question_prompt(message, history_tokens=history_tokens)
+
+    # Check for the same or a similar question in the cache. A follow-up only makes sense
+    # after the earlier turns, so it skips the cache.
+    cached_answer = None if history else check_similar_questions(message, prompt)
     if cached_answer:
         print(f"Using cached answer for question: '{message}'")
         await interaction.followup.send(f"Found a similar question in the cache: {cached_answer[:2000]}")
+        if key:
+            conversation_memory.add(key, message, cached_answer)
         return
     
-    # Get the response from OpenAI
-    response = await ask_openai(message)
+    # Get the response from OpenAI, streaming it into the followup message as it arrives
+    reply = StreamingReply(
+        lambda content: interaction.followup.send(content, wait=True),
+        prefix=f"{interaction.user.display_name}'s ChatGPT response: ",
+        edit_interval=STREAM_EDIT_INTERVAL,
+        budget=stream_edit_budget,
+        channel_id=interaction.channel_id,
+    )
+    if history:
+        response, shared = await ask_openai(message, reply, prompt, history), False
+    else:
+        # If the same question is already being answered for another student, wait for that answer instead
+        response, shared = await answer_coalescer.run(
+            message, (prompt.model, prompt.context_hash), lambda: ask_openai(message, reply, prompt)
+        )
+    await reply.finish(response)
+    if response != OPENAI_ERROR_MESSAGE:
+        if key:
+            conversation_memory.add(key, message, response)
+        if not shared and not history:
+            response_cache.put(message, prompt.model, prompt.context_hash, response, prompt.lecture_ids)
     
-    # Store the new interaction in the cache
-    interactions_cache.append({
+    # Store the new interaction in the cache. A follow-up's answer depends on the earlier
+    # turns, so it is marked to keep it out of the answer cache when it is loaded again.
+    entry = {
         'user_id': interaction.user.id,
         'question': message,
-        'response': response
-    })
-    
-    # Send the response in chunks if necessary
-    if len(response) > 2000:
-        for i in range(0, len(response), 2000):
-            chunk = response[i:i + 2000]
-            await interaction.followup.send(chunk)
-    else:
-        await interaction.followup.send(f"{interaction.user.display_name}'s ChatGPT response: {response}")
+        'response': response,
+        'lecture_ids': prompt.lecture_ids,
+    }
+    if history:
+        entry['followup'] = True
+    interactions_cache.append(entry)
+    question_clusters.add(message)
+    store.add_interaction(entry)
 
 
 
@@ -353,67 +898,164 @@ async def clear_cache(interaction: discord.Interaction):
     # Clear the in-memory caches
     lectures_cache.clear()
     interactions_cache.clear()
-
-    # Clear the cache.txt file
-    try:
-        cache_file = "cache.txt"
-        if os.path.exists(cache_file):
-            with open(cache_file, 'w') as f:
-                json.dump({'lectures': {}, 'interactions': []}, f)
-            print("Cache file cleared successfully.")
-        else:
-            print("Cache file does not exist, so nothing to clear.")
-    except Exception as e:
-        await interaction.response.send_message(
-            f"Failed to clear the cache file due to an error: {e}", ephemeral=True
-        )
+    response_cache.clear()
+    question_clusters.clear()
+    lecture_index.clear()
+    conversation_memory.clear()
+
+    # Clear the stored lectures and interactions (other worker processes notice the new generation)
+    store_sync['generation'] = store.clear()
+    print("Store cleared successfully.")
+
+    await interaction.response.send_message("Cache and stored lectures have been cleared successfully!")
+
+
+# Function to load the caches from the store, importing an old cache.txt the first time.
+# Blocking, so main() runs it in a thread, once, before connecting to Discord.
+def load_cache_from_store():
+    timer = lifecycle.timer
+    with timer.phase('store'):
+        store.migrate_from_json("cache.txt")
+
+        lectures_cache.clear()
+        lectures_cache.update(store.load_lectures())
+
+        store_sync['data_version'] = store.data_version()
+        store_sync['generation'] = store.generation()
+        store_sync['last_interaction_id'], interactions = store.load_interactions_since()
+        interactions_cache.clear()
+        interactions_cache.extend(interactions)
+    with timer.phase('answer_cache'):
+        response_cache.clear()
+        response_cache.warm(interactions_cache)
+    with timer.phase('question_clusters'):
+        load_question_clusters()
+
+    print(f"Cache loaded successfully: {len(lectures_cache)} lectures, {len(interactions_cache)} interactions.")
+
+    with timer.phase('lecture_index'):
+        sync_lecture_index()
+
+# Start the question clusters from the snapshot plus the questions logged after it, or rebuild them
+def load_question_clusters():
+    snapshot = read_json(STATE_SNAPSHOT_PATH)
+    if (snapshot is None or snapshot.get('generation') != store_sync['generation']
+            or snapshot.get('last_interaction_id', 0) > store_sync['last_interaction_id']):
+        question_clusters.rebuild(entry.get('question') for entry in interactions_cache)
         return
 
-    await interaction.response.send_message("Cache and cache.txt file have been cleared successfully!")
-
+    question_clusters.restore(snapshot['question_clusters'])
+    _, newer = store.load_interactions_since(snapshot['last_interaction_id'], until_id=store_sync['last_interaction_id'])
+    for entry in newer:
+        if entry.get('question'):
+            question_clusters.add(entry['question'])
+    print(f"Question clusters restored from {STATE_SNAPSHOT_PATH}, with {len(newer)} newer interactions.")
+
+# Bring the state snapshot up to date with the store; blocking, so run it in a thread.
+# It is built from the stored interaction log alone (the previous snapshot plus the
+# questions logged since), so it matches the log up to its last_interaction_id exactly,
+# whatever this process has in memory.
+def save_state_snapshot():
+    generation = store.generation()
+    snapshot = read_json(STATE_SNAPSHOT_PATH)
+    clusters = QuestionClusters(threshold=QUESTION_CLUSTER_THRESHOLD)
+    last_interaction_id = 0
+    if snapshot is not None and snapshot.get('generation') == generation:
+        clusters.restore(snapshot['question_clusters'])
+        last_interaction_id = snapshot['last_interaction_id']
+
+    new_last_interaction_id, interactions = store.load_interactions_since(last_interaction_id)
+    if snapshot is not None and snapshot.get('generation') == generation and new_last_interaction_id == last_interaction_id:
+        return  # nothing new since the last snapshot
+    for entry in interactions:
+        if entry.get('question'):
+            clusters.add(entry['question'])
+    write_json_atomic(STATE_SNAPSHOT_PATH, {
+        'generation': generation,
+        'last_interaction_id': new_last_interaction_id,
+        'saved_at': time.time(),
+        'question_clusters': clusters.snapshot(),
+    })
 
-# Function to load cache from file
-def load_cache_from_file():
-    cache_file = "cache.txt"
-    
-    if os.path.exists(cache_file):
-        with open(cache_file, 'r') as f:
-            try:
-                cache_data = json.load(f)
-                
-                # Load lectures_cache with integer keys
-                global lectures_cache
-                lectures_cache = {
-                    int(id): lecture  # Ensure IDs are integers for lectures
-                    for id, lecture in cache_data.get('lectures', {}).items()
-                }
-                
-                # Load interactions_cache (if exists)
-                global interactions_cache
-                interactions_cache = cache_data.get('interactions', [])
-                
-                print("Cache loaded successfully.")
-                
-                
-            except json.JSONDecodeError:
-                print("Error decoding cache file. Starting with an empty cache.")
-    else:
-        print("Cache file not found. Starting with an empty cache.")
+# Load the persisted lecture index and bring it in line with lectures_cache
+def sync_lecture_index():
+    indexed_ids = lecture_index.load()
+    for lecture_id in indexed_ids:
+        if lecture_id not in lectures_cache:
+            lecture_index.remove_lecture(lecture_id)
+    for lecture_id in lectures_cache:
+        if lecture_id not in lecture_index:
+            lecture_index.add_lecture(lecture_id, build_passages(store.get_lecture_content(lecture_id)))
+    print(f"Lecture index loaded with {len(lecture_index.passages)} passages.")
+
+# Bring the in-memory caches up to date with lectures and interactions written by other worker processes
+async def refresh_from_store():
+    async with store_refresh_lock:
+        await _refresh_from_store()
+
+async def _refresh_from_store():
+    data_version = await asyncio.to_thread(store.data_version)
+    if data_version == store_sync['data_version']:
+        return
+    store_sync['data_version'] = data_version
+
+    # Another worker ran /clear: start over from an empty cache
+    generation = await asyncio.to_thread(store.generation)
+    if generation != store_sync['generation']:
+        store_sync['generation'] = generation
+        store_sync['last_interaction_id'] = 0
+        lectures_cache.clear()
+        interactions_cache.clear()
+        response_cache.clear()
+        question_clusters.clear()
+        lecture_index.clear()
+
+    known_ids = set(lectures_cache)
+    lectures = await asyncio.to_thread(store.load_lectures)
+    for lecture_id in known_ids - set(lectures):
+        lectures_cache.pop(lecture_id, None)
+        lecture_index.remove_lecture(lecture_id)
+        response_cache.invalidate_lecture(lecture_id)
+    for lecture_id, lecture in lectures.items():
+        if lecture_id in lectures_cache:
+            continue
+        content = await asyncio.to_thread(store.get_lecture_content, lecture_id)
+        passages = await asyncio.to_thread(build_passages, content or "")
+        lectures_cache[lecture_id] = lecture
+        lecture_index.add_lecture(lecture_id, passages)
+
+    store_sync['last_interaction_id'], interactions = await asyncio.to_thread(
+        store.load_interactions_since, store_sync['last_interaction_id'], WORKER_ID
+    )
+    for entry in interactions:
+        interactions_cache.append(entry)
+        if entry.get('question'):
+            question_clusters.add(entry['question'])
+    response_cache.warm(interactions)
 
 @bot.event
 async def on_message(message: discord.Message):
     if message.author == bot.user:
         return
 
-    if message.guild is None:
+    # Remember the latest image in each channel for /sayiac
+    latest_images.observe(message)
+
+    # A DM with only an image is context for a later /sayiac, not a question
+    if message.guild is None and message.content:
+        if not await question_queue.submit(message.author.id, (message.content, message, True)):
+            await message.channel.send(BUSY_MESSAGE)
+            return
         await message.channel.send("Processing your message...")
-        interactions_cache.append({'user_id': str(message.author.id), 'question': message.content})
-        await question_queue.put((message.content, message, True))
+        entry = {'user_id': str(message.author.id), 'question': message.content}
+        interactions_cache.append(entry)
+        question_clusters.add(message.content)
+        store.add_interaction(entry)
 
     await bot.process_commands(message)
 
 @bot.tree.command(name="list")
-async def list_lectures(interaction: discord.Interaction):
+async def list_lectures(interaction: discord.Interaction, page: int = 1):
     # Check for admin role
     if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
         await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
@@ -422,14 +1064,14 @@ async def list_lectures(interaction: discord.Interaction):
     await interaction.response.defer()
 
     if lectures_cache:
-        lecture_list = "\n".join([f"ID: {id} - Filename: {lecture['filename']}" for id, lecture in lectures_cache.items()])
-        await interaction.followup.send(f"### Stored Lectures:\n{lecture_list}")
+        paginator = Paginator([lecture_section("### Stored Lectures:", with_type=False)], per_page=PAGE_SIZE)
+        await send_page(interaction.followup.send, paginator, page, interaction.user.id)
     else:
         await interaction.followup.send("No lectures found in the memory.")
         
 
 @bot.tree.command(name="questions")
-async def frequent_questions(interaction: discord.Interaction, top_n: int = 5):
+async def frequent_questions(interaction: discord.Interaction, top_n: int = 5, page: int = 1):
     # Check if the user has the required admin role
     if not any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles):
         await interaction.response.send_message(
@@ -437,40 +1079,46 @@ async def frequent_questions(interaction: discord.Interaction, top_n: int = 5):
         )
         return
 
-    # Check if the interactions_cache is empty
-    if not interactions_cache:
+    # Check if any questions have been logged
+    if not question_clusters:
         await interaction.response.send_message(
             "No questions have been logged yet.", ephemeral=True
         )
         return
 
-    # Count the frequency of questions with normalization
-    question_counts = {}
-    for entry in interactions_cache:
-        question = entry.get('question')  # Safeguard in case 'question' is missing
-        if question:
-            normalized_question = question.strip().lower()  # Normalize question
-            question_counts[normalized_question] = question_counts.get(normalized_question, 0) + 1
-
-    # Sort questions by frequency in descending order
-    sorted_questions = sorted(question_counts.items(), key=lambda x: x[1], reverse=True)
-
-    # Prepare the response message
-    response_message = "**Most Frequently Asked Questions:**\n"
-    for i, (question, count) in enumerate(sorted_questions[:top_n], 1):
-        response_message += f"{i}. {question} (Asked {count} times)\n"
-
-    # Ensure the response doesn't exceed Discord's character limit (2000 characters)
-    if len(response_message) > 2000:
-        response_message = response_message[:1997] + "..."  # Truncate and add ellipsis
+    # Clusters are kept ranked by how often they were asked, so a page only reads its own ranks
+    def format_clusters(start, stop):
+        for rank, cluster in enumerate(question_clusters.ranked(start, stop), start + 1):
+            question, *other_phrasings = cluster.representatives(3)
+            line = f"{rank}. {question} (Asked {cluster.count} times)"
+            if other_phrasings:
+                line += "\n   Also asked as: " + "; ".join(other_phrasings)
+            yield line
 
-    await interaction.response.send_message(response_message)
+    paginator = Paginator(
+        [Section("**Most Frequently Asked Questions:**", lambda: len(question_clusters), format_clusters)],
+        per_page=top_n,
+        max_line_chars=600,
+    )
+    await send_page(interaction.response.send_message, paginator, page, interaction.user.id)
 
 
 @bot.event
 async def on_ready():
-    load_cache_from_file() 
-    await bot.tree.sync()
+    # on_ready fires again after every gateway reconnect. The state was loaded once in main(),
+    # so a reconnect only makes sure the queue workers are still running.
+    if lifecycle.timer.ready_seconds is not None:
+        print(f"Reconnected as {bot.user}.")
+        if not lifecycle.stopping.is_set():
+            await question_queue.start()
+            await lecture_jobs.start()
+        return
+    lifecycle.timer.end('gateway')
+
+    # Slash commands are global, so only the process running shard 0 needs to sync them
+    if not SHARD_IDS or 0 in SHARD_IDS:
+        with lifecycle.timer.phase('command_sync'):
+            await bot.tree.sync()
     print(f'Bot is online as {bot.user}!')
 
     general_channel = discord.utils.get(bot.get_all_channels(), name='general')
@@ -484,7 +1132,10 @@ async def on_ready():
             f"I'm looking forward to assisting you throughout the course!"
         )
 
-    asyncio.create_task(process_queue())
+    await question_queue.start()
+    await lecture_jobs.start()
+    lifecycle.timer.mark_ready()
+    print(lifecycle.timer.summary())
 
 # /sayiac command that extracts text from an image (from DMs or lecture channel)
 @bot.tree.command(name="sayiac")
@@ -503,31 +1154,23 @@ async def sayiac(interaction: discord.Interaction, *, message: str):
 
 # Background task to process the image in the DM
 async def process_image_from_dm(interaction: discord.Interaction, user_question: str):
-    # Fetch the most recent message with an image in the DM
-    image_message = None
-    async for msg in interaction.channel.history(limit=50):
-        if msg.attachments:
-            for attachment in msg.attachments:
-                if attachment.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    image_message = msg
-                    break
-        if image_message:
-            break
-
-    if not image_message:
+    # Find the most recent image in the DM
+    image_attachment = await latest_images.find(interaction.channel)
+
+    if not image_attachment:
         await interaction.channel.send("No image found in your recent direct messages. Please send an image and try again.")
         return
 
-    # Download the image and extract text using pytesseract
-    image_data = await image_message.attachments[0].read()
-    image = Image.open(io.BytesIO(image_data))
-    extracted_text = pytesseract.image_to_string(image)
-
-    # Construct the prompt to send to ChatGPT
-    constructed_prompt = f'ImageAsText: "{extracted_text}". UserQuestion: "{user_question}".'
+    # Extract text from the image (cached, so the same image is only OCRed once)
+    try:
+        extracted_text = await ocr_cache.extract_text(image_attachment)
+    except ExtractionError as e:
+        await interaction.channel.send(f"Could not read the image: {e}")
+        return
 
-    # Add the constructed prompt and interaction object to the queue
-    question_queue.append((constructed_prompt, interaction, True))
+    # Queue the question with the image text, which is fitted into the prompt's token budget when it is answered
+    if not await question_queue.submit(interaction.user.id, (user_question, interaction, True, extracted_text)):
+        await interaction.channel.send(BUSY_MESSAGE)
 
 # Background task to process the image in the "lecture" channel
 async def process_image_from_lecture(interaction: discord.Interaction, user_question: str):
@@ -537,35 +1180,40 @@ async def process_image_from_lecture(interaction: discord.Interaction, user_ques
         await interaction.channel.send("Lecture channel not found!")
         return
 
-    # Fetch the most recent message with an image in the "lecture" channel
-    image_message = None
-    async for msg in lecture_channel.history(limit=50):
-        if msg.attachments:
-            for attachment in msg.attachments:
-                if attachment.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    image_message = msg
-                    break
-        if image_message:
-            break
-
-    if not image_message:
+    # Find the most recent image in the "lecture" channel
+    image_attachment = await latest_images.find(lecture_channel)
+
+    if not image_attachment:
         await interaction.channel.send("No image found in the recent messages.")
         return
 
-    # Download and process the image
-    image_data = await image_message.attachments[0].read()
-    image = Image.open(io.BytesIO(image_data))
-    extracted_text = pytesseract.image_to_string(image)
+    # Extract text from the image (cached, so a slide many students ask about is only OCRed once)
+    try:
+        extracted_text = await ocr_cache.extract_text(image_attachment)
+    except ExtractionError as e:
+        await interaction.channel.send(f"Could not read the image: {e}")
+        return
 
-    # Construct the prompt to send to ChatGPT
-    constructed_prompt = f'ImageAsText: "{extracted_text}". UserQuestion: "{user_question}".'
+    # Queue the question with the image text, Professors go first
+    priority = 0 if any(role.name == ADMIN_ROLE_NAME for role in interaction.user.roles) else 1
+    if not await question_queue.submit(interaction.user.id, (user_question, interaction, False, extracted_text), priority):
+        await interaction.channel.send(BUSY_MESSAGE)
 
-    # Add the constructed prompt and interaction object to the queue
-    question_queue.append((constructed_prompt, interaction, False))
+# Record how long each slash command took, from reaching this process to the handler finishing
+def record_command_latency(name: str, interaction: discord.Interaction):
+    received_at = interaction.extras.get('received_at')
+    if received_at is not None:
+        command_latency.record(name, time.perf_counter() - received_at)
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    record_command_latency(command.name, interaction)
 
 # Error handling for app commands
 @bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error):
+    if interaction.command is not None:
+        record_command_latency(f"{interaction.command.name}:error", interaction)
     if isinstance(error, commands.CheckFailure):
         await interaction.response.send_message("You do not have the required role to use this command.", ephemeral=True)
     else:
@@ -575,12 +1223,46 @@ async def on_app_command_error(interaction: discord.Interaction, error):
 
 # Main function to start the bot
 async def main():
+    lifecycle.install_signal_handlers()
+    bot_task = None
     try:
-        await bot.start(DISCORD_TOKEN)
+        store.start()
+        loop_lag_monitor.start()
+        # Load the persisted state once, off the event loop, before connecting to Discord
+        await asyncio.to_thread(load_cache_from_store)
+        if STORE_REFRESH_INTERVAL:
+            lifecycle.every(STORE_REFRESH_INTERVAL, refresh_from_store, "refreshing from the store")
+        if STATE_SNAPSHOT_INTERVAL:
+            lifecycle.every(STATE_SNAPSHOT_INTERVAL, lambda: asyncio.to_thread(save_state_snapshot), "saving the state snapshot")
+        if METRICS_PORT:
+            await metrics.start_server(METRICS_HOST, METRICS_PORT)
+        lifecycle.timer.begin('gateway')
+        bot_task = asyncio.create_task(bot.start(DISCORD_TOKEN))
+        # Runs until SIGTERM/SIGINT, or until the bot stops by itself
+        await lifecycle.wait_for_stop(bot_task)
     except KeyboardInterrupt:
         print("Bot stopped manually")
     finally:
+        print("Shutting down...")
+        # Finish the questions and lecture jobs in hand while still connected, then disconnect
+        await lifecycle.shutdown()
         await bot.close()
-
-# Run the asynchronous main function
-asyncio.run(main())
+        if bot_task is not None:
+            await asyncio.gather(bot_task, return_exceptions=True)
+        extractor.shutdown()
+        if STATE_SNAPSHOT_INTERVAL:
+            # Leave a fresh snapshot behind so the next start is warm
+            try:
+                await asyncio.to_thread(save_state_snapshot)
+            except Exception as e:
+                print(f"Error saving the state snapshot: {e}")
+        await store.close()
+        await openai_client.close()
+        loop_lag_monitor.stop()
+        await metrics.stop_server()
+        print(f"Metrics at shutdown:\n{metrics.summary()}")
+        print(f"OpenAI rate limits: {openai_client.dispatcher.stats()}")
+
+# Run the asynchronous main function (guarded so extraction worker processes can import this module)
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+import math
+from collections import Counter, defaultdict
+
+from similarity import normalize, tokenize
+
+
+class QuestionCluster:
+    __slots__ = ('cluster_id', 'count', 'centroid', 'norm', 'norm_questions', 'phrasings', 'originals')
+
+    def __init__(self, cluster_id: int):
+        self.cluster_id = cluster_id
+        self.count = 0
+        self.centroid = Counter()  # token -> number of questions in the cluster using it
+        self.norm = 0.0  # length of the IDF-weighted centroid
+        self.norm_questions = 0  # questions logged when `norm` was computed, 0 when it is stale
+        self.phrasings = Counter()  # normalized phrasing -> times asked
+        self.originals = {}  # normalized phrasing -> first original wording seen
+
+    # Most asked phrasings first, in their original wording
+    def representatives(self, limit: int = 3) -> list:
+        return [self.originals[phrasing] for phrasing, _ in self.phrasings.most_common(limit)]
+
+
+# Incremental clustering of logged questions.
+# Each question joins the cluster whose token centroid it is most similar to
+# (cosine similarity of IDF-weighted tokens, so words every question uses, like
+# "how", "work" or "python", count for little), or starts a new cluster. Document
+# frequencies are kept as questions arrive; a cluster's weighted length is
+# recomputed when it changes or once the log has grown by 10% since. Clusters are
+# kept ranked by count, so the top N is read off without rescanning the log.
+class QuestionClusters:
+    def __init__(self, threshold: float = 0.6, max_candidates: int = 200, max_phrasings: int = 20):
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.max_phrasings = max_phrasings
+        self.clear()
+
+    def clear(self):
+        self.clusters = []
+        self.document_frequency = Counter()  # token -> questions using it
+        self.question_count = 0
+        self.postings = defaultdict(set)  # token -> cluster ids whose centroid contains it
+        self.ranking = []  # cluster ids, most asked first
+        self.positions = {}  # cluster id -> index in ranking
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def _candidates(self, tokens: set) -> set:
+        candidates = set()
+        for token in sorted(tokens, key=lambda token: len(self.postings.get(token, ()))):
+            candidates.update(self.postings.get(token, ()))
+            if len(candidates) >= self.max_candidates:
+                break
+        return candidates
+
+    def _idf(self, token: str) -> float:
+        return math.log(1 + self.question_count / max(1, self.document_frequency[token]))
+
+    def _norm(self, cluster: QuestionCluster) -> float:
+        if not cluster.norm_questions or self.question_count > cluster.norm_questions * 1.1:
+            cluster.norm = math.sqrt(sum((count * self._idf(token)) ** 2 for token, count in cluster.centroid.items()))
+            cluster.norm_questions = self.question_count
+        return cluster.norm
+
+    # Cosine similarity of the question's IDF-weighted tokens, given as (token, idf squared) pairs, and a cluster's centroid
+    def _similarity(self, weights: list, question_norm: float, cluster: QuestionCluster) -> float:
+        centroid = cluster.centroid
+        overlap = sum(centroid.get(token, 0) * weight for token, weight in weights)
+        return overlap / (question_norm * self._norm(cluster)) if overlap else 0.0
+
+    # Move a cluster up the ranking after its count went up
+    def _promote(self, cluster_id: int):
+        position = self.positions[cluster_id]
+        count = self.clusters[cluster_id].count
+        while position > 0 and self.clusters[self.ranking[position - 1]].count < count:
+            above = self.ranking[position - 1]
+            self.ranking[position] = above
+            self.positions[above] = position
+            position -= 1
+        self.ranking[position] = cluster_id
+        self.positions[cluster_id] = position
+
+    # Assign a question to a cluster and return the cluster
+    def add(self, question: str):
+        phrasing = normalize(question)
+        tokens = set(tokenize(question))
+        if not tokens:
+            return None
+
+        self.question_count += 1
+        self.document_frequency.update(tokens)
+        weights = [(token, self._idf(token) ** 2) for token in tokens]
+        question_norm = math.sqrt(sum(weight for _, weight in weights))
+
+        best, best_score = None, self.threshold
+        for cluster_id in self._candidates(tokens):
+            score = self._similarity(weights, question_norm, self.clusters[cluster_id])
+            if score >= best_score:
+                best, best_score = self.clusters[cluster_id], score
+
+        if best is None:
+            best = QuestionCluster(len(self.clusters))
+            self.clusters.append(best)
+            self.positions[best.cluster_id] = len(self.ranking)
+            self.ranking.append(best.cluster_id)
+
+        best.count += 1
+        for token in tokens:
+            best.centroid[token] += 1
+            self.postings[token].add(best.cluster_id)
+        best.norm_questions = 0
+
+        best.phrasings[phrasing] += 1
+        best.originals.setdefault(phrasing, question.strip())
+        if len(best.phrasings) > self.max_phrasings:
+            rarest, _ = best.phrasings.most_common()[-1]
+            del best.phrasings[rarest]
+            del best.originals[rarest]
+
+        self._promote(best.cluster_id)
+        return best
+
+    # The clusters as JSON-safe data, most asked first, for a state snapshot
+    def snapshot(self) -> list:
+        return [
+            {
+                'count': cluster.count,
+                'centroid': dict(cluster.centroid),
+                'phrasings': dict(cluster.phrasings),
+                'originals': cluster.originals,
+            }
+            for cluster in self.ranked(0, len(self.ranking))
+        ]
+
+    # Load clusters saved by snapshot(), in place of the current ones
+    def restore(self, data: list):
+        self.clear()
+        for item in data:
+            cluster = QuestionCluster(len(self.clusters))
+            cluster.count = item['count']
+            cluster.centroid = Counter(item['centroid'])
+            cluster.phrasings = Counter(item['phrasings'])
+            cluster.originals = dict(item['originals'])
+            self.clusters.append(cluster)
+            self.positions[cluster.cluster_id] = len(self.ranking)
+            self.ranking.append(cluster.cluster_id)
+            # A centroid counts the questions using each token, so the document frequencies add up from them
+            self.question_count += cluster.count
+            self.document_frequency.update(cluster.centroid)
+            for token in cluster.centroid:
+                self.postings[token].add(cluster.cluster_id)
+
+    def rebuild(self, questions):
+        self.clear()
+        for question in questions:
+            if question:
+                self.add(question)
+
+    # Clusters at ranks [start, stop), most asked first
+    def ranked(self, start: int, stop: int) -> list:
+        return [self.clusters[cluster_id] for cluster_id in self.ranking[start:stop]]
@@ -0,0 +1,68 @@
+import asyncio
+import re
+
+from fuzzywuzzy import fuzz
+
+from similarity import normalize
+
+NUMBER_PATTERN = re.compile(r"\d+")
+
+
+# Single-flight coalescing of ChatGPT answers.
+# The first caller for a question runs the request; callers asking the same question
+# (equal normalized text) with the same scope while it is in flight await that request
+# instead of sending their own. With a `similarity_threshold`, near-identical wordings
+# (fuzz.ratio at or above it) are shared too, but only when they mention the same
+# numbers: "question 12" and "question 13" score over 90 and need different answers.
+class AnswerCoalescer:
+    def __init__(self, similarity_threshold: int = 0):
+        self.similarity_threshold = similarity_threshold
+        self.started = 0  # requests actually sent
+        self.shared = 0  # callers served by another caller's request
+        self._in_flight = {}  # (scope, normalized question) -> task producing the answer
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    # The in-flight task for the question, or None. Only a handful of requests are
+    # in flight at once, so near-identical questions are found with a linear scan.
+    def _find(self, scope, question: str):
+        task = self._in_flight.get((scope, question))
+        if task is not None or not self.similarity_threshold:
+            return task
+        numbers = NUMBER_PATTERN.findall(question)
+        best_score, best_task = 0, None
+        for (entry_scope, entry_question), entry_task in self._in_flight.items():
+            if entry_scope != scope or NUMBER_PATTERN.findall(entry_question) != numbers:
+                continue
+            score = fuzz.ratio(question, entry_question)
+            if score >= self.similarity_threshold and score > best_score:
+                best_score, best_task = score, entry_task
+        return best_task
+
+    # Run `work()` for the question unless an equivalent one is in flight.
+    # Returns (answer, shared) where `shared` is True when another caller's answer was reused.
+    async def run(self, question: str, scope, work):
+        normalized = normalize(question)
+        task = self._find(scope, normalized)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task), True
+
+        self.started += 1
+        key = (scope, normalized)
+        task = asyncio.ensure_future(work())
+        self._in_flight[key] = task
+        # Forget the request when it finishes, even if the caller that started it was cancelled
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def saved_rate(self) -> float:
+        total = self.started + self.shared
+        return self.shared / total if total else 0.0
+
+    def stats(self) -> str:
+        return (
+            f"Requests sent: {self.started}, answers shared: {self.shared} "
+            f"({self.saved_rate() * 100:.1f}% of questions), {len(self)} in flight"
+        )
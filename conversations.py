@@ -0,0 +1,127 @@
+from collections import deque
+
+from cachetools import TTLCache
+
+from prompts import MESSAGE_OVERHEAD_TOKENS
+from similarity import STOPWORDS, normalize
+from summarizer import estimate_tokens
+
+RECAP_PREFIX = "Earlier in this conversation the student asked: "
+
+# Words that point back at something said earlier, and openings that continue an earlier question
+FOLLOWUP_WORDS = frozenset("""
+it its this that these those they them their he she him her his above previous earlier
+again more else another instead same former latter one ones
+""".split())
+FOLLOWUP_OPENINGS = ("and ", "but ", "also ", "so ", "then ", "ok ", "okay ", "what about ", "how about ",
+                     "what if ", "what else ", "why not ", "thanks ")
+# Words that ask for more without naming a topic, as in "give me an example" or "explain please"
+VAGUE_WORDS = frozenset("example examples explain elaborate detail details mean meant give show tell".split())
+
+
+# Whether a question looks like it only makes sense after the earlier turns, e.g. "why is it
+# slower?", "what about in java?" or "an example please". Errs towards yes: such questions
+# skip the shared answer cache, so a false positive only costs an OpenAI call.
+def looks_like_followup(question: str) -> bool:
+    text = normalize(question)
+    words = text.split()
+    return (
+        (text + " ").startswith(FOLLOWUP_OPENINGS)
+        or any(word in FOLLOWUP_WORDS for word in words)
+        or all(word in STOPWORDS or word in VAGUE_WORDS for word in words)
+    )
+
+
+class Turn:
+    __slots__ = ('question', 'answer', 'tokens')
+
+    def __init__(self, question: str, answer: str, tokens: int):
+        self.question = question
+        self.answer = answer
+        self.tokens = tokens
+
+
+class Conversation:
+    __slots__ = ('turns', 'earlier_questions', 'tokens')
+
+    def __init__(self, max_earlier_questions: int):
+        self.turns = deque()
+        self.earlier_questions = deque(maxlen=max_earlier_questions)  # (question, tokens) of evicted turns
+        self.tokens = 0
+
+
+# Recent questions and answers per conversation (a user in the server, or a DM channel).
+# Each conversation keeps at most `max_turns` turns and `max_tokens` tokens; older
+# turns are evicted and only their questions are kept, as a one-line recap of what
+# the student asked before. Conversations idle for `ttl` seconds expire, and all of
+# them together are capped at `max_total_tokens`, least recently used dropped first.
+class ConversationMemory:
+    def __init__(self, count_tokens=estimate_tokens, max_turns: int = 6, max_tokens: int = 1500,
+                 ttl: float = 1800, max_total_tokens: int = 2_000_000, max_earlier_questions: int = 5):
+        self.count_tokens = count_tokens
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_earlier_questions = max_earlier_questions
+        self.conversations = TTLCache(
+            maxsize=max_total_tokens, ttl=ttl, getsizeof=lambda conversation: conversation.tokens + 1
+        )
+        self.evicted_turns = 0
+
+    def __len__(self):
+        return len(self.conversations)
+
+    @property
+    def tokens(self) -> int:
+        return self.conversations.currsize
+
+    def _evict_oldest(self, conversation: Conversation):
+        turn = conversation.turns.popleft()
+        conversation.tokens -= turn.tokens
+        self.evicted_turns += 1
+        if not self.max_earlier_questions:
+            return
+        if len(conversation.earlier_questions) == conversation.earlier_questions.maxlen:
+            _, dropped_tokens = conversation.earlier_questions[0]
+            conversation.tokens -= dropped_tokens
+        question_tokens = self.count_tokens(turn.question) + 2  # the "; " joining recap questions
+        conversation.earlier_questions.append((turn.question, question_tokens))
+        conversation.tokens += question_tokens
+
+    def add(self, key, question: str, answer: str):
+        if not self.max_turns:
+            return
+        conversation = self.conversations.get(key) or Conversation(self.max_earlier_questions)
+        tokens = self.count_tokens(question) + self.count_tokens(answer) + 2 * MESSAGE_OVERHEAD_TOKENS
+        conversation.turns.append(Turn(question, answer, tokens))
+        conversation.tokens += tokens
+        while conversation.turns and (len(conversation.turns) > self.max_turns or conversation.tokens > self.max_tokens):
+            self._evict_oldest(conversation)
+        # Store it again so its new size counts against the global cap and its idle timer restarts
+        self.conversations[key] = conversation
+
+    # Chat messages for the conversation's history, oldest first, and their token count
+    def messages(self, key):
+        conversation = self.conversations.get(key)
+        if conversation is None:
+            return [], 0
+        messages = []
+        if conversation.earlier_questions:
+            recap = "; ".join(question for question, _ in conversation.earlier_questions)
+            messages.append({'role': 'system', 'content': RECAP_PREFIX + recap})
+        for turn in conversation.turns:
+            messages.append({'role': 'user', 'content': turn.question})
+            messages.append({'role': 'assistant', 'content': turn.answer})
+        tokens = conversation.tokens
+        if conversation.earlier_questions:
+            tokens += self.count_tokens(RECAP_PREFIX) + MESSAGE_OVERHEAD_TOKENS
+        return messages, tokens
+
+    def clear(self):
+        self.conversations.clear()
+
+    def stats(self) -> str:
+        self.conversations.expire()
+        return (
+            f"{len(self.conversations)} conversations, {self.tokens} tokens held "
+            f"(cap {self.conversations.maxsize}), {self.evicted_turns} older turns folded into recaps"
+        )
@@ -0,0 +1,165 @@
+import asyncio
+import random
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Statuses worth retrying: rate limited, or a temporary server-side failure
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+# Parse OpenAI reset durations such as "1s", "250ms" or "6m0s" into seconds
+def parse_duration(value: str) -> float:
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION_PATTERN.findall(value))
+
+
+# Rough token count of a chat request (prompt characters / 4 plus room for the answer)
+def estimate_request_tokens(payload: dict, completion_tokens: int = 500) -> int:
+    characters = sum(len(message.get('content') or '') for message in payload.get('messages', []))
+    return characters // 4 + payload.get('max_tokens', completion_tokens)
+
+
+# Flow control for OpenAI requests.
+# Tracks requests and tokens sent in the last minute against the limits the API
+# reports in its x-ratelimit-* headers, pauses everyone after a 429, and sizes
+# concurrency from the account's request limit (cut in half on every 429 and
+# grown back one slot at a time), so bursts wait their turn instead of failing.
+class RateLimitDispatcher:
+    def __init__(self, initial_concurrency: int = 3, min_concurrency: int = 1, max_concurrency: int = 32,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 expected_latency: float = 10.0):
+        self.concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.ceiling = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expected_latency = expected_latency
+
+        self.in_flight = 0
+        self.request_limit = None  # per minute, from x-ratelimit-limit-requests
+        self.token_limit = None  # per minute, from x-ratelimit-limit-tokens
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+        self.paused_until = 0.0
+
+        self.retries = 0
+        self.throttled = 0
+        self._successes = 0
+        self._window = deque()  # (sent_at, tokens) for requests in the last minute
+        self._window_tokens = 0
+        self._condition = asyncio.Condition()
+
+    def _trim_window(self, now: float):
+        while self._window and now - self._window[0][0] >= 60:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    # Seconds until a request of `tokens` fits every known budget (0 when it fits now)
+    def _wait_time(self, tokens: int) -> float:
+        now = time.monotonic()
+        self._trim_window(now)
+        waits = [self.paused_until - now]
+        if self.remaining_requests is not None and self.remaining_requests <= 0:
+            waits.append(self.requests_reset_at - now)
+        if self.remaining_tokens is not None and self.remaining_tokens < tokens:
+            waits.append(self.tokens_reset_at - now)
+        if self._window:
+            window_free_at = self._window[0][0] + 60 - now
+            if self.request_limit is not None and len(self._window) >= self.request_limit:
+                waits.append(window_free_at)
+            if self.token_limit is not None and self._window_tokens + tokens > self.token_limit:
+                waits.append(window_free_at)
+        return max(waits)
+
+    # Hold one request slot for the duration of the block
+    @asynccontextmanager
+    async def slot(self, tokens: int):
+        async with self._condition:
+            while True:
+                delay = self._wait_time(tokens)
+                if delay <= 0 and self.in_flight < self.concurrency:
+                    break
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=delay if delay > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            self.in_flight += 1
+            self._window.append((time.monotonic(), tokens))
+            self._window_tokens += tokens
+            if self.remaining_requests is not None:
+                self.remaining_requests -= 1
+            if self.remaining_tokens is not None:
+                self.remaining_tokens -= tokens
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    # Record the limits the API reported and size concurrency from them
+    def update_from_headers(self, headers):
+        now = time.monotonic()
+        if 'x-ratelimit-limit-requests' in headers:
+            self.request_limit = int(headers['x-ratelimit-limit-requests'])
+            # Enough slots to use the per-minute limit at the expected request latency
+            per_second = self.request_limit / 60
+            self.ceiling = max(self.min_concurrency, min(self.max_concurrency, int(per_second * self.expected_latency)))
+            self.concurrency = min(self.concurrency, self.ceiling)
+        if 'x-ratelimit-limit-tokens' in headers:
+            self.token_limit = int(headers['x-ratelimit-limit-tokens'])
+        if 'x-ratelimit-remaining-requests' in headers:
+            self.remaining_requests = int(headers['x-ratelimit-remaining-requests'])
+            self.requests_reset_at = now + parse_duration(headers.get('x-ratelimit-reset-requests'))
+        if 'x-ratelimit-remaining-tokens' in headers:
+            self.remaining_tokens = int(headers['x-ratelimit-remaining-tokens'])
+            self.tokens_reset_at = now + parse_duration(headers.get('x-ratelimit-reset-tokens'))
+
+    def record_success(self):
+        self._successes += 1
+        if self._successes >= self.concurrency and self.concurrency < self.ceiling:
+            self._successes = 0
+            self.concurrency += 1
+
+    # Delay before retry number `attempt`: Retry-After when the server sent one, else jittered backoff
+    def retry_delay(self, attempt: int, headers=None) -> float:
+        self.retries += 1
+        if headers:
+            if 'retry-after-ms' in headers:
+                return float(headers['retry-after-ms']) / 1000
+            if 'retry-after' in headers:
+                try:
+                    return float(headers['retry-after'])
+                except ValueError:
+                    pass
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+
+    # After a 429, hold back every request until `delay` has passed and back off concurrency
+    def throttle(self, delay: float):
+        self.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+        self._successes = 0
+
+    def stats(self) -> str:
+        self._trim_window(time.monotonic())
+        return (
+            f"concurrency={self.concurrency}/{self.ceiling} in_flight={self.in_flight} "
+            f"rpm={len(self._window)}/{self.request_limit or '?'} "
+            f"tpm={self._window_tokens}/{self.token_limit or '?'} "
+            f"retries={self.retries} throttled={self.throttled}"
+        )
@@ -0,0 +1,327 @@
+import asyncio
+import concurrent.futures
+import io
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+import aiohttp
+import docx
+import pdfplumber
+import pytesseract
+from PIL import Image
+from pptx import Presentation
+
+from metrics import LatencyTracker
+
+
+class ExtractionError(Exception):
+    pass
+
+
+# --- Extraction functions. These run inside the executor, so they must stay top-level and picklable ---
+
+DOCX_PARAGRAPHS_PER_PAGE = 40  # .docx has no real pages, so group paragraphs instead
+OPEN_DOCUMENTS_PER_WORKER = 2
+
+# Documents parsed by this worker, so the batches of one upload that land on it parse
+# the file once instead of once per batch. Each is read into memory whole and the file
+# is closed, so a cached document never keeps an upload open (Windows couldn't delete it,
+# POSIX would keep its disk space). Keyed by the file's identity, since a temporary file
+# name can be reused. Only a couple are kept, and release_document() drops one early.
+_open_documents = OrderedDict()  # (path, inode, mtime, size) -> pdf pages, pptx slides or docx paragraph texts
+_open_documents_lock = threading.Lock()  # for the thread executor
+
+
+def _extension(filename: str) -> str:
+    return os.path.splitext(filename)[1].lower()
+
+
+def is_supported_document(filename: str) -> bool:
+    return _extension(filename) in (".pdf", ".docx", ".pptx")
+
+
+def _parse_document(path: str):
+    extension = _extension(path)
+    if extension == ".pdf":
+        # Reopening a PDF per batch would walk its whole page tree each time. Page objects
+        # are cheap until a page is read, and each is closed once its text is extracted.
+        with open(path, 'rb') as f:
+            return pdfplumber.open(io.BytesIO(f.read())).pages
+    if extension == ".pptx":
+        return list(Presentation(path).slides)
+    if extension == ".docx":
+        return [para.text for para in docx.Document(path).paragraphs]
+    raise ExtractionError(f"Unsupported file type '{extension}'")
+
+
+def _open_document(path: str):
+    stat = os.stat(path)
+    key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _open_documents_lock:
+        document = _open_documents.get(key)
+        if document is not None:
+            _open_documents.move_to_end(key)
+            return document
+    document = _parse_document(path)
+    with _open_documents_lock:
+        _open_documents[key] = document
+        while len(_open_documents) > OPEN_DOCUMENTS_PER_WORKER:
+            _open_documents.popitem(last=False)
+    return document
+
+
+# Drop a document from this worker's cache once its upload has been read
+def release_document(path: str):
+    with _open_documents_lock:
+        for key in [key for key in _open_documents if key[0] == path]:
+            del _open_documents[key]
+
+
+def count_pages(path: str) -> int:
+    document = _open_document(path)
+    if _extension(path) == ".docx":
+        return max(1, -(-len(document) // DOCX_PARAGRAPHS_PER_PAGE))
+    return len(document)
+
+
+# Run Tesseract on a preprocessed image. Its exceptions can't be pickled back from a
+# worker process (which breaks the whole pool), so they are re-raised as ExtractionError.
+def _ocr(image: Image.Image) -> str:
+    try:
+        return pytesseract.image_to_string(image)
+    except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError, OSError) as e:
+        raise ExtractionError(f"OCR failed: {e}") from None
+
+
+# OCR a PDF page that has no text layer (scanned slides)
+def _ocr_pdf_page(page, resolution: int) -> str:
+    image = page.to_image(resolution=resolution).original
+    return _ocr(preprocess_image(image))
+
+
+# Extract the text of pages [start, stop) of a document, one string per page
+def extract_pages(path: str, start: int, stop: int, ocr_resolution: int = 0) -> list:
+    extension = _extension(path)
+    document = _open_document(path)
+    texts = []
+    if extension == ".pdf":
+        for page in document[start:stop]:
+            text = page.extract_text() or ""
+            if not text.strip() and ocr_resolution:
+                text = _ocr_pdf_page(page, ocr_resolution)
+            texts.append(text)
+            page.close()  # drop the page's parsed objects before the next one
+    elif extension == ".pptx":
+        for slide in document[start:stop]:
+            texts.append("\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text")))
+    else:
+        for page in range(start, stop):
+            texts.append("\n".join(document[page * DOCX_PARAGRAPHS_PER_PAGE:(page + 1) * DOCX_PARAGRAPHS_PER_PAGE]))
+    return texts
+
+
+# Otsu's threshold: the gray level that best separates dark text from a light background
+def _otsu_threshold(histogram: list) -> int:
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background = background_weighted = 0
+    best_level, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        background_weighted += level * count
+        mean_background = background_weighted / background
+        mean_foreground = (weighted_total - background_weighted) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+# Shrink, grayscale and binarize an image so Tesseract has less (and cleaner) input to scan
+def preprocess_image(image: Image.Image, max_side: int = 2000, binarize: bool = True) -> Image.Image:
+    image = image.convert("L")
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+    if binarize:
+        threshold = _otsu_threshold(image.histogram())
+        image = image.point(lambda value: 255 if value > threshold else 0, mode="1")
+    return image
+
+
+def extract_image(data: bytes, max_side: int = 2000, binarize: bool = True) -> str:
+    image = Image.open(io.BytesIO(data))
+    return _ocr(preprocess_image(image, max_side, binarize))
+
+
+# Download an attachment to a temporary file in chunks, so large uploads never sit in memory whole.
+# The caller removes the file when done.
+async def spool_attachment(url: str, filename: str, max_bytes: int, chunk_size: int = 1024 * 1024) -> str:
+    fd, path = tempfile.mkstemp(suffix=_extension(filename))
+    try:
+        written = 0
+        with os.fdopen(fd, 'wb') as f:
+            # Attachments come from Discord's CDN, not OpenAI, so this doesn't use the pooled OpenAI session
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        written += len(chunk)
+                        if written > max_bytes:
+                            raise ExtractionError(f"File is larger than {max_bytes // (1024 * 1024)} MB")
+                        f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def is_archive(filename: str) -> bool:
+    return _extension(filename) == ".zip"
+
+
+# Unpack the supported documents in a .zip archive into temporary files; blocking, so run it in a thread.
+# Members are copied in chunks and refused past `max_bytes` each or `max_total_bytes` altogether,
+# whatever sizes the archive claims. Returns ([(filename, path)], [(filename, reason)] skipped);
+# the caller removes the files.
+def unpack_archive(path: str, max_bytes: int, max_total_bytes: int, max_files: int, chunk_size: int = 1024 * 1024):
+    documents, skipped = [], []
+    total = 0
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                filename = os.path.basename(info.filename)
+                if info.is_dir() or not filename or filename.startswith('.'):
+                    continue
+                if not is_supported_document(filename):
+                    skipped.append((filename, "not a .pdf, .docx or .pptx file"))
+                    continue
+                if len(documents) >= max_files:
+                    skipped.append((filename, f"more than {max_files} documents in the archive"))
+                    continue
+
+                fd, member_path = tempfile.mkstemp(suffix=_extension(filename))
+                written = 0
+                try:
+                    with os.fdopen(fd, 'wb') as out, archive.open(info) as member:
+                        while chunk := member.read(chunk_size):
+                            written += len(chunk)
+                            if written > max_bytes or total + written > max_total_bytes:
+                                raise ExtractionError("too large once unpacked")
+                            out.write(chunk)
+                except (ExtractionError, zipfile.BadZipFile, RuntimeError) as e:
+                    # RuntimeError: encrypted member
+                    os.remove(member_path)
+                    skipped.append((filename, str(e)))
+                    continue
+                total += written
+                documents.append((filename, member_path))
+    except zipfile.BadZipFile as e:
+        for _, member_path in documents:
+            os.remove(member_path)
+        raise ExtractionError(f"Not a valid .zip archive: {e}") from None
+    return documents, skipped
+
+
+# Runs document and image extraction off the event loop.
+# The backing executor is pluggable ("process" by default, or "thread"); the
+# concurrency cap is separate from the OpenAI semaphore so a burst of uploads
+# can't hold up questions and vice versa.
+class ExtractionExecutor:
+    def __init__(self, kind: str = "process", workers: int = 2, concurrency: int = 2,
+                 max_bytes: int = 50 * 1024 * 1024, max_pages: int = 500, timeout: float = 120,
+                 batch_pages: int = 10, ocr_resolution: int = 200,
+                 ocr_max_side: int = 2000, ocr_binarize: bool = True):
+        self.kind = kind
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.batch_pages = batch_pages
+        self.ocr_resolution = ocr_resolution  # 0 turns off OCR for image-only PDF pages
+        self.ocr_max_side = ocr_max_side
+        self.ocr_binarize = ocr_binarize
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.latency = LatencyTracker()  # per extraction function, e.g. extract_pages
+        self._executor = None
+
+    def _make_executor(self):
+        if self.kind == "thread":
+            return concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = self._make_executor()
+        return self._executor
+
+    # A timed-out job keeps its worker busy, so throw the pool away and stop its processes.
+    # Only `executor`, the pool the failed job ran on: other jobs on that pool fail with it
+    # and must not also throw away the fresh pool a later job has started.
+    def _reset_executor(self, executor):
+        if self._executor is executor:
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        # _processes is None once the pool has shut itself down after a crash
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+
+    async def run(self, function, *args):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            future = loop.run_in_executor(executor, function, *args)
+            try:
+                with self.latency.time(function.__name__):
+                    return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self._reset_executor(executor)
+                raise ExtractionError(f"Extraction took longer than {self.timeout:.0f} seconds")
+            except concurrent.futures.process.BrokenProcessPool:
+                self._reset_executor(executor)
+                raise ExtractionError("Extraction worker crashed")
+
+    def _check_size(self, data: bytes):
+        if len(data) > self.max_bytes:
+            raise ExtractionError(f"File is larger than {self.max_bytes // (1024 * 1024)} MB")
+
+    async def page_count(self, path: str) -> int:
+        return await self.run(count_pages, path)
+
+    # Yield (page number, total pages, text) for a .pdf/.docx/.pptx file on disk, given its
+    # page count if already known. Only the first `max_pages` pages are read, so callers
+    # should compare page_count() with max_pages to tell the user about the rest.
+    # Pages are extracted a batch at a time, so memory stays bounded on large decks.
+    async def iter_pages(self, path: str, page_count: int = None):
+        if page_count is None:
+            page_count = await self.page_count(path)
+        total = min(page_count, self.max_pages)
+        for start in range(0, total, self.batch_pages):
+            stop = min(start + self.batch_pages, total)
+            texts = await self.run(extract_pages, path, start, stop, self.ocr_resolution)
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, total, text
+
+    # Free the worker's parsed copy of a document once it has been read. With the process
+    # pool this reaches one worker; a copy on another is dropped as newer uploads replace it.
+    async def release(self, path: str):
+        try:
+            await self.run(release_document, path)
+        except ExtractionError as e:
+            print(f"Error releasing '{path}': {e}")
+
+    async def extract_image_text(self, data: bytes) -> str:
+        self._check_size(data)
+        return await self.run(extract_image, data, self.ocr_max_side, self.ocr_binarize)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,67 @@
+import asyncio
+
+from scheduler import SharedQueueWorkers
+
+
+# Background jobs that precompute results for new lectures (summary, keywords).
+# Jobs are rows in the store's lecture_jobs table, so they survive restarts and
+# any worker process sharing the database can run them. `handlers` maps a job
+# kind to a coroutine taking the lecture ID. A job that raises is retried after
+# `retry_delay` seconds, doubling each time, and marked failed after `max_attempts`.
+# Jobs left running by a process that died are picked up again after `claim_timeout` seconds.
+class LectureJobRunner(SharedQueueWorkers):
+    label = "Lecture job queue"
+    items = "lecture jobs"
+
+    def __init__(self, store, handlers: dict, worker_id: str, workers: int = 1, poll_interval: float = 5.0,
+                 claim_timeout: float = 1800, max_attempts: int = 3, retry_delay: float = 30):
+        super().__init__(store, worker_id, workers, poll_interval, claim_timeout)
+        self.handlers = handlers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.failed = 0
+        self.counts = {}  # status -> jobs across every worker process, as of the last count
+
+    # Queue every job kind for a lecture
+    async def submit(self, lecture_id: int):
+        await asyncio.to_thread(self.store.enqueue_lecture_jobs, lecture_id, list(self.handlers))
+        self._wakeup.set()
+
+    def _claim(self):
+        return self.store.claim_lecture_job(self.worker_id, self.claim_timeout)
+
+    async def _handle(self, job_id: int, lecture_id: int, kind: str, attempts: int):
+        handler = self.handlers.get(kind)
+        if handler is None:
+            await asyncio.to_thread(self.store.finish_lecture_job, job_id, 'failed', f"Unknown job kind '{kind}'")
+            return
+        if attempts >= self.max_attempts:
+            # Claimed this many times without finishing, e.g. it keeps crashing its worker
+            await asyncio.to_thread(self.store.finish_lecture_job, job_id, 'failed', "Gave up after repeated attempts")
+            self.failed += 1
+            return
+
+        try:
+            with self.latency.time(kind):
+                await handler(lecture_id)
+        except asyncio.CancelledError:
+            # Shutting down mid-job: let this or another worker run it again
+            await asyncio.to_thread(self.store.finish_lecture_job, job_id, 'pending')
+            raise
+        except Exception as e:
+            print(f"Error running {kind} job for lecture {lecture_id}: {e}")
+            if attempts + 1 < self.max_attempts:
+                retry_after = self.retry_delay * 2 ** attempts
+                await asyncio.to_thread(self.store.finish_lecture_job, job_id, 'pending', str(e), retry_after)
+            else:
+                await asyncio.to_thread(self.store.finish_lecture_job, job_id, 'failed', str(e))
+                self.failed += 1
+            return
+        await asyncio.to_thread(self.store.finish_lecture_job, job_id, 'done')
+        self.completed += 1
+
+    def _release_claims(self) -> int:
+        return self.store.release_lecture_claims(self.worker_id)
+
+    async def _refresh_counts(self):
+        self.counts = await asyncio.to_thread(self.store.lecture_job_counts)
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from contextlib import contextmanager
+
+
+# Wall-clock time of each startup phase, from when the timer is created until the bot is ready
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # phase name -> seconds, in the order they ran
+        self.ready_seconds = None
+        self._begun = {}  # phase name -> start time
+
+    @contextmanager
+    def phase(self, name: str):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    # begin()/end() time a phase that doesn't fit in one block, e.g. connecting to Discord
+    def begin(self, name: str):
+        self._begun[name] = time.perf_counter()
+
+    def end(self, name: str):
+        start = self._begun.pop(name, None)
+        if start is not None:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    # Record that startup finished; returns False if it already had
+    def mark_ready(self) -> bool:
+        if self.ready_seconds is not None:
+            return False
+        self.ready_seconds = time.perf_counter() - self.started
+        return True
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        total = f"ready after {self.ready_seconds:.2f}s" if self.ready_seconds is not None else "not ready yet"
+        return f"Startup {total} ({phases})"
+
+
+# Write JSON to a temporary file and rename it, so a crash mid-write never leaves a torn snapshot
+def write_json_atomic(path: str, data):
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary_path, path)
+
+
+# The JSON in `path`, or None when it is missing or unreadable
+def read_json(path: str):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Runs the bot's background loops and its shutdown.
+# SIGTERM and SIGINT set `stopping`; shutdown() then cancels the loops started with
+# every() and gives each registered drain callback up to `drain_timeout` seconds,
+# all at once, to finish the work it has in hand.
+class Lifecycle:
+    def __init__(self, drain_timeout: float = 8.0):
+        self.drain_timeout = drain_timeout
+        self.timer = StartupTimer()
+        self.stopping = asyncio.Event()
+        self._loops = []
+        self._drains = []  # (name, coroutine function taking the timeout and returning the items left)
+
+    # Stop on SIGTERM/SIGINT instead of being killed mid-answer. Not available on Windows,
+    # where Ctrl+C still interrupts the bot the old way.
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signal_number, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    # Call `function()` every `interval` seconds until shutdown, logging its errors
+    def every(self, interval: float, function, description: str):
+        async def run():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await function()
+                except Exception as e:
+                    print(f"Error {description}: {e}")
+        self._loops.append(asyncio.create_task(run()))
+
+    def on_drain(self, name: str, drain):
+        self._drains.append((name, drain))
+
+    # Wait until a stop signal arrives or `task` ends by itself (re-raising its error)
+    async def wait_for_stop(self, task: asyncio.Task):
+        stop = asyncio.ensure_future(self.stopping.wait())
+        try:
+            await asyncio.wait({task, stop}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+        if task.done():
+            task.result()
+
+    async def shutdown(self):
+        self.stopping.set()
+        for task in self._loops:
+            task.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        self._loops = []
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(drain(self.drain_timeout) for _, drain in self._drains), return_exceptions=True
+        )
+        for (name, _), result in zip(self._drains, results):
+            if isinstance(result, Exception):
+                print(f"Error draining the {name}: {result}")
+        print(f"Drained background work in {time.perf_counter() - start:.2f}s.")
@@ -0,0 +1,215 @@
+import asyncio
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Histogram bucket upper bounds in seconds, from fast cache hits to slow GPT-4 answers
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+# Rolling latency samples per name (e.g. per OpenAI endpoint) with percentile summaries,
+# plus cumulative histograms for the Prometheus endpoint
+class LatencyTracker:
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.counts = defaultdict(int)
+        self.sums = defaultdict(float)
+        self.buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))  # last bucket is +Inf
+
+    def record(self, name: str, seconds: float):
+        self.samples[name].append(seconds)
+        self.counts[name] += 1
+        self.sums[name] += seconds
+        self.buckets[name][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def time(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def percentile(self, name: str, percent: float) -> float:
+        samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self) -> str:
+        lines = []
+        for name in sorted(self.samples):
+            p50 = self.percentile(name, 50) * 1000
+            p99 = self.percentile(name, 99) * 1000
+            lines.append(f"{name}: count={self.counts[name]} p50={p50:.0f}ms p99={p99:.0f}ms")
+        return "\n".join(lines) if lines else "No samples recorded."
+
+
+# Measures how late the event loop wakes up from a short sleep; anything above
+# zero is time some coroutine spent blocking the loop
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.latency = LatencyTracker()
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.latency.record('event_loop_lag', max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Collects latency trackers and gauges from the bot's components and renders them
+# as Prometheus text (for the HTTP endpoint) or a readable summary (for /stats)
+class MetricsRegistry:
+    def __init__(self, namespace: str = "classbot"):
+        self.namespace = namespace
+        self.trackers = []  # (source, tracker)
+        self.gauges = []  # (name, help, function returning a number)
+        self._runner = None
+
+    def add_tracker(self, source: str, tracker: LatencyTracker):
+        self.trackers.append((source, tracker))
+
+    def gauge(self, name: str, help_text: str, function):
+        self.gauges.append((name, help_text, function))
+
+    def render_prometheus(self) -> str:
+        family = f"{self.namespace}_latency_seconds"
+        lines = [f"# HELP {family} Latency of bot operations.", f"# TYPE {family} histogram"]
+        for source, tracker in self.trackers:
+            for name in sorted(tracker.counts):
+                labels = f'source="{source}",name="{name}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), tracker.buckets[name]):
+                    cumulative += count
+                    lines.append(f'{family}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{family}_sum{{{labels}}} {tracker.sums[name]:.6f}")
+                lines.append(f"{family}_count{{{labels}}} {tracker.counts[name]}")
+
+        for name, help_text, function in self.gauges:
+            metric = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            try:
+                lines.append(f"{metric} {float(function())}")
+            except Exception as e:
+                print(f"Error reading metric {metric}: {e}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        sections = []
+        for source, tracker in self.trackers:
+            if tracker.counts:
+                sections.append(f"**{source}**\n{tracker.summary()}")
+        gauges = []
+        for name, _, function in self.gauges:
+            try:
+                gauges.append(f"{name}: {function():g}")
+            except Exception as e:
+                gauges.append(f"{name}: error ({e})")
+        if gauges:
+            sections.append("**gauges**\n" + "\n".join(gauges))
+        return "\n\n".join(sections) if sections else "No metrics recorded yet."
+
+    # Serve /metrics over HTTP on the given host and port
+    async def start_server(self, host: str, port: int):
+        async def handle_metrics(request):
+            return web.Response(text=self.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"Metrics available at http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Sampling profiler for the event loop thread.
+# A background thread records the loop thread's stack every `interval` seconds;
+# the report lists the functions (own time and cumulative) seen most often.
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.own = collections.Counter()
+        self.cumulative = collections.Counter()
+        self.sample_count = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _sample(self, thread_id: int):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            self.sample_count += 1
+            seen = set()
+            leaf = True
+            while frame is not None:
+                code = frame.f_code
+                location = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                if leaf:
+                    self.own[location] += 1
+                    leaf = False
+                if location not in seen:
+                    self.cumulative[location] += 1
+                    seen.add(location)
+                frame = frame.f_back
+
+    # Start sampling the calling thread (the event loop thread when called from a coroutine)
+    def start(self):
+        if self.running:
+            return
+        self.own.clear()
+        self.cumulative.clear()
+        self.sample_count = 0
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def report(self, top: int = 15) -> str:
+        if not self.sample_count:
+            return "No samples collected."
+        lines = [f"{self.sample_count} samples every {self.interval * 1000:.0f}ms", "", "Own time:"]
+        for location, count in self.own.most_common(top):
+            lines.append(f"{count / self.sample_count * 100:5.1f}%  {location}")
+        lines += ["", "Cumulative time:"]
+        for location, count in self.cumulative.most_common(top):
+            lines.append(f"{count / self.sample_count * 100:5.1f}%  {location}")
+        return "\n".join(lines)
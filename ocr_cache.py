@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+
+from cachetools import LRUCache
+
+from metrics import LatencyTracker
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def is_image(attachment) -> bool:
+    return attachment.filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+# Latest image attachment per channel, kept up to date from on_message so
+# /sayiac doesn't have to scan channel history on every call
+class LatestImages:
+    def __init__(self, history_limit: int = 50):
+        self.history_limit = history_limit
+        self.by_channel = {}  # channel id -> attachment
+
+    def observe(self, message):
+        for attachment in message.attachments:
+            if is_image(attachment):
+                self.by_channel[message.channel.id] = attachment
+                return
+
+    # Latest image in the channel, scanning history only when nothing has been seen yet
+    async def find(self, channel):
+        attachment = self.by_channel.get(channel.id)
+        if attachment is not None:
+            return attachment
+        async for message in channel.history(limit=self.history_limit):
+            for attachment in message.attachments:
+                if is_image(attachment):
+                    self.by_channel[channel.id] = attachment
+                    return attachment
+        return None
+
+
+# OCR results cached by attachment ID and by image content hash.
+# When many students ask about the same slide, only the first request downloads
+# and OCRs it; concurrent requests for the same attachment share that work.
+class OcrCache:
+    def __init__(self, extractor, max_entries: int = 512):
+        self.extractor = extractor
+        self.by_attachment = LRUCache(maxsize=max_entries)
+        self.by_hash = LRUCache(maxsize=max_entries)
+        self.latency = LatencyTracker()
+        self.hits = 0
+        self.misses = 0
+        self._in_flight = {}  # attachment id -> task OCRing it
+
+    async def _extract(self, attachment) -> str:
+        data = await attachment.read()
+        digest = hashlib.sha256(data).hexdigest()
+        text = self.by_hash.get(digest)
+        if text is None:
+            self.misses += 1
+            with self.latency.time('ocr'):
+                text = await self.extractor.extract_image_text(data)
+            self.by_hash[digest] = text
+        else:
+            self.hits += 1
+        self.by_attachment[attachment.id] = text
+        return text
+
+    async def extract_text(self, attachment) -> str:
+        text = self.by_attachment.get(attachment.id)
+        if text is not None:
+            self.hits += 1
+            return text
+
+        task = self._in_flight.get(attachment.id)
+        if task is not None:
+            self.hits += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._extract(attachment))
+        self._in_flight[attachment.id] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._in_flight.pop(attachment.id, None)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        return (
+            f"OCR lookups: {self.hits + self.misses} (hit rate {self.hit_rate() * 100:.1f}%), "
+            f"{len(self.by_hash)} images cached\n"
+            f"{self.latency.summary()}"
+        )
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from dispatcher import RETRY_STATUSES, RateLimitDispatcher, estimate_request_tokens
+from metrics import LatencyTracker
+
+
+# Long-lived OpenAI HTTP client owned by the bot.
+# One pooled aiohttp session is reused for every request so connections stay
+# alive between questions instead of paying a new TCP+TLS handshake each time.
+class OpenAIClient:
+    def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1",
+                 pool_limit: int = 20, limit_per_host: int = 10,
+                 timeout: float = 120, connect_timeout: float = 10, dispatcher: RateLimitDispatcher = None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.pool_limit = pool_limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.latency = LatencyTracker()
+        self.usage = defaultdict(lambda: {'prompt_tokens': 0, 'completion_tokens': 0})  # per model
+        self.dispatcher = dispatcher or RateLimitDispatcher()
+        self._session = None
+
+    # The session has to be created inside the running event loop, so do it on first use
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={
+                    'Authorization': f'Bearer {self.api_key}',
+                    'Content-Type': 'application/json'
+                },
+            )
+        return self._session
+
+    # Send a request, retrying rate limits, server errors and connection failures.
+    # Returns the open response; the caller must release it.
+    async def _send(self, endpoint: str, payload: dict):
+        session = self._get_session()
+        attempt = 0
+        while True:
+            try:
+                response = await session.post(f"{self.base_url}/{endpoint}", json=payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.dispatcher.max_retries:
+                    raise
+                delay = self.dispatcher.retry_delay(attempt)
+                reason = repr(e)
+            else:
+                self.dispatcher.update_from_headers(response.headers)
+                if response.status not in RETRY_STATUSES or attempt >= self.dispatcher.max_retries:
+                    if response.status == 200:
+                        self.dispatcher.record_success()
+                    return response
+                delay = self.dispatcher.retry_delay(attempt, response.headers)
+                if response.status == 429:
+                    self.dispatcher.throttle(delay)
+                reason = f"HTTP {response.status}"
+                response.release()
+
+            print(f"OpenAI request to {endpoint} failed ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Log and add up the token usage the API reported for one request
+    def _record_usage(self, model: str, usage: dict):
+        if not usage:
+            return
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        self.usage[model]['prompt_tokens'] += prompt_tokens
+        self.usage[model]['completion_tokens'] += completion_tokens
+        print(f"OpenAI {model}: {prompt_tokens} input tokens, {completion_tokens} output tokens")
+
+    def total_tokens(self, kind: str) -> int:
+        return sum(usage[kind] for usage in self.usage.values())
+
+    # POST a JSON payload to an API endpoint and return (status, response_json)
+    async def post(self, endpoint: str, payload: dict):
+        async with self.dispatcher.slot(estimate_request_tokens(payload)):
+            with self.latency.time(endpoint):
+                response = await self._send(endpoint, payload)
+                try:
+                    response_json = await response.json()
+                    if response.status == 200 and isinstance(response_json, dict):
+                        self._record_usage(payload.get('model'), response_json.get('usage'))
+                    return response.status, response_json
+                finally:
+                    response.release()
+
+    async def chat_completion(self, messages: list, model: str = 'gpt-4'):
+        return await self.post('chat/completions', {'model': model, 'messages': messages})
+
+    # Stream a chat completion, yielding content deltas as they arrive.
+    # Time to first token is recorded as "<endpoint>:first_token".
+    async def stream_chat_completion(self, messages: list, model: str = 'gpt-4'):
+        endpoint = 'chat/completions'
+        payload = {'model': model, 'messages': messages, 'stream': True, 'stream_options': {'include_usage': True}}
+        async with self.dispatcher.slot(estimate_request_tokens(payload)):
+            start = time.perf_counter()
+            first_token = True
+            response = await self._send(endpoint, payload)
+            async with response:
+                if response.status != 200:
+                    raise RuntimeError(f"OpenAI returned {response.status}: {await response.text()}")
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    event = json.loads(data)
+                    self._record_usage(model, event.get('usage'))  # sent in the last event
+                    choices = event.get('choices') or [{}]
+                    delta = choices[0].get('delta', {}).get('content')
+                    if delta:
+                        if first_token:
+                            self.latency.record(f"{endpoint}:first_token", time.perf_counter() - start)
+                            first_token = False
+                        yield delta
+            self.latency.record(f"{endpoint}:stream", time.perf_counter() - start)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
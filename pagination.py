@@ -0,0 +1,122 @@
+import itertools
+
+import discord
+
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+# One part of a paginated listing. `count()` returns how many items it has right now and
+# `lines(start, stop)` renders only items [start, stop), so drawing a page never walks
+# the rest of the underlying cache. An empty section takes one line for `empty_message`.
+class Section:
+    def __init__(self, header: str, count, lines, empty_message: str = "None."):
+        self.header = header
+        self.count = count
+        self.lines = lines
+        self.empty_message = empty_message
+
+    def size(self) -> int:
+        return max(1, self.count())
+
+    def render(self, start: int, stop: int):
+        if not self.count():
+            return [self.empty_message]
+        return self.lines(start, stop)
+
+
+# Lines for items [start, stop) of a list, with random access so any page costs the same
+def list_lines(items: list, format_item):
+    return lambda start, stop: (format_item(start + offset, item) for offset, item in enumerate(items[start:stop]))
+
+
+# Lines for items [start, stop) of a dict; reaching a late page skips the earlier keys without formatting them
+def mapping_lines(mapping: dict, format_item):
+    return lambda start, stop: (
+        format_item(start + offset, key, value)
+        for offset, (key, value) in enumerate(itertools.islice(mapping.items(), start, stop))
+    )
+
+
+# Renders one page of one or more sections, `per_page` items to a page, within Discord's
+# message limit. Sizes are read again on every render, so pages reflect the caches as they are now.
+class Paginator:
+    def __init__(self, sections: list, per_page: int = 10, title: str = "", max_chars: int = DISCORD_MESSAGE_LIMIT,
+                 max_line_chars: int = 300):
+        self.sections = sections
+        self.per_page = max(1, per_page)
+        self.title = title
+        self.max_chars = max_chars
+        self.max_line_chars = max_line_chars
+
+    def page_count(self) -> int:
+        total = sum(section.size() for section in self.sections)
+        return max(1, -(-total // self.per_page))
+
+    # Render a 1-based page number (clamped to the pages there are); returns (text, page, page count)
+    def render(self, page: int):
+        pages = self.page_count()
+        page = min(max(1, page), pages)
+        start = (page - 1) * self.per_page
+        stop = start + self.per_page
+
+        parts = [self.title] if self.title else []
+        offset = 0
+        for section in self.sections:
+            size = section.size()
+            first, last = max(start - offset, 0), min(stop - offset, size)
+            if first < last:
+                header = section.header if first == 0 else f"{section.header} (continued)"
+                lines = [line if len(line) <= self.max_line_chars else line[:self.max_line_chars - 3] + "..."
+                         for line in section.render(first, last)]
+                parts.append(header + "\n" + "\n".join(lines))
+            offset += size
+            if offset >= stop:
+                break
+
+        footer = f"\n\nPage {page}/{pages}" if pages > 1 else ""
+        body = "\n\n".join(parts)
+        if len(body) + len(footer) > self.max_chars:
+            body = body[:self.max_chars - len(footer) - 3] + "..."
+        return body + footer, page, pages
+
+
+# Previous/Next buttons that re-render a paginator in place.
+# Only the member who ran the command can turn its pages.
+class PageView(discord.ui.View):
+    def __init__(self, paginator: Paginator, page: int, user_id: int, timeout: float = 300):
+        super().__init__(timeout=timeout)
+        self.paginator = paginator
+        self.page = page
+        self.user_id = user_id
+        self._update_buttons(paginator.page_count())
+
+    def _update_buttons(self, pages: int):
+        self.previous_page.disabled = self.page <= 1
+        self.next_page.disabled = self.page >= pages
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("Run the command yourself to browse these pages.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        content, self.page, pages = self.paginator.render(page)
+        self._update_buttons(pages)
+        await interaction.response.edit_message(content=content, view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+
+# Send one page of a listing through `send` (e.g. interaction.followup.send), with buttons when there are more
+async def send_page(send, paginator: Paginator, page: int, user_id: int, **kwargs):
+    content, page, pages = paginator.render(page)
+    if pages > 1:
+        kwargs['view'] = PageView(paginator, page, user_id)
+    await send(content, **kwargs)
@@ -0,0 +1,131 @@
+import hashlib
+
+try:
+    import tiktoken
+except ImportError:  # optional: without it tokens are estimated from the text length
+    tiktoken = None
+
+from summarizer import estimate_tokens
+
+# Tokens the chat format adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# Counts and trims text in model tokens, with tiktoken's encoding for the model when
+# it is installed and the four-characters-per-token estimate otherwise
+class Tokenizer:
+    def __init__(self, model: str = 'gpt-4'):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # The encoding is downloaded on first use, which fails offline
+                print(f"Could not load the tokenizer for {model}, estimating tokens instead: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is None:
+            return estimate_tokens(text)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    # The longest prefix of `text` that fits in `max_tokens`
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            return text if estimate_tokens(text) <= max_tokens else text[:max_tokens * 4]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+
+class Prompt:
+    __slots__ = ('text', 'tokens', 'model', 'lecture_ids', 'context_hash', 'trimmed')
+
+    def __init__(self, text: str, tokens: int, model: str, lecture_ids=(), context_hash: str = "", trimmed=()):
+        self.text = text
+        self.tokens = tokens
+        self.model = model
+        self.lecture_ids = list(lecture_ids)
+        self.context_hash = context_hash  # hash of the lecture material included, for the answer cache
+        self.trimmed = tuple(trimmed)  # names of the parts that were cut to fit
+
+
+# Assembles question prompts within a token budget.
+# Parts are fitted by priority: the instructions and the student's question always go
+# in (the question trimmed to `question_max_tokens`), then the image text (up to
+# `image_max_tokens`), then retrieved lecture passages best first, skipping those
+# that don't fit. Prompts of at most `fast_model_max_tokens` go to `fast_model` when one is set.
+class PromptBuilder:
+    def __init__(self, model: str = 'gpt-4', max_tokens: int = 6000, question_max_tokens: int = 1000,
+                 image_max_tokens: int = 1500, fast_model: str = "", fast_model_max_tokens: int = 0):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.question_max_tokens = question_max_tokens
+        self.image_max_tokens = image_max_tokens
+        self.fast_model = fast_model
+        self.fast_model_max_tokens = fast_model_max_tokens
+        self.tokenizer = Tokenizer(model)
+
+    def count(self, text: str) -> int:
+        return self.tokenizer.count(text)
+
+    def choose_model(self, tokens: int) -> str:
+        if self.fast_model and tokens <= self.fast_model_max_tokens:
+            return self.fast_model
+        return self.model
+
+    # `passages` are (lecture label, lecture id, text) tuples, best match first.
+    # `reserved_tokens` is budget already taken by other messages, e.g. conversation history.
+    def build(self, instructions: str, question: str, passages=(), image_text: str = "",
+              reserved_tokens: int = 0) -> Prompt:
+        trimmed = []
+        question_part = f'\n\nStudentQuestion: "{question}"'
+        if self.count(question_part) > self.question_max_tokens:
+            question_part = f'\n\nStudentQuestion: "{self.tokenizer.truncate(question, self.question_max_tokens)}"'
+            trimmed.append('question')
+        used = reserved_tokens + MESSAGE_OVERHEAD_TOKENS + self.count(instructions) + self.count(question_part)
+
+        image_part = ""
+        if image_text:
+            header = '\n\nImageAsText: ""'
+            allowed = min(self.image_max_tokens, self.max_tokens - used - self.count(header))
+            text = self.tokenizer.truncate(image_text, allowed)
+            if text != image_text:
+                trimmed.append('image')
+            if text:
+                image_part = f'\n\nImageAsText: "{text}"'
+                used += self.count(image_part)
+
+        material_header = ' Use the lecture material below when it is relevant.\n\nLectureMaterial:\n'
+        used += self.count(material_header)
+        sections = []
+        lecture_ids = set()
+        for label, lecture_id, text in passages:
+            section = f"[{label}]\n{text}"
+            tokens = self.count(section) + 2  # the blank line joining sections
+            if used + tokens > self.max_tokens:
+                # Leave this one out, a shorter lower-ranked passage may still fit
+                if 'passages' not in trimmed:
+                    trimmed.append('passages')
+                continue
+            sections.append(section)
+            lecture_ids.add(lecture_id)
+            used += tokens
+
+        if sections:
+            lecture_material = "\n\n".join(sections)
+            text = f'{instructions}{material_header}{lecture_material}{image_part}{question_part}'
+            context_hash = hashlib.sha256(lecture_material.encode('utf-8')).hexdigest()
+        else:
+            text = f'{instructions}{image_part}{question_part}'
+            context_hash = ""
+        if image_part:
+            # Answers about an image depend on the image, so keep them apart in the answer cache
+            context_hash = hashlib.sha256(f"{context_hash}\0{image_part}".encode('utf-8')).hexdigest()
+
+        tokens = reserved_tokens + self.count(text) + MESSAGE_OVERHEAD_TOKENS
+        return Prompt(text, tokens, self.choose_model(tokens), sorted(lecture_ids), context_hash, trimmed)
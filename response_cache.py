@@ -0,0 +1,171 @@
+import hashlib
+import sys
+
+from cachetools import TTLCache
+
+from similarity import QuestionIndex, normalize
+
+
+# Approximate memory used by a cached answer (str of ASCII text is about one byte per character)
+def answer_size(answer) -> int:
+    return sys.getsizeof(answer.question) + sys.getsizeof(answer.response) + 64
+
+
+class CachedAnswer:
+    __slots__ = ('question', 'response', 'lecture_ids')
+
+    def __init__(self, question: str, response: str, lecture_ids=()):
+        self.question = question
+        self.response = response
+        self.lecture_ids = tuple(sorted(lecture_ids))
+
+
+# TTL + LRU cache bounded by total answer size that reports what it drops
+class _BoundedCache(TTLCache):
+    def __init__(self, max_bytes: int, ttl: float, on_remove):
+        super().__init__(maxsize=max_bytes, ttl=ttl, getsizeof=answer_size)
+        self.on_remove = on_remove
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        key, answer = super().popitem()
+        self.evictions += 1
+        self.on_remove(key, answer)
+        return key, answer
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for key, answer in expired:
+            self.expirations += 1
+            self.on_remove(key, answer)
+        return expired
+
+    # Clearing isn't eviction, so delete entries directly instead of through popitem
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+
+# Two-tier answer cache.
+# The exact layer is keyed on the normalized question, the model and a hash of
+# the lecture context sent with it; the similarity layer reuses the answer of a
+# close enough earlier question that drew on the same lectures, so uploading a
+# lecture relevant to a question stops older answers to it from being reused.
+# Both layers are bounded by size and TTL with LRU eviction, and entries are
+# dropped when a lecture they were based on is removed. `error_responses` are
+# never cached, even when they were logged as answers.
+class ResponseCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 7 * 24 * 3600,
+                 similarity_threshold: int = 60, error_responses=()):
+        self.similarity_threshold = similarity_threshold
+        self.error_responses = frozenset(error_responses)
+        self.index = QuestionIndex()
+        self.exact = _BoundedCache(max_bytes // 2, ttl, self._forget)
+        self.similar = _BoundedCache(max_bytes // 2, ttl, self._forget_similar)
+        self.lecture_keys = {}  # lecture id -> {(layer, key)} of answers based on it
+        self.hits = {'exact': 0, 'similar': 0}
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def exact_key(question: str, model: str, context_hash: str = "") -> str:
+        return hashlib.sha256(f"{model}\0{context_hash}\0{normalize(question)}".encode('utf-8')).hexdigest()
+
+    def _layer(self, name: str) -> _BoundedCache:
+        return self.exact if name == 'exact' else self.similar
+
+    def _forget(self, key, answer, layer='exact'):
+        for lecture_id in answer.lecture_ids:
+            keys = self.lecture_keys.get(lecture_id)
+            if keys is not None:
+                keys.discard((layer, key))
+                if not keys:
+                    del self.lecture_keys[lecture_id]
+
+    def _forget_similar(self, entry_id, answer):
+        self.index.remove(entry_id)
+        self._forget(entry_id, answer, 'similar')
+
+    def _track(self, answer: CachedAnswer, layer: str, key):
+        for lecture_id in answer.lecture_ids:
+            self.lecture_keys.setdefault(lecture_id, set()).add((layer, key))
+
+    # Return a cached response for the question, or None.
+    # `lecture_ids` are the lectures the question's prompt would draw on.
+    def get(self, question: str, model: str, context_hash: str = "", lecture_ids=()):
+        answer = self.exact.get(self.exact_key(question, model, context_hash))
+        if answer is not None:
+            self.hits['exact'] += 1
+            return answer.response
+
+        self.similar.expire()
+        entry_id = self.index.best_match(question, self.similarity_threshold)
+        if entry_id is not None:
+            answer = self.similar.get(entry_id)  # refreshes its LRU position
+            if answer is not None and answer.lecture_ids == tuple(sorted(lecture_ids)):
+                self.hits['similar'] += 1
+                return answer.response
+
+        self.misses += 1
+        return None
+
+    def put(self, question: str, model: str, context_hash: str, response: str, lecture_ids=()):
+        answer = CachedAnswer(question, response, lecture_ids)
+        if response in self.error_responses or answer_size(answer) > self.exact.maxsize:
+            return
+
+        key = self.exact_key(question, model, context_hash)
+        self.exact[key] = answer
+        entry_id = self.index.add({'question': question, 'response': response})
+        self.similar[entry_id] = answer
+        self._track(answer, 'exact', key)
+        self._track(answer, 'similar', entry_id)
+
+    # Seed the similarity layer with previously logged interactions (oldest first).
+    # Follow-up answers only make sense after the conversation they were part of, so they are skipped.
+    def warm(self, interactions):
+        for entry in interactions:
+            if not entry.get('question') or not entry.get('response') or entry.get('followup'):
+                continue
+            if entry['response'] in self.error_responses:
+                continue
+            answer = CachedAnswer(entry['question'], entry['response'], entry.get('lecture_ids', ()))
+            if answer_size(answer) <= self.similar.maxsize:
+                entry_id = self.index.add(entry)
+                self.similar[entry_id] = answer
+                self._track(answer, 'similar', entry_id)
+
+    # Drop every answer that was based on the lecture
+    def invalidate_lecture(self, lecture_id):
+        for layer, key in self.lecture_keys.pop(lecture_id, set()):
+            answer = self._layer(layer).pop(key, None)
+            if answer is None:
+                continue
+            self.invalidations += 1
+            if layer == 'similar':
+                self._forget_similar(key, answer)
+            else:
+                self._forget(key, answer)
+
+    def clear(self):
+        self.exact.clear()
+        self.similar.clear()
+        self.index.clear()
+        self.lecture_keys.clear()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits['exact'] + self.hits['similar'] + self.misses
+        return (self.hits['exact'] + self.hits['similar']) / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        lookups = self.hits['exact'] + self.hits['similar'] + self.misses
+        return (
+            f"Lookups: {lookups} (hit rate {self.hit_rate() * 100:.1f}%)\n"
+            f"Exact hits: {self.hits['exact']}, similar hits: {self.hits['similar']}, misses: {self.misses}\n"
+            f"Exact layer: {len(self.exact)} answers, {self.exact.currsize // 1024} KB, "
+            f"{self.exact.evictions} evicted, {self.exact.expirations} expired\n"
+            f"Similarity layer: {len(self.similar)} answers, {self.similar.currsize // 1024} KB, "
+            f"{self.similar.evictions} evicted, {self.similar.expirations} expired\n"
+            f"Invalidated by lecture changes: {self.invalidations}"
+        )
@@ -0,0 +1,183 @@
+import heapq
+import json
+import math
+import os
+import zlib
+from collections import Counter, defaultdict
+
+from similarity import tokenize
+from summarizer import split_into_chunks
+
+
+# Split a lecture into passages and count their terms; pure CPU work, safe to run in a thread
+def build_passages(text: str, passage_tokens: int = 250) -> list:
+    passages = []
+    for passage in split_into_chunks(text, passage_tokens):
+        terms = Counter(tokenize(passage))
+        if terms:
+            passages.append({'text': passage, 'terms': dict(terms)})
+    return passages
+
+
+# BM25 index over lecture passages.
+# Each lecture's passages are persisted as their own JSON file in `directory`,
+# so adding or removing a lecture only touches that lecture's file. With `compress`
+# the passage text held in memory is zlib-compressed and only the passages a
+# search returns are decompressed. Lectures a LectureIndexWriter is still adding are
+# left out of search results until it commits them.
+class LectureIndex:
+    def __init__(self, directory: str = "lecture_index", k1: float = 1.5, b: float = 0.75, compress: bool = True):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.compress = compress
+        self.uncommitted = set()  # lecture ids a writer is still adding
+        self._reset()
+
+    def _reset(self):
+        self.passages = {}  # passage id -> (lecture id, text, length, terms)
+        self.lecture_passages = defaultdict(list)  # lecture id -> passage ids
+        self.postings = defaultdict(dict)  # term -> {passage id: term frequency}
+        self.total_length = 0
+        self._next_id = 0
+
+    def __contains__(self, lecture_id):
+        return lecture_id in self.lecture_passages
+
+    def _path(self, lecture_id) -> str:
+        return os.path.join(self.directory, f"{lecture_id}.json")
+
+    def _insert(self, lecture_id, passages: list):
+        for passage in passages:
+            passage_id = self._next_id
+            self._next_id += 1
+            length = sum(passage['terms'].values())
+            text = zlib.compress(passage['text'].encode('utf-8')) if self.compress else passage['text']
+            self.passages[passage_id] = (lecture_id, text, length, tuple(passage['terms']))
+            self.lecture_passages[lecture_id].append(passage_id)
+            self.total_length += length
+            for term, count in passage['terms'].items():
+                self.postings[term][passage_id] = count
+
+    # Add (or replace) a lecture's passages and persist them
+    def add_lecture(self, lecture_id, passages: list):
+        writer = self.writer(lecture_id)
+        writer.add(passages)
+        writer.commit()
+
+    # Add a lecture's passages a batch at a time, e.g. page by page while it is ingested
+    def writer(self, lecture_id):
+        return LectureIndexWriter(self, lecture_id)
+
+    def remove_lecture(self, lecture_id):
+        for passage_id in self.lecture_passages.pop(lecture_id, []):
+            _, _, length, terms = self.passages.pop(passage_id)
+            self.total_length -= length
+            for term in terms:
+                posting = self.postings[term]
+                del posting[passage_id]
+                if not posting:
+                    del self.postings[term]
+        if os.path.exists(self._path(lecture_id)):
+            os.remove(self._path(lecture_id))
+
+    def clear(self):
+        self._reset()
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith(".json"):
+                    os.remove(os.path.join(self.directory, filename))
+
+    # Load every persisted lecture; returns the lecture ids found on disk
+    def load(self) -> list:
+        self._reset()
+        if not os.path.isdir(self.directory):
+            return []
+        lecture_ids = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+            lecture_id = int(filename[:-len(".json")])
+            try:
+                with open(os.path.join(self.directory, filename), 'r') as f:
+                    self._insert(lecture_id, json.load(f))
+                lecture_ids.append(lecture_id)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable lecture index file '{filename}': {e}")
+        return lecture_ids
+
+    # Return up to `top_k` (score, lecture id, passage text) tuples, best first
+    def search(self, query: str, top_k: int = 3) -> list:
+        if not self.passages:
+            return []
+        count = len(self.passages)
+        average_length = self.total_length / count
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for passage_id, frequency in posting.items():
+                length = self.passages[passage_id][2]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[passage_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        results = scores.items()
+        if self.uncommitted:
+            results = [(pid, score) for pid, score in results if self.passages[pid][0] not in self.uncommitted]
+        best = heapq.nlargest(top_k, results, key=lambda item: item[1])
+        return [(score, self.passages[pid][0], self._text(pid)) for pid, score in best]
+
+    # The `top_n` terms that best characterize a lecture: frequent in its passages, rare in the others
+    def keywords(self, lecture_id, top_n: int = 10) -> list:
+        count = len(self.passages)
+        scores = defaultdict(float)
+        for passage_id in self.lecture_passages.get(lecture_id, ()):
+            for term in self.passages[passage_id][3]:
+                posting = self.postings[term]
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                scores[term] += posting[passage_id] * idf
+        best = heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])
+        return [term for term, _ in best]
+
+    def _text(self, passage_id) -> str:
+        text = self.passages[passage_id][1]
+        return zlib.decompress(text).decode('utf-8') if self.compress else text
+
+
+# Adds one lecture to a LectureIndex incrementally. Each batch of passages goes into the
+# in-memory index and is appended to a temporary file at once, so nothing holds the
+# whole lecture's passages. The lecture stays out of search() until commit(), which
+# also renames the file into place, so other worker processes never load a half-written
+# lecture either. abort() takes the lecture back out.
+class LectureIndexWriter:
+    def __init__(self, index: LectureIndex, lecture_id):
+        self.index = index
+        self.lecture_id = lecture_id
+        index.remove_lecture(lecture_id)
+        index.uncommitted.add(lecture_id)
+        os.makedirs(index.directory, exist_ok=True)
+        self.temporary_path = f"{index._path(lecture_id)}.{os.getpid()}.tmp"
+        self._file = open(self.temporary_path, 'w')
+        self._file.write("[")
+        self._count = 0
+
+    def add(self, passages: list):
+        self.index._insert(self.lecture_id, passages)
+        for passage in passages:
+            self._file.write(("," if self._count else "") + json.dumps(passage))
+            self._count += 1
+
+    def commit(self):
+        self._file.write("]")
+        self._file.close()
+        os.replace(self.temporary_path, self.index._path(self.lecture_id))
+        self.index.uncommitted.discard(self.lecture_id)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.temporary_path)
+        self.index.remove_lecture(self.lecture_id)
+        self.index.uncommitted.discard(self.lecture_id)
@@ -0,0 +1,267 @@
+import asyncio
+import time
+from collections import deque
+
+from metrics import LatencyTracker
+
+
+# Fair work queue for questions answered in the background.
+# Pending items are grouped per user and workers take them round-robin across
+# users (lower priority numbers first), so one student flooding DMs only delays
+# their own questions. Workers sleep on a semaphore instead of polling.
+class QuestionScheduler:
+    def __init__(self, handler, workers: int = 3, max_depth: int = 100, max_per_user: int = 5):
+        self.handler = handler
+        self.worker_count = workers
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.latency = LatencyTracker()
+        self.depth = 0
+        self.active = 0  # items being handled right now
+        self.completed = 0
+        self.rejected = 0
+        self.closed = False  # set while draining, new items are turned away
+        self._pending = {}  # priority -> {user_id: deque of (enqueued_at, item)}
+        self._turns = {}  # priority -> deque of user ids waiting for their turn
+        self._available = asyncio.Semaphore(0)
+        self._workers = []
+
+    def __len__(self):
+        return self.depth
+
+    # Queue an item for `user_id`; returns False when the queue is full and the caller should say so
+    async def submit(self, user_id, item, priority: int = 1) -> bool:
+        user_queues = self._pending.setdefault(priority, {})
+        user_queue = user_queues.get(user_id)
+        if self.closed or self.depth >= self.max_depth or (user_queue and len(user_queue) >= self.max_per_user):
+            self.rejected += 1
+            return False
+
+        if user_queue is None:
+            user_queue = user_queues[user_id] = deque()
+            self._turns.setdefault(priority, deque()).append(user_id)
+        user_queue.append((time.perf_counter(), item))
+        self.depth += 1
+        self._available.release()
+        return True
+
+    # Take the next item: highest priority first, then the user whose turn it is
+    def _next(self):
+        for priority in sorted(self._turns):
+            turns = self._turns[priority]
+            if not turns:
+                continue
+            user_id = turns.popleft()
+            user_queue = self._pending[priority][user_id]
+            enqueued_at, item = user_queue.popleft()
+            if user_queue:
+                turns.append(user_id)
+            else:
+                del self._pending[priority][user_id]
+            self.depth -= 1
+            return enqueued_at, item
+        raise RuntimeError("Question queue is empty")
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            enqueued_at, item = self._next()
+            self.latency.record('queue_wait', time.perf_counter() - enqueued_at)
+            self.active += 1
+            try:
+                with self.latency.time('queue_service'):
+                    await self.handler(*item)
+            except Exception as e:
+                print(f"Error processing queued question: {e}")
+            finally:
+                self.active -= 1
+            self.completed += 1
+
+    # Start the worker tasks; calling this again while they run does nothing
+    async def start(self):
+        self._workers = [task for task in self._workers if not task.done()]
+        for _ in range(self.worker_count - len(self._workers)):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # Stop taking new items, answer the queued ones for up to `timeout` seconds, then stop.
+    # The queue lives in memory, so whatever is left at the deadline is lost; returns how many.
+    async def drain(self, timeout: float) -> int:
+        self.closed = True
+        deadline = time.monotonic() + timeout
+        while (self.depth or self.active) and self._workers and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        left = self.depth + self.active
+        await self.stop()
+        if left:
+            print(f"Question queue: {left} questions left unanswered at shutdown.")
+        return left
+
+
+# Worker tasks that claim items from a queue kept in the store, shared by several bot processes.
+# Subclasses say how to claim, handle and count items and how to hand back the claims of a
+# previous run. Local submits call `_wakeup.set()` to wake the workers at once; items queued
+# by other processes are picked up within `poll_interval` seconds. The counts are refreshed
+# every poll interval too, off the event loop, so metrics and /stats never wait on the database.
+class SharedQueueWorkers:
+    label = "Shared queue"  # names the queue in log messages
+    items = "items"
+
+    def __init__(self, store, worker_id: str, workers: int, poll_interval: float, claim_timeout: float):
+        self.store = store
+        self.worker_id = worker_id
+        self.worker_count = workers
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.latency = LatencyTracker()
+        self.active = 0  # workers claiming or handling an item right now
+        self.completed = 0
+        self.closed = False  # set while draining, no new items are claimed
+        self._wakeup = asyncio.Event()
+        self._starting = asyncio.Lock()
+        self._workers = []
+        self._counter = None
+
+    # Claim the next item for this worker, or None when there is nothing to do; runs in a thread
+    def _claim(self):
+        raise NotImplementedError
+
+    async def _handle(self, *job):
+        raise NotImplementedError
+
+    # Hand back the items this worker had claimed before a restart; returns how many
+    def _release_claims(self) -> int:
+        raise NotImplementedError
+
+    async def _refresh_counts(self):
+        raise NotImplementedError
+
+    async def _worker(self):
+        while not self.closed:
+            self._wakeup.clear()
+            self.active += 1
+            try:
+                job = await asyncio.to_thread(self._claim)
+                if job is not None:
+                    await self._handle(*job)
+            except Exception as e:
+                # e.g. the database is locked: keep the worker alive and try again after a poll interval
+                print(f"Error in the {self.label.lower()}: {e}")
+                job = None
+            finally:
+                self.active -= 1
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _count(self):
+        while True:
+            try:
+                await self._refresh_counts()
+            except Exception as e:
+                print(f"Error counting the {self.label.lower()}: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    # Start the worker tasks; calling this again while they run does nothing.
+    # Items this worker had claimed before a restart go back in the queue first,
+    # before any worker claims a new one.
+    async def start(self):
+        async with self._starting:
+            self._workers = [task for task in self._workers if not task.done()]
+            if not self._workers:
+                released = await asyncio.to_thread(self._release_claims)
+                if released:
+                    print(f"Requeued {released} {self.items} left unfinished by {self.worker_id}.")
+            for _ in range(self.worker_count - len(self._workers)):
+                self._workers.append(asyncio.create_task(self._worker()))
+            if self._counter is None or self._counter.done():
+                self._counter = asyncio.create_task(self._count())
+
+    async def stop(self):
+        tasks = self._workers + ([self._counter] if self._counter is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._counter = None
+
+    # Stop claiming items and finish the ones in hand for up to `timeout` seconds, then stop.
+    # Items still unfinished at the deadline go back in the shared queue; returns how many.
+    async def drain(self, timeout: float) -> int:
+        self.closed = True
+        self._wakeup.set()
+        if self._workers:
+            await asyncio.wait(self._workers, timeout=timeout)
+        left = self.active
+        await self.stop()
+        if left:
+            print(f"{self.label}: {left} {self.items} handed back to the queue at shutdown.")
+        return left
+
+
+# Question queue shared by several bot processes through the store.
+# Items are rows in the store's question_jobs table, so a question received by one
+# process can be answered by any of them. `encode` turns an item into JSON-safe data
+# and `decode` rebuilds it in the process that claims it. Items left claimed by a
+# process that died are handed out again after `claim_timeout` seconds.
+class SharedQuestionScheduler(SharedQueueWorkers):
+    label = "Shared question queue"
+    items = "questions"
+
+    def __init__(self, handler, store, encode, decode, worker_id: str, workers: int = 3,
+                 max_depth: int = 100, max_per_user: int = 5, poll_interval: float = 1.0,
+                 claim_timeout: float = 600):
+        super().__init__(store, worker_id, workers, poll_interval, claim_timeout)
+        self.handler = handler
+        self.encode = encode
+        self.decode = decode
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.rejected = 0
+        self.depth = 0  # items waiting in the shared queue across every process, as of the last count
+
+    def __len__(self):
+        return self.depth
+
+    async def submit(self, user_id, item, priority: int = 1) -> bool:
+        if self.closed:
+            self.rejected += 1
+            return False
+        accepted = await asyncio.to_thread(
+            self.store.enqueue_question, user_id, priority, self.encode(*item), self.max_depth, self.max_per_user
+        )
+        if not accepted:
+            self.rejected += 1
+            return False
+        self._wakeup.set()
+        return True
+
+    def _claim(self):
+        return self.store.claim_question(self.worker_id, self.claim_timeout)
+
+    async def _handle(self, job_id: int, enqueued_at: float, data: dict):
+        self.latency.record('queue_wait', max(0.0, time.time() - enqueued_at))
+        try:
+            with self.latency.time('queue_service'):
+                await self.handler(*self.decode(data))
+        except asyncio.CancelledError:
+            # Shutting down mid-answer: let another worker answer it instead
+            await asyncio.to_thread(self.store.release_question, job_id)
+            raise
+        except Exception as e:
+            print(f"Error processing queued question: {e}")
+        await asyncio.to_thread(self.store.finish_question, job_id)
+        self.completed += 1
+
+    def _release_claims(self) -> int:
+        return self.store.release_claims(self.worker_id)
+
+    async def _refresh_counts(self):
+        self.depth = await asyncio.to_thread(self.store.pending_questions)
@@ -0,0 +1,39 @@
+# Run the bot as one process per shard, all sharing the same store and question queue.
+# Usage: python shards.py 4   (starts shards 0-3, each in its own process)
+import os
+import signal
+import subprocess
+import sys
+
+
+def main():
+    shard_count = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv('SHARD_COUNT', '2'))
+    metrics_port = int(os.getenv('METRICS_PORT', '9108'))
+
+    processes = []
+    for shard_id in range(shard_count):
+        env = dict(os.environ)
+        env.update({
+            'SHARD_COUNT': str(shard_count),
+            'SHARD_IDS': str(shard_id),
+            'QUEUE_BACKEND': 'shared',
+            'WORKER_ID': f"shard-{shard_id}",
+            # Each process serves its own metrics, on consecutive ports
+            'METRICS_PORT': str(metrics_port + shard_id if metrics_port else 0),
+        })
+        processes.append(subprocess.Popen([sys.executable, 'bot.py'], env=env))
+        print(f"Started shard {shard_id} of {shard_count} (pid {processes[-1].pid})")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        print("Stopping shards...")
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+from fuzzywuzzy import fuzz
+
+# Words that appear in almost every student question and say nothing about the topic
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does did for from how i if in into is it its
+me my of on or please so that the their them then there these this to was what whats
+when where which who why will with would you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# Lowercase the question and join its words, so spacing, case and punctuation don't matter
+def normalize(text: str) -> str:
+    return " ".join(TOKEN_PATTERN.findall(text.lower().replace("'", "")))
+
+
+# Lowercase the question and split it into index tokens, dropping stopwords when possible
+def tokenize(text: str) -> list:
+    words = TOKEN_PATTERN.findall(text.lower().replace("'", ""))
+    tokens = [word for word in words if word not in STOPWORDS]
+    return tokens or words
+
+
+# Inverted token index over cached questions.
+# Lookups only fuzzy-rank the shortlist of questions sharing rare tokens with the
+# new question instead of calling fuzz.ratio on the whole interaction log.
+class QuestionIndex:
+    def __init__(self, shortlist_size: int = 50, max_df_ratio: float = 0.05):
+        self.shortlist_size = shortlist_size
+        self.max_df_ratio = max_df_ratio
+        self.clear()
+
+    def clear(self):
+        self.questions = {}  # entry id -> lowercased question text
+        self.postings = defaultdict(set)  # token -> entry ids containing it
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.questions)
+
+    # Add one interaction and return its entry id; entries without a response
+    # (queued DMs) are not answers to reuse, so they are skipped and None is returned
+    def add(self, entry: dict):
+        question = entry.get('question')
+        response = entry.get('response')
+        if not question or not response:
+            return None
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self.questions[entry_id] = question.lower()
+        for token in set(tokenize(question)):
+            self.postings[token].add(entry_id)
+        return entry_id
+
+    def remove(self, entry_id):
+        question = self.questions.pop(entry_id, None)
+        if question is None:
+            return
+        for token in set(tokenize(question)):
+            posting = self.postings[token]
+            posting.discard(entry_id)
+            if not posting:
+                del self.postings[token]
+
+    def rebuild(self, entries):
+        self.clear()
+        for entry in entries:
+            self.add(entry)
+
+    # Candidate entry ids ranked by the summed IDF of the tokens they share with the question
+    def candidates(self, question: str) -> list:
+        total = len(self.questions)
+        tokens = [token for token in set(tokenize(question)) if token in self.postings]
+        if not tokens:
+            return []
+
+        # Visit rare tokens first and skip very common ones once something rarer matched
+        tokens.sort(key=lambda token: len(self.postings[token]))
+        max_df = max(1, int(total * self.max_df_ratio))
+
+        scores = Counter()
+        for token in tokens:
+            posting = self.postings[token]
+            if scores and len(posting) > max_df:
+                break
+            idf = math.log(1 + total / len(posting))
+            for entry_id in posting:
+                scores[entry_id] += idf
+
+        return [entry_id for entry_id, _ in scores.most_common(self.shortlist_size)]
+
+    # Return the entry id of the closest question scoring at least `threshold`
+    def best_match(self, question: str, threshold: int = 60):
+        new_question = question.lower()
+        new_length = len(new_question)
+
+        best_score = threshold - 1
+        best_id = None
+        for entry_id in self.candidates(question):
+            existing_question = self.questions[entry_id]
+
+            # fuzz.ratio can't reach the threshold when the lengths are too far apart
+            shorter, longer = sorted((new_length, len(existing_question)))
+            if 200 * shorter < threshold * (shorter + longer):
+                continue
+
+            similarity = fuzz.ratio(existing_question, new_question)
+            if similarity > best_score:
+                best_score = similarity
+                best_id = entry_id
+        return best_id
@@ -0,0 +1,502 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from cachetools import LRUCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lectures (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL,
+    filetype TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lecture_pages (
+    lecture_id INTEGER NOT NULL,
+    page_number INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (lecture_id, page_number)
+);
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    question TEXT,
+    response TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS lecture_ids (
+    id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS question_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE TABLE IF NOT EXISTS question_turns (
+    user_id TEXT PRIMARY KEY,
+    served_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lecture_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lecture_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    run_after REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    finished_at REAL,
+    UNIQUE (lecture_id, kind)
+);
+CREATE TABLE IF NOT EXISTS lecture_artifacts (
+    lecture_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    value BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (lecture_id, kind)
+);
+"""
+
+# Next question job: highest priority first, then round-robin across users (the user
+# served longest ago goes next, users new to the queue wait from when they joined it),
+# then the oldest of that user's jobs
+CLAIM_QUESTION = """
+SELECT id, user_id, enqueued_at, payload FROM question_jobs AS job
+WHERE claimed_by IS NULL OR claimed_at < ?
+ORDER BY priority,
+    COALESCE((SELECT served_at FROM question_turns WHERE question_turns.user_id = job.user_id), job.enqueued_at),
+    id
+LIMIT 1
+"""
+
+# Next lecture job: pending jobs due to run, or running jobs whose worker stopped
+# reporting back (claimed before the cutoff), oldest first
+CLAIM_LECTURE_JOB = """
+SELECT id, lecture_id, kind, attempts FROM lecture_jobs
+WHERE (status = 'pending' AND run_after <= ?) OR (status = 'running' AND claimed_at < ?)
+ORDER BY run_after, id
+LIMIT 1
+"""
+
+
+# Lecture text is stored zlib-compressed; rows written before that hold plain text
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode('utf-8'), 6)
+
+
+def decompress_text(value) -> str:
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value or ""
+
+
+# Metadata of a stored lecture, the only part of it kept in memory
+class LectureRecord:
+    __slots__ = ('filename', 'filetype')
+
+    def __init__(self, filename: str, filetype: str):
+        self.filename = filename
+        self.filetype = filetype
+
+
+# SQLite-backed store for lectures and interactions.
+# Records are queued as they are created and committed in batches every
+# `flush_interval` seconds (synchronous=FULL, so each commit is fsynced).
+# Only lecture metadata is loaded at startup; bodies are stored compressed, read
+# on demand through the memory-mapped database and kept in a small LRU while hot.
+# Several worker processes can share one database: lecture IDs and question jobs
+# are committed immediately, and interactions record the `worker_id` that wrote them.
+class ClassroomStore:
+    def __init__(self, path: str = "classroom.db", flush_interval: float = 2.0, worker_id: str = "",
+                 content_cache_bytes: int = 16 * 1024 * 1024, mmap_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.worker_id = worker_id
+        self._content_lock = threading.Lock()  # guards _content_cache, reads come from several threads
+        self._content_cache = LRUCache(maxsize=content_cache_bytes, getsizeof=len)  # lecture id -> decompressed text
+        self.content_hits = 0
+        self.content_misses = 0
+        self._pending_lock = threading.Lock()  # guards _pending, only ever held briefly
+        self._db_lock = threading.RLock()  # guards the connection
+        self._pending = []  # (sql, params) waiting for the next commit
+        self._flush_task = None
+        # Other processes may hold the write lock briefly, so wait for it instead of failing
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(interactions)")}
+        if 'worker' not in columns:
+            self._conn.execute("ALTER TABLE interactions ADD COLUMN worker TEXT")
+        if 'followup' not in columns:
+            self._conn.execute("ALTER TABLE interactions ADD COLUMN followup INTEGER NOT NULL DEFAULT 0")
+        if 'lecture_ids' not in columns:
+            self._conn.execute("ALTER TABLE interactions ADD COLUMN lecture_ids TEXT")
+        self._conn.commit()
+
+    # --- Writes (queued, committed by flush) ---
+
+    def _queue(self, sql: str, params: tuple = ()):
+        with self._pending_lock:
+            self._pending.append((sql, params))
+
+    def _forget_content(self, lecture_id=None):
+        with self._content_lock:
+            if lecture_id is None:
+                self._content_cache.clear()
+            else:
+                self._content_cache.pop(lecture_id, None)
+
+    # Lectures ingested page by page keep an empty `content` and store their text in lecture_pages
+    def add_lecture(self, lecture_id: int, filename: str, filetype: str, content: str = ""):
+        self._forget_content(lecture_id)
+        self._queue(
+            "INSERT OR REPLACE INTO lectures (id, filename, filetype, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (lecture_id, filename, filetype, compress_text(content) if content else "", time.time()),
+        )
+
+    def add_lecture_page(self, lecture_id: int, page_number: int, text: str):
+        self._forget_content(lecture_id)
+        self._queue(
+            "INSERT OR REPLACE INTO lecture_pages (lecture_id, page_number, text) VALUES (?, ?, ?)",
+            (lecture_id, page_number, compress_text(text)),
+        )
+
+    def delete_lecture(self, lecture_id: int):
+        self._forget_content(lecture_id)
+        self._queue("DELETE FROM lectures WHERE id = ?", (lecture_id,))
+        self._queue("DELETE FROM lecture_pages WHERE lecture_id = ?", (lecture_id,))
+        self._queue("DELETE FROM lecture_artifacts WHERE lecture_id = ?", (lecture_id,))
+        self._queue("DELETE FROM lecture_jobs WHERE lecture_id = ?", (lecture_id,))
+
+    # Results precomputed for a lecture, e.g. its summary, stored compressed by kind
+    def put_lecture_artifact(self, lecture_id: int, kind: str, value: str):
+        self._queue(
+            "INSERT OR REPLACE INTO lecture_artifacts (lecture_id, kind, value, created_at) VALUES (?, ?, ?, ?)",
+            (lecture_id, kind, compress_text(value), time.time()),
+        )
+
+    # `lecture_ids` are the lectures the answer drew on, stored as comma-separated IDs
+    def add_interaction(self, entry: dict):
+        lecture_ids = entry.get('lecture_ids')
+        self._queue(
+            "INSERT INTO interactions (user_id, question, response, created_at, worker, followup, lecture_ids) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(entry.get('user_id')), entry.get('question'), entry.get('response'), time.time(), self.worker_id,
+             int(bool(entry.get('followup'))), ",".join(map(str, lecture_ids)) if lecture_ids is not None else None),
+        )
+
+    # Delete every lecture and interaction. Returns the new generation, which tells
+    # other worker processes to drop their in-memory copies.
+    def clear(self) -> str:
+        generation = uuid.uuid4().hex
+        self._forget_content()
+        self._queue("DELETE FROM lectures")
+        self._queue("DELETE FROM lecture_pages")
+        self._queue("DELETE FROM interactions")
+        self._queue("DELETE FROM lecture_artifacts")
+        self._queue("DELETE FROM lecture_jobs")
+        self._queue("INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (generation,))
+        return generation
+
+    # Commit every queued write in one transaction; blocking, so call it from a thread
+    def flush(self):
+        with self._db_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                with self._conn:
+                    for sql, params in pending:
+                        self._conn.execute(sql, params)
+            except sqlite3.Error:
+                # Keep the batch so the next flush retries it
+                with self._pending_lock:
+                    self._pending[:0] = pending
+                raise
+        return len(pending)
+
+    # Run `function(connection)` in its own transaction, committed before returning.
+    # Used for state other processes act on right away; blocking, so call it from a thread.
+    def _write_now(self, function):
+        with self._db_lock:
+            self.flush()
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                return function(self._conn)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except sqlite3.Error as e:
+                print(f"Error writing to the store: {e}")
+
+    # Start the periodic flush task; calling this again while it runs does nothing
+    def start(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await asyncio.to_thread(self.flush)
+        self._conn.close()
+
+    # --- Reads (pending writes are flushed first so reads see them) ---
+
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        with self._db_lock:
+            self.flush()
+            return self._conn.execute(sql, params).fetchall()
+
+    def load_lectures(self) -> dict:
+        rows = self._read("SELECT id, filename, filetype FROM lectures ORDER BY id")
+        return {lecture_id: LectureRecord(filename, filetype) for lecture_id, filename, filetype in rows}
+
+    # Interactions stored after `after_id` (and up to `until_id`), skipping those written by `exclude_worker`.
+    # Returns (highest interaction id, entries) so the next call can continue from there.
+    def load_interactions_since(self, after_id: int = 0, exclude_worker: str = None, until_id: int = None):
+        rows = self._read(
+            "SELECT id, user_id, question, response, worker, followup, lecture_ids FROM interactions "
+            "WHERE id > ? AND id <= ? ORDER BY id",
+            (after_id, until_id if until_id is not None else 2 ** 63 - 1),
+        )
+        interactions = []
+        for interaction_id, user_id, question, response, worker, followup, lecture_ids in rows:
+            after_id = interaction_id
+            if exclude_worker is not None and worker == exclude_worker:
+                continue
+            entry = {'user_id': user_id, 'question': question}
+            if response is not None:
+                entry['response'] = response
+            if followup:
+                entry['followup'] = True
+            if lecture_ids is not None:
+                entry['lecture_ids'] = [int(lecture_id) for lecture_id in lecture_ids.split(",") if lecture_id]
+            interactions.append(entry)
+        return after_id, interactions
+
+    def get_lecture_content(self, lecture_id: int):
+        with self._content_lock:
+            content = self._content_cache.get(lecture_id)
+        if content is not None:
+            self.content_hits += 1
+            return content
+
+        self.content_misses += 1
+        rows = self._read("SELECT content FROM lectures WHERE id = ?", (lecture_id,))
+        if not rows:
+            return None
+        pages = self._read(
+            "SELECT text FROM lecture_pages WHERE lecture_id = ? ORDER BY page_number", (lecture_id,)
+        )
+        if pages:
+            content = "\n\n".join(decompress_text(text) for text, in pages)
+        else:
+            content = decompress_text(rows[0][0])
+
+        if len(content) <= self._content_cache.maxsize:
+            with self._content_lock:
+                self._content_cache[lecture_id] = content
+        return content
+
+    def get_lecture_artifact(self, lecture_id: int, kind: str):
+        rows = self._read("SELECT value FROM lecture_artifacts WHERE lecture_id = ? AND kind = ?", (lecture_id, kind))
+        return decompress_text(rows[0][0]) if rows else None
+
+    def content_hit_rate(self) -> float:
+        lookups = self.content_hits + self.content_misses
+        return self.content_hits / lookups if lookups else 0.0
+
+    def content_stats(self) -> str:
+        return (
+            f"Lookups: {self.content_hits + self.content_misses} (hit rate {self.content_hit_rate() * 100:.1f}%), "
+            f"{len(self._content_cache)} lectures, {self._content_cache.currsize // 1024} KB decompressed"
+        )
+
+    # --- Coordination between worker processes ---
+
+    # Changes whenever another connection (e.g. another worker process) commits to the database
+    def data_version(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # Changes whenever the store is cleared
+    def generation(self) -> str:
+        rows = self._read("SELECT value FROM meta WHERE key = 'generation'")
+        return rows[0][0] if rows else ""
+
+    # Hand out the next free lecture ID, unique across every process sharing the database
+    def reserve_lecture_id(self) -> int:
+        def reserve(conn):
+            (lecture_id,) = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) + 1 FROM (SELECT id FROM lectures UNION ALL SELECT id FROM lecture_ids)"
+            ).fetchone()
+            conn.execute("INSERT INTO lecture_ids (id) VALUES (?)", (lecture_id,))
+            return lecture_id
+        return self._write_now(reserve)
+
+    # Queue a question job; returns False when the queue or the user's share of it is full
+    def enqueue_question(self, user_id, priority: int, payload: dict, max_depth: int, max_per_user: int) -> bool:
+        def enqueue(conn):
+            (depth,) = conn.execute("SELECT COUNT(*) FROM question_jobs WHERE claimed_by IS NULL").fetchone()
+            (user_depth,) = conn.execute(
+                "SELECT COUNT(*) FROM question_jobs WHERE claimed_by IS NULL AND user_id = ? AND priority = ?",
+                (str(user_id), priority),
+            ).fetchone()
+            if depth >= max_depth or user_depth >= max_per_user:
+                return False
+            conn.execute(
+                "INSERT INTO question_jobs (user_id, priority, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+                (str(user_id), priority, json.dumps(payload), time.time()),
+            )
+            return True
+        return self._write_now(enqueue)
+
+    # Claim the next question job for `worker`, taking over jobs claimed more than
+    # `claim_timeout` seconds ago by a worker that never finished them.
+    # Returns (job id, enqueued_at, payload) or None when the queue is empty.
+    def claim_question(self, worker: str, claim_timeout: float):
+        def claim(conn):
+            now = time.time()
+            row = conn.execute(CLAIM_QUESTION, (now - claim_timeout,)).fetchone()
+            if row is None:
+                return None
+            job_id, user_id, enqueued_at, payload = row
+            conn.execute(
+                "UPDATE question_jobs SET claimed_by = ?, claimed_at = ? WHERE id = ?", (worker, now, job_id)
+            )
+            conn.execute("INSERT OR REPLACE INTO question_turns (user_id, served_at) VALUES (?, ?)", (user_id, now))
+            return job_id, enqueued_at, json.loads(payload)
+        return self._write_now(claim)
+
+    # Remove a finished job, forgetting the turns of users with nothing left in the queue
+    def finish_question(self, job_id: int):
+        def finish(conn):
+            conn.execute("DELETE FROM question_jobs WHERE id = ?", (job_id,))
+            conn.execute("DELETE FROM question_turns WHERE user_id NOT IN (SELECT user_id FROM question_jobs)")
+        self._write_now(finish)
+
+    # Put a claimed job back so another worker can take it
+    def release_question(self, job_id: int):
+        self._write_now(lambda conn: conn.execute(
+            "UPDATE question_jobs SET claimed_by = NULL, claimed_at = NULL WHERE id = ?", (job_id,)
+        ))
+
+    # Put back every job `worker` had claimed, e.g. when it restarts after a crash
+    def release_claims(self, worker: str) -> int:
+        return self._write_now(lambda conn: conn.execute(
+            "UPDATE question_jobs SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ?", (worker,)
+        ).rowcount)
+
+    def pending_questions(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM question_jobs WHERE claimed_by IS NULL").fetchone()[0]
+
+    # --- Background lecture jobs (summaries, keywords), kept until done so they survive restarts ---
+
+    # Queue one job per kind for a lecture, resetting any earlier job of that kind
+    def enqueue_lecture_jobs(self, lecture_id: int, kinds):
+        def enqueue(conn):
+            now = time.time()
+            for kind in kinds:
+                conn.execute(
+                    "INSERT OR REPLACE INTO lecture_jobs (lecture_id, kind, status, run_after) VALUES (?, ?, 'pending', ?)",
+                    (lecture_id, kind, now),
+                )
+        self._write_now(enqueue)
+
+    # Claim the next lecture job for `worker`, taking over jobs claimed more than
+    # `claim_timeout` seconds ago. Returns (job id, lecture id, kind, attempts so far) or None.
+    def claim_lecture_job(self, worker: str, claim_timeout: float):
+        def claim(conn):
+            now = time.time()
+            row = conn.execute(CLAIM_LECTURE_JOB, (now, now - claim_timeout)).fetchone()
+            if row is None:
+                return None
+            job_id, lecture_id, kind, attempts = row
+            conn.execute(
+                "UPDATE lecture_jobs SET status = 'running', attempts = attempts + 1, claimed_by = ?, claimed_at = ? "
+                "WHERE id = ?",
+                (worker, now, job_id),
+            )
+            return job_id, lecture_id, kind, attempts
+        return self._write_now(claim)
+
+    # Record a job's outcome: "done", "failed", or "pending" again after `retry_after` seconds
+    def finish_lecture_job(self, job_id: int, status: str, error: str = None, retry_after: float = 0):
+        def finish(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE lecture_jobs SET status = ?, error = ?, run_after = ?, claimed_by = NULL, claimed_at = NULL, "
+                "finished_at = ? WHERE id = ?",
+                (status, error, now + retry_after, None if status == 'pending' else now, job_id),
+            )
+        self._write_now(finish)
+
+    # Put back every lecture job `worker` was running, e.g. when it restarts after a crash
+    def release_lecture_claims(self, worker: str) -> int:
+        return self._write_now(lambda conn: conn.execute(
+            "UPDATE lecture_jobs SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+            "WHERE status = 'running' AND claimed_by = ?", (worker,)
+        ).rowcount)
+
+    # Job counts by status, e.g. {'pending': 3, 'done': 10}
+    def lecture_job_counts(self) -> dict:
+        return dict(self._read("SELECT status, COUNT(*) FROM lecture_jobs GROUP BY status"))
+
+    # Most recent jobs first, as (lecture id, kind, status, attempts, error) tuples
+    def lecture_jobs(self, lecture_id: int = None, limit: int = 20) -> list:
+        if lecture_id is None:
+            return self._read(
+                "SELECT lecture_id, kind, status, attempts, error FROM lecture_jobs ORDER BY id DESC LIMIT ?", (limit,)
+            )
+        return self._read(
+            "SELECT lecture_id, kind, status, attempts, error FROM lecture_jobs WHERE lecture_id = ? ORDER BY id",
+            (lecture_id,),
+        )
+
+    # --- One-time import of the old cache.txt JSON file ---
+
+    def migrate_from_json(self, cache_file: str = "cache.txt") -> bool:
+        migrated = self._read("SELECT value FROM meta WHERE key = 'migrated_cache_file'")
+        if migrated or not os.path.exists(cache_file):
+            return False
+
+        try:
+            with open(cache_file, 'r') as f:
+                cache_data = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Error decoding {cache_file}, nothing to migrate.")
+            return False
+
+        for lecture_id, lecture in cache_data.get('lectures', {}).items():
+            self.add_lecture(int(lecture_id), lecture['filename'], lecture['filetype'], lecture['content'])
+        for entry in cache_data.get('interactions', []):
+            self.add_interaction(entry)
+        self._queue("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_cache_file', ?)", (cache_file,))
+        self.flush()
+
+        os.replace(cache_file, cache_file + ".migrated")
+        print(f"Migrated {cache_file} into {self.path}.")
+        return True
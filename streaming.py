@@ -0,0 +1,141 @@
+import asyncio
+import time
+from collections import deque
+
+from cachetools import TTLCache
+
+DISCORD_MESSAGE_LIMIT = 2000
+CODE_FENCE = "```"
+
+
+# Split `text` into a head of at most `limit` characters and the remaining tail.
+# Prefers line breaks, then spaces, so words aren't cut in half. If the cut falls
+# inside a code block, the block is closed in the head and reopened in the tail.
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT):
+    if len(text) <= limit:
+        return text, ""
+
+    search_limit = limit - len(CODE_FENCE) - 1  # leave room to close an open code block
+    cut = text.rfind("\n", 0, search_limit)
+    if cut < search_limit // 2:
+        cut = text.rfind(" ", 0, search_limit)
+    if cut <= 0:
+        cut = search_limit
+
+    head, tail = text[:cut], text[cut:].lstrip(" ")
+    if head.count(CODE_FENCE) % 2 == 1:
+        opening = head.rfind(CODE_FENCE)
+        if opening >= limit // 4:
+            # Plenty of text before the block, so move the whole block to the next message
+            head, tail = text[:opening], text[opening:]
+        else:
+            language = head[opening + len(CODE_FENCE):].split("\n", 1)[0].strip()
+            head = head.rstrip("\n") + "\n" + CODE_FENCE
+            tail = f"{CODE_FENCE}{language}\n" + tail.lstrip("\n")
+    return head.rstrip(), tail
+
+
+# Limits how many messages are sent or edited per channel: at most `edits` every `per` seconds,
+# which is roughly what Discord allows before it starts rate limiting the channel.
+# Shared by every reply being streamed, so answers streaming into one channel take turns.
+class EditBudget:
+    def __init__(self, edits: int = 5, per: float = 5.0, max_channels: int = 10000):
+        self.edits = edits
+        self.per = per
+        self.recent = TTLCache(maxsize=max_channels, ttl=per)  # channel id -> deque of recent edit times
+
+    # Wait until the channel has an edit left in the current window, then use it
+    async def acquire(self, channel_id):
+        while True:
+            now = time.monotonic()
+            recent = self.recent.get(channel_id) or deque()
+            while recent and now - recent[0] >= self.per:
+                recent.popleft()
+            if len(recent) < self.edits:
+                recent.append(now)
+                self.recent[channel_id] = recent
+                return
+            await asyncio.sleep(self.per - (now - recent[0]))
+
+
+# Shows a streamed answer by progressively editing Discord messages.
+# `append` only adds to a buffer, so reading the stream never waits on Discord; a
+# separate task shows the buffered text, at most once every `edit_interval` seconds
+# per message and within the channel's share of `budget`. Text that goes past the
+# 2000 character limit rolls over into a new message. `send` is a coroutine taking
+# the content and returning the sent message.
+class StreamingReply:
+    def __init__(self, send, prefix: str = "", edit_interval: float = 1.5,
+                 limit: int = DISCORD_MESSAGE_LIMIT, budget: EditBudget = None, channel_id=None):
+        self.send = send
+        self.prefix = prefix
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.budget = budget
+        self.channel_id = channel_id
+        self.text = ""  # everything received so far
+        self.messages = []
+        self._current = ""  # text belonging to the message being written
+        self._shown = None  # content that message currently displays, None until sent
+        self._finished_parts = 0
+        self._last_edit = 0.0
+        self._flusher = None
+        self._finishing = asyncio.Event()  # set by finish(), so the last edit doesn't wait out the interval
+
+    # The prefix goes on the first message only
+    def _content(self) -> str:
+        return (self.prefix if self._finished_parts == 0 else "") + self._current
+
+    async def _show(self, content: str):
+        if content == self._shown or not content.strip():
+            return
+        if self.budget is not None:
+            await self.budget.acquire(self.channel_id)
+        if self._shown is None:
+            self.messages.append(await self.send(content))
+        else:
+            await self.messages[-1].edit(content=content)
+        self._shown = content
+        self._last_edit = time.monotonic()
+
+    # Show the buffered text until the messages are caught up with it
+    async def _flush(self):
+        while True:
+            # Finish the current message and roll the rest over into a new one
+            if len(self._content()) > self.limit:
+                current = self._current
+                head, tail = split_message(self._content(), self.limit)
+                await self._show(head)
+                self._current = tail + self._current[len(current):]  # keep text appended while showing
+                self._shown = None
+                self._finished_parts += 1
+                continue
+
+            content = self._content()
+            if content == self._shown or not content.strip():
+                return
+            wait = self._last_edit + self.edit_interval - time.monotonic()
+            if wait > 0 and not self._finishing.is_set():
+                try:
+                    await asyncio.wait_for(self._finishing.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            await self._show(self._content())
+
+    def append(self, delta: str):
+        self.text += delta
+        self._current += delta
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    # Show whatever is left; `final_text` replaces the streamed text if it differs (e.g. an error)
+    async def finish(self, final_text: str = None):
+        if final_text is not None and final_text != self.text:
+            if final_text.startswith(self.text):
+                self.append(final_text[len(self.text):])
+            else:
+                self.append(("\n\n" if self.text else "") + final_text)
+        self._finishing.set()
+        if self._flusher is not None:
+            await self._flusher
+        await self._flush()
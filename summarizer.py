@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import re
+
+from cachetools import LRUCache
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+
+# Returned when no part of the lecture could be summarized
+SUMMARY_ERROR_MESSAGE = "Error in summarizing this lecture."
+
+
+# Rough token count (about four characters per token for English text)
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# Break a block that is too large on its own into sentences, then words if needed
+def _split_block(block: str, max_tokens: int, count_tokens=estimate_tokens) -> list:
+    pieces = []
+    for sentence in SENTENCE_PATTERN.split(block):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words = sentence.split()
+        step = max(1, max_tokens * 4 // 6)  # about six characters per word with the space
+        pieces.extend(" ".join(words[i:i + step]) for i in range(0, len(words), step))
+    return pieces
+
+
+# Split text on paragraph/slide/page boundaries into chunks of at most `max_tokens`,
+# counted with `count_tokens` (the length estimate unless a tokenizer is given)
+def split_into_chunks(text: str, max_tokens: int, count_tokens=estimate_tokens) -> list:
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for paragraph in PARAGRAPH_PATTERN.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        paragraph_tokens = count_tokens(paragraph)
+        if paragraph_tokens <= max_tokens:
+            blocks = [paragraph]
+        else:
+            blocks = _split_block(paragraph, max_tokens, count_tokens)
+        for block in blocks:
+            block_tokens = paragraph_tokens if block is paragraph else count_tokens(block)
+            if current and current_tokens + block_tokens > max_tokens:
+                chunks.append("\n\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(block)
+            current_tokens += block_tokens
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+# Map-reduce summarizer.
+# Chunks are summarized concurrently (bounded by `concurrency`), then the partial
+# summaries are merged in reduce passes until the result fits in `max_chars`.
+# `complete` is a coroutine taking a prompt and returning the model's text.
+class Summarizer:
+    def __init__(self, complete, chunk_tokens: int = 2000, concurrency: int = 4,
+                 max_chars: int = 1900, max_reduce_passes: int = 5, cache_size: int = 4096,
+                 count_tokens=estimate_tokens):
+        self.complete = complete
+        self.chunk_tokens = chunk_tokens
+        self.count_tokens = count_tokens
+        self.max_chars = max_chars
+        self.max_reduce_passes = max_reduce_passes
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.cache = LRUCache(maxsize=cache_size)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # Summarize one piece of text, reusing the cached result when the content is unchanged
+    async def _summarize_chunk(self, prompt: str, chunk: str):
+        key = hashlib.sha256(f"{prompt}\0{chunk}".encode('utf-8')).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        self.cache_misses += 1
+
+        async with self.semaphore:
+            try:
+                summary = await self.complete(f"{prompt}\n{chunk}")
+            except Exception as e:
+                print(f"Exception while summarizing chunk: {e}")
+                return None
+
+        self.cache[key] = summary
+        return summary
+
+    async def _map(self, prompt: str, chunks: list) -> list:
+        results = await asyncio.gather(*(self._summarize_chunk(prompt, chunk) for chunk in chunks))
+        return [summary for summary in results if summary]
+
+    async def summarize(self, text: str) -> str:
+        chunks = split_into_chunks(text, self.chunk_tokens, self.count_tokens)
+        print(f"Text split into {len(chunks)} chunks")
+        if not chunks:
+            return ""
+
+        summaries = await self._map("Summarize the following text:", chunks)
+        if not summaries:
+            return SUMMARY_ERROR_MESSAGE
+
+        # Reduce passes: merge groups of partial summaries until one short summary remains
+        reduce_pass = 0
+        while (len(summaries) > 1 or len(summaries[0]) > self.max_chars) and reduce_pass < self.max_reduce_passes:
+            reduce_pass += 1
+            combined = "\n\n".join(summaries)
+            groups = split_into_chunks(combined, self.chunk_tokens, self.count_tokens)
+            print(f"Reduce pass {reduce_pass}: {len(summaries)} summaries into {len(groups)} groups")
+            prompt = (
+                "Combine the following partial summaries of one lecture into a single summary"
+                + (f" of at most {self.max_chars} characters:" if len(groups) == 1 else ":")
+            )
+            reduced = await self._map(prompt, groups)
+            if not reduced:
+                break
+            # Stop if the model isn't making the summary any shorter
+            if len(reduced) == len(summaries) and sum(map(len, reduced)) >= sum(map(len, summaries)):
+                summaries = reduced
+                break
+            summaries = reduced
+
+        final_summary = "\n\n".join(summaries)
+        if len(final_summary) > self.max_chars:
+            final_summary = final_summary[:self.max_chars]
+        return final_summary